@@ -5,15 +5,20 @@
 # This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
 
 
+import os
 import logging
 
 from zim.plugins import PluginClass, extends, WindowExtension, ObjectExtension
 from zim.actions import action
 from zim.gui.widgets import LEFT_PANE, PANE_POSITIONS
 
-from .panelview import IconTagsPluginWidget
 from .iconutils import SEVERAL_ICONS, ICON_RE
-from .indexer import IconsIndexer
+from .indexer import IconsIndexer, init_plugin_tables
+from .rules import SEVERAL_ICONS_ERROR, SEVERAL_ICONS_PRIORITY, SEVERAL_ICONS_SPECIFIC
+from .stats import STATS
+from .stats import ENVIRON_KEY as STATS_ENVIRON_KEY
+from .profiling import PROFILER
+from .profiling import ENVIRON_KEY as PROFILE_ENVIRON_KEY
 
 
 
@@ -21,6 +26,12 @@ logger = logging.getLogger('zim.plugins.icontags')
 
 TAGSMANAGER_KEY ='<alt>2'
 
+SEVERAL_ICONS_CHOICES = (
+    (SEVERAL_ICONS_ERROR, _('Show a question mark')), # T: option value for pages with several icons
+    (SEVERAL_ICONS_PRIORITY, _('Icon of the rule with the best priority')), # T: option value for pages with several icons
+    (SEVERAL_ICONS_SPECIFIC, _('Icon of the most specific tag')), # T: option value for pages with several icons
+)
+
 
 class IconTagsPlugin(PluginClass):
 
@@ -40,6 +51,12 @@ class IconTagsPlugin(PluginClass):
   # T: option for plugin preferences
   ('show_lines', 'bool', _('Show lines in tree'), False), # T: preferences option
   ('enable_indexing', 'bool', _('Enable icon shortcodes'), False), # T: preferences option
+  ('several_icons', 'choice', _('Page with tags with different icons'), SEVERAL_ICONS_ERROR,
+   SEVERAL_ICONS_CHOICES), # T: preferences option
+  ('shortcode_first', 'bool', _('Icon shortcode has priority over tags'), True), # T: preferences option
+  ('inherit_icons', 'bool', _('Subpages inherit icons of parent pages'), False), # T: preferences option
+  ('collect_stats', 'bool', _('Collect timing statistics (for debugging)'), False), # T: preferences option
+  ('profile', 'bool', _('Profile operations and save traces (for debugging)'), False), # T: preferences option
   )
 
 
@@ -61,6 +78,7 @@ class MainWindowExtension(WindowExtension):
             <menu action='tools_menu'>
                 <placeholder name='plugin_items'>
                     <menuitem action='show_tagsmanager'/>
+                    <menuitem action='show_statistics'/>
                 </placeholder>
             </menu>
             <menu action='insert_menu'>
@@ -78,6 +96,7 @@ class MainWindowExtension(WindowExtension):
 
         self.indexer = None
         self._indexing_enabled = plugin.preferences['enable_indexing']
+        init_plugin_tables(self.index)
 
         if self._indexing_enabled:
             if self.index.get_property(IconsIndexer.PLUGIN_NAME) != IconsIndexer.PLUGIN_DB_FORMAT:
@@ -92,9 +111,15 @@ class MainWindowExtension(WindowExtension):
 
 
     def on_preferences_changed(self, preferences):
+        STATS.enabled = preferences['collect_stats'] or bool(os.environ.get(STATS_ENVIRON_KEY))
+        PROFILER.enabled = preferences['profile'] or bool(os.environ.get(PROFILE_ENVIRON_KEY))
+
         if self.widget:
+            self.widget.teardown()
             self.window.remove(self.widget)
 
+        # Widgets are imported here to make the import of the plugin fast.
+        from .panelview import IconTagsPluginWidget
         self.widget = IconTagsPluginWidget(self.window.ui.notebook.index,
                                            self.window.ui, self.uistate)
 
@@ -104,6 +129,9 @@ class MainWindowExtension(WindowExtension):
                 self._initialize_indexer(True)
             else:
                 self._destroy_indexer()
+        self.widget.set_icon_options(preferences['several_icons'],
+                                     preferences['shortcode_first'],
+                                     preferences['inherit_icons'])
         self.widget.setIndexer(preferences['enable_indexing'])
 
         self.window.add_tab(_('icIndex'), self.widget, preferences['pane'])
@@ -133,6 +161,7 @@ class MainWindowExtension(WindowExtension):
 
     def teardown(self):
         if self.widget:
+            self.widget.teardown()
             self.window.remove(self.widget)
             self.widget = None
 
@@ -146,6 +175,12 @@ class MainWindowExtension(WindowExtension):
         if self.widget:
             self.widget.show_tagsmanager(self.window)
 
+    @action(_('IconTags Statistics'))
+    def show_statistics(self):
+        '''Show counters and timings of the plugin.'''
+        from .panelview import StatisticsDialog
+        StatisticsDialog(self.window).run()
+
     @action(_('Insert Icon'))
     def insert_icon(self):
         '''
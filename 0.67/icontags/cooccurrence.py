@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import weakref
+import logging
+
+from zim.signals import ConnectorMixin
+
+from .tagsindex import PageTagsIndex
+from .tagpairs import TagPairs
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+
+class TagsCooccurrence(TagPairs, ConnectorMixin):
+    '''
+    L{TagPairs} for L{PageTagsIndex}, updated by its signals.
+    There is one shared object for a notebook index, use 'new_from_index'.
+    '''
+
+    _instances = weakref.WeakKeyDictionary() # index -> TagsCooccurrence
+
+    @classmethod
+    def new_from_index(cls, index):
+        '''Return the shared object for the index.'''
+        try:
+            return cls._instances[index]
+        except KeyError:
+            obj = cls(PageTagsIndex.new_from_index(index))
+            cls._instances[index] = obj
+            return obj
+
+    def __init__(self, tagsindex):
+        TagPairs.__init__(self, tagsindex)
+        self.connectto_all(tagsindex, ('tag-added', 'tag-removed'))
+
+    def on_tag_added(self, o, pagename, tag):
+        self.add_tag(pagename, tag)
+
+    def on_tag_removed(self, o, pagename, tag):
+        self.remove_tag(pagename, tag)
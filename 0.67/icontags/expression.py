@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+# The module doesn't import zim or gtk, so it is tested without them.
+
+import re
+
+
+
+# Parser for expressions, the tree is made of tuples:
+# ('tag', name), ('icon', name), ('not', a), ('and', a, b), ('or', a, b).
+
+_TOKEN_RE = re.compile(r'\(|\)|[^\s()]+', re.U)
+TAG_PREFIX = '@'
+ICON_PREFIX = 'icon:'
+
+
+def parse_expression(expression):
+    '''
+    Return the tree for the expression.
+    Raises C{ValueError} if the expression is not valid.
+    '''
+    tokens = _TOKEN_RE.findall(expression)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]].upper() if pos[0] < len(tokens) else None
+
+    def take():
+        pos[0] += 1
+        return tokens[pos[0] - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == 'OR':
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() not in (None, 'OR', ')'):
+            if peek() == 'AND':
+                take()
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        token = peek()
+        if token == 'NOT':
+            take()
+            return ('not', parse_not())
+        if token == '(':
+            take()
+            node = parse_or()
+            if peek() != ')':
+                raise ValueError(_('Missing ")" in the filter'))
+            take()
+            return node
+        if token is None:
+            raise ValueError(_('Unexpected end of the filter'))
+
+        word = take()
+        if word.startswith(TAG_PREFIX) and len(word) > len(TAG_PREFIX):
+            return ('tag', word[len(TAG_PREFIX):].lower())
+        if word.lower().startswith(ICON_PREFIX) and len(word) > len(ICON_PREFIX):
+            return ('icon', word[len(ICON_PREFIX):].lower())
+        raise ValueError(_('Unknown word in the filter: %s') % word)
+
+    node = parse_or()
+    if pos[0] < len(tokens):
+        raise ValueError(_('Unexpected word in the filter: %s') % tokens[pos[0]])
+    return node
+
+
+def compile_sql(node, params):
+    '''Return SQL query with column 'id' of matched pages.'''
+    kind = node[0]
+    if kind == 'tag':
+        params.append(node[1])
+        return '''
+            SELECT tagsources.source AS id FROM tagsources
+            JOIN tags ON tags.id = tagsources.tag
+            WHERE lower(tags.name) = ?'''
+    if kind == 'icon':
+        params.append(node[1])
+        return '''
+            SELECT pages.id AS id FROM iconresolved
+            JOIN pages ON pages.name = iconresolved.id
+            WHERE iconresolved.icon = ?'''
+    if kind == 'not':
+        return 'SELECT id FROM pages EXCEPT SELECT id FROM (%s)' \
+               % compile_sql(node[1], params)
+
+    operator = 'INTERSECT' if kind == 'and' else 'UNION'
+    left = compile_sql(node[1], params)
+    right = compile_sql(node[2], params)
+    return 'SELECT id FROM (%s) %s SELECT id FROM (%s)' % (left, operator, right)
+
+
+def match_expression(node, tags, icon):
+    '''Evaluate the tree for a page with given tags and icon.'''
+    kind = node[0]
+    if kind == 'tag':
+        return node[1] in tags
+    if kind == 'icon':
+        return node[1] == icon
+    if kind == 'not':
+        return not match_expression(node[1], tags, icon)
+    if kind == 'and':
+        return match_expression(node[1], tags, icon) and match_expression(node[2], tags, icon)
+    return match_expression(node[1], tags, icon) or match_expression(node[2], tags, icon)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import logging
+
+from zim.signals import SignalEmitter, ConnectorMixin
+
+from .expression import parse_expression, compile_sql, match_expression
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+
+class PagesFilter(SignalEmitter, ConnectorMixin):
+    '''
+    Base class to keep ids of pages which should be shown in the
+    filtered tree: matched pages and all their parents.
+    For every shown page it keeps the number of matched pages in its subtree,
+    so 'is_visible' is a dict lookup without SQL queries.
+    Subclasses define 'MATCHED_SQL' (query with ids of matched pages)
+    and call 'set_matched' when a page is changed.
+    '''
+
+    # define signals we want to use - (closure type, return type and arg types)
+    __signals__ = {'visibility-changed': (None, None, (object,))}
+
+    MATCHED_SQL = None
+
+    def __init__(self, index):
+        self.db = index._db # XXX
+        self._parents = {} # page id -> parent id
+        self._matched = set() # ids of matched pages
+        self._counts = {} # page id -> number of matched pages in the subtree
+        self.load()
+
+        self.connectto_all(index.update_iter.pages, (
+            'page-row-inserted', 'page-row-deleted'))
+
+    def load(self):
+        '''Load all pages and matched pages with one query.'''
+        self._parents, self._matched, self._counts = {}, set(), {}
+        sql, params = self.get_matched_sql()
+        for id, parent, matched in self.db.execute(
+                'SELECT id, parent, id IN (%s) FROM pages' % sql, params):
+            self._parents[id] = parent
+            if matched:
+                self._matched.add(id)
+
+        for id in self._matched:
+            self._add_chain(id)
+
+    def get_matched_sql(self):
+        '''Return SQL query with ids of matched pages and its parameters.'''
+        return self.MATCHED_SQL, ()
+
+    def is_visible(self, id):
+        '''Return True if the page should be shown.'''
+        return id in self._counts
+
+    def set_matched(self, id, matched):
+        '''Add or remove page from matched pages.'''
+        if matched and id not in self._matched:
+            self._matched.add(id)
+            self._emit_changed(self._add_chain(id), True)
+        elif not matched and id in self._matched:
+            self._matched.discard(id)
+            self._emit_changed(self._remove_chain(id), False)
+
+    def _chain(self, id):
+        '''Return ids of the page and all its parents.'''
+        chain = []
+        while id in self._parents:
+            chain.append(id)
+            id = self._parents[id]
+        return chain
+
+    def _add_chain(self, id):
+        '''Return list with ids of pages which became visible.'''
+        changed = []
+        for a in self._chain(id):
+            n = self._counts.get(a, 0)
+            if not n:
+                changed.append(a)
+            self._counts[a] = n + 1
+        return changed
+
+    def _remove_chain(self, id):
+        '''Return list with ids of pages which became invisible.'''
+        changed = []
+        for a in self._chain(id):
+            n = self._counts.get(a, 0) - 1
+            if n > 0:
+                self._counts[a] = n
+            else:
+                self._counts.pop(a, None)
+                changed.append(a)
+        return changed
+
+    def _emit_changed(self, ids, top_first):
+        if ids:
+            # Parents should be shown before their children and
+            # hidden after them.
+            if top_first:
+                ids.reverse()
+            self.emit('visibility-changed', ids)
+
+    def on_page_row_inserted(self, o, row):
+        self._parents[row['id']] = row['parent']
+
+    def on_page_row_deleted(self, o, row):
+        self.set_matched(row['id'], False)
+        self._parents.pop(row['id'], None)
+
+
+class TaggedPagesFilter(PagesFilter):
+    '''
+    Filter for pages with tags.
+    The number of tags for every page is updated by tag signals,
+    so updates don't need SQL queries too.
+    '''
+
+    def __init__(self, index):
+        self._n_tags = {} # page id -> number of tags
+        PagesFilter.__init__(self, index)
+
+        self.connectto_all(index.update_iter.tags, (
+            'tag-added-to-page', 'tag-removed-from-page'))
+
+    def load(self):
+        '''Load all pages with their tags counts.'''
+        self._parents, self._matched, self._counts, self._n_tags = {}, set(), {}, {}
+        for id, parent, n_tags in self.db.execute(
+                '''
+                SELECT pages.id, pages.parent, count(tagsources.source)
+                FROM pages
+                LEFT JOIN tagsources ON tagsources.source = pages.id
+                GROUP BY pages.id'''):
+            self._parents[id] = parent
+            if n_tags:
+                self._n_tags[id] = n_tags
+                self._matched.add(id)
+
+        for id in self._matched:
+            self._add_chain(id)
+
+    def on_page_row_deleted(self, o, row):
+        self._n_tags.pop(row['id'], None)
+        PagesFilter.on_page_row_deleted(self, o, row)
+
+    def on_tag_added_to_page(self, o, row, pagerow):
+        id = pagerow['id']
+        self._parents.setdefault(id, pagerow['parent'])
+        self._n_tags[id] = self._n_tags.get(id, 0) + 1
+        self.set_matched(id, True)
+
+    def on_tag_removed_from_page(self, o, row, pagerow):
+        id = pagerow['id']
+        n = self._n_tags.pop(id, 0) - 1
+        if n > 0:
+            self._n_tags[id] = n
+        self.set_matched(id, n > 0)
+
+
+class TagExpressionFilter(PagesFilter):
+    '''
+    Filter for pages by an expression with tags and icons, e.g.
+    "@project AND NOT @done", "@home OR icon:important".
+    Words are '@tag', 'icon:name', 'AND', 'OR', 'NOT' and brackets;
+    'AND' can be omitted. The expression is evaluated as one SQL query
+    for all pages and in python for pages changed later.
+    'icon:name' matches the icon shown in the tree, so with inherited
+    icons it also matches subpages which show the icon of a parent.
+    '''
+
+    def __init__(self, index, expression, resolver = None):
+        self.expression = expression
+        self.tree = parse_expression(expression)
+        PagesFilter.__init__(self, index)
+
+        self.connectto_all(index.update_iter.tags, (
+            ('tag-added-to-page', self.on_tag_changed),
+            ('tag-removed-from-page', self.on_tag_changed)))
+        if resolver:
+            self.connectto(resolver, 'icon-changed', self.on_icon_changed)
+
+    def get_matched_sql(self):
+        params = []
+        sql = compile_sql(self.tree, params)
+        return sql, params
+
+    def update_page(self, id):
+        '''Evaluate the expression for the page.'''
+        tags = set(a[0].lower() for a in self.db.execute(
+            '''
+            SELECT tags.name FROM tagsources
+            JOIN tags ON tags.id = tagsources.tag
+            WHERE tagsources.source = ?''', (id,)))
+        row = self.db.execute(
+            '''
+            SELECT iconresolved.icon FROM pages
+            JOIN iconresolved ON iconresolved.id = pages.name
+            WHERE pages.id = ?''', (id,)).fetchone()
+        icon = row[0] if row else None
+        self.set_matched(id, match_expression(self.tree, tags, icon))
+
+    def on_page_row_inserted(self, o, row):
+        PagesFilter.on_page_row_inserted(self, o, row)
+        self.update_page(row['id']) # e.g. new page matches "NOT @done"
+
+    def on_tag_changed(self, o, row, pagerow):
+        self._parents.setdefault(pagerow['id'], pagerow['parent'])
+        self.update_page(pagerow['id'])
+
+    def on_icon_changed(self, o, pagename):
+        row = self.db.execute(
+            'SELECT id FROM pages WHERE name = ?', (pagename,)).fetchone()
+        if row:
+            self.update_page(row[0])
@@ -11,6 +11,9 @@ import logging
 
 from zim.config import data_dir
 
+from .stats import timed
+from .profiling import profiled
+
 logger = logging.getLogger('zim.plugins.icontags')
 
 # Directory where additional icons are.
@@ -41,6 +44,22 @@ ICON_RE = re.compile(r'(?<=\{}).*?(?={})'.format(PREFIX, POSTFIX), re.U)
 def getIconMarkup(iconName):
     return '{0}{1}{2}{3}{0}'.format(STRONG_MARKUP, PREFIX, iconName, POSTFIX)
 
+# Only names of stock icons are taken from gtk here, the module
+# is imported by zim widgets before the plugin anyway.
+STOCK_ICONS = {
+    NO_IMAGE: gtk.STOCK_MISSING_IMAGE, # icon has no image
+    SEVERAL_ICONS: gtk.STOCK_DIALOG_QUESTION, # not clear what icon to use
+    # Icons below can be overwritten if there is a certain file in the 'ICONS_DIRECTORY'.
+    'apply': gtk.STOCK_APPLY, # additional GTK icon
+    #'info': gtk.STOCK_INFO, # additional GTK icon
+    FOLDER_ICON: gtk.STOCK_DIRECTORY, # for pages with children
+    FOLDER_TAGS_ICON: gtk.STOCK_DIRECTORY, # for pages with children and with tags
+    FILE_ICON: gtk.STOCK_FILE, # for ordinary pages
+    FILE_TAGS_ICON: gtk.STOCK_FILE # for ordinary pages with tags
+    }
+
+@profiled('load_icons')
+@timed('icons.load')
 def _load_icons():
     '''
     Load icons for the plugin from 'ICONS_DIRECTORY' folder (files with png format).
@@ -51,17 +70,7 @@ def _load_icons():
     # Use IconFactory to get the same size for all icons.
     factory = gtk.IconFactory()
     factory.add_default()
-    icons = {
-        NO_IMAGE: gtk.STOCK_MISSING_IMAGE, # icon has no image
-        SEVERAL_ICONS: gtk.STOCK_DIALOG_QUESTION, # not clear what icon to use
-        # Icons below can be overwritten if there is a certain file in the 'ICONS_DIRECTORY'.
-        'apply': gtk.STOCK_APPLY, # additional GTK icon
-        #'info': gtk.STOCK_INFO, # additional GTK icon
-        FOLDER_ICON: gtk.STOCK_DIRECTORY, # for pages with children
-        FOLDER_TAGS_ICON: gtk.STOCK_DIRECTORY, # for pages with children and with tags
-        FILE_ICON: gtk.STOCK_FILE, # for ordinary pages
-        FILE_TAGS_ICON: gtk.STOCK_FILE # for ordinary pages with tags
-        }
+    icons = STOCK_ICONS.copy()
 
     # Icons from directory.
     dir = data_dir(ICONS_DIRECTORY)
@@ -78,7 +87,9 @@ def _load_icons():
                 icons[name] = icon_name
                 counter += 1
             except:
-                logger.error('IconTags: Error while loading icons.')
+                # Name is already known by '_Icons', so it gets an image too.
+                logger.error('IconTags: Error while loading icon: %s', file)
+                icons[name] = icons[NO_IMAGE]
         logger.debug('IconTags: {} icons loaded from: {}'.format(counter, dir.path))
     else:
         logger.debug('''IconTags: Folder with icons doesn't exist.''')
@@ -101,7 +112,55 @@ class _RenderIcon:
             self.cache[icon] = result
             return result
 
-ICONS = _load_icons() # init and load all icons
+class _Icons(object):
+    '''
+    Dict-like object with loaded icons: {'name': 'icon'}.
+    Names of icons are taken from names of files on first use,
+    images are loaded with '_load_icons' only when an icon is requested,
+    so the plugin is imported and icons for pages are resolved
+    without loading images. Files which fail to load keep their names
+    with the 'NO_IMAGE' icon, so names and loaded icons are the same.
+    '''
+    def __init__(self):
+        self._names = None
+        self._icons = None
+
+    def _get_names(self):
+        if self._icons is not None:
+            return self._icons
+        if self._names is None:
+            names = set(STOCK_ICONS)
+            dir = data_dir(ICONS_DIRECTORY)
+            if dir:
+                names.update(file[:-4].lower() for file in dir.list('*.png'))
+            self._names = names
+        return self._names
+
+    def _get_icons(self):
+        if self._icons is None:
+            self._icons = _load_icons()
+            self._names = None
+        return self._icons
+
+    def __contains__(self, name):
+        return name in self._get_names()
+
+    def __iter__(self):
+        return iter(self._get_names())
+
+    def __len__(self):
+        return len(self._get_names())
+
+    def __getitem__(self, name):
+        return self._get_icons()[name]
+
+    def get(self, name, default = None):
+        return self._get_icons().get(name, default)
+
+    def iteritems(self):
+        return self._get_icons().iteritems()
+
+ICONS = _Icons() # icons are loaded on first use
 
 # Use it as: "render_icon(ICONS['tags'])" to return the rendered image.
 render_icon = _RenderIcon()
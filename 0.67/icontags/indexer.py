@@ -12,6 +12,11 @@ from zim.notebook.index.base import IndexerBase
 from zim.notebook.index.pages import PagesViewInternal
 
 from .iconutils import SEVERAL_ICONS, ICON_RE
+from .tagicons import TagIconsTable
+from .rules import IconRulesTable
+from .overrides import IconOverridesTable
+from .resolver import IconsResolver
+from .stats import timed
 
 
 
@@ -60,6 +65,7 @@ class IconsIndexer(IndexerBase):
             ('page-changed', 'page-row-deleted')))
 
 
+    @timed('indexer.page_changed')
     def on_page_changed(self, o, row, doc):
         # parse page
 
@@ -70,7 +76,7 @@ class IconsIndexer(IndexerBase):
             self._ind_insert(row['name'], new_icon)
 
     def on_page_row_deleted(self, o, row):
-        _ind_remove(self, row['name'])
+        self._ind_remove(row['name'])
 
     def _ind_insert(self, pagename, icon):
         '''Insert (update) new icon to the index.'''
@@ -97,6 +103,7 @@ class IconsIndexer(IndexerBase):
             )
             self.emit('iconlist-changed', pagename)
 
+    @timed('indexer.extract_icons')
     def _extract_icons(self, tokens):
         '''
         Search for icons in the text.
@@ -126,6 +133,23 @@ class IconsIndexer(IndexerBase):
                 new_icon = search[0].lower()
         return new_icon
 
+
+def init_plugin_tables(index):
+    '''
+    Create tables which are used also without indexing of shortcodes:
+    icons for tags, rules, icons for pages and resolved icons.
+    Like INIT_SCRIPT of L{IconsIndexer} the schema is set up once when
+    the plugin is loaded, so other classes only read and write rows and
+    their changes are committed with resolved icons (see L{IconsResolver}).
+    '''
+    db = index._db # XXX
+    if index.get_property(IconsResolver.FORMAT_PROPERTY) != IconsResolver.DB_FORMAT:
+        # Table is created again in case its format is changed.
+        db.executescript(IconsResolver.TEARDOWN_SCRIPT)
+    db.executescript(''.join(a.INIT_SCRIPT for a in (
+        TagIconsTable, IconRulesTable, IconOverridesTable, IconsResolver)))
+    index.set_property(IconsResolver.FORMAT_PROPERTY, IconsResolver.DB_FORMAT)
+
 from zim.notebook.index.base import IndexView
 
 
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import gtk
+import logging
+
+from collections import OrderedDict
+
+from .stats import STATS, timer
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+WINDOW_SIZE = 200 # number of rows fetched with one query
+MAX_WINDOWS = 10 # number of fetched windows kept in memory
+
+
+class LazyListModel(gtk.GenericTreeModel):
+    '''
+    List model which doesn't keep all rows in memory. Rows are fetched
+    from an SQL query in windows with "ORDER BY ... LIMIT ? OFFSET ?"
+    when the view asks for them, so only rows around the visible range
+    are loaded. Rows are sorted by SQL too, use 'set_order' instead of
+    a sortable model.
+
+    'source' is an SQL query with named columns, 'columns' are names of
+    columns to fetch, 'convert' turns a fetched row into a tuple of
+    values for the model columns of 'column_types' and 'key' is
+    the column with unique values to find rows.
+    '''
+
+    def __init__(self, db, source, params, columns, column_types, convert, key, order):
+        gtk.GenericTreeModel.__init__(self)
+        self.set_property('leak-references', False) # rowrefs are just numbers
+        self.db = db
+        self.source = source
+        self.params = tuple(params)
+        self.columns = columns
+        self.column_types = column_types
+        self.convert = convert
+        self.key = key
+        self.order = []
+        self._windows = OrderedDict() # number of window -> list of rows
+        self._n_rows = self._count()
+        self._set_order(order)
+
+    def _count(self):
+        return self.db.execute('SELECT count(*) FROM (%s)' % self.source,
+                               self.params).fetchone()[0]
+
+    def _set_order(self, order):
+        '''
+        Set list of tuples (column, descending).
+        Rows are always sorted by the key at the end to have a stable order.
+        '''
+        self.order = []
+        for column, desc in order:
+            self.order.append((column, desc))
+            if column == self.key:
+                break
+        else:
+            self.order.append((self.key, False))
+        self._windows.clear()
+
+    def set_order(self, order):
+        '''
+        Sort rows by SQL. The new order of rows is not known without
+        fetching all of them, so views should set the model again.
+        '''
+        self._set_order(order)
+
+    def _get_window(self, n):
+        try:
+            rows = self._windows.pop(n)
+        except KeyError:
+            start = timer() if STATS.enabled else None
+            order = ', '.join('%s %s' % (a, 'DESC' if desc else 'ASC') for a, desc in self.order)
+            rows = [self.convert(row) for row in self.db.execute(
+                'SELECT %s FROM (%s) ORDER BY %s LIMIT ? OFFSET ?'
+                % (', '.join(self.columns), self.source, order),
+                self.params + (WINDOW_SIZE, n * WINDOW_SIZE))]
+            if len(self._windows) >= MAX_WINDOWS:
+                self._windows.popitem(last = False)
+            if start is not None:
+                STATS.add_time('listmodel.fetch_window', timer() - start)
+        self._windows[n] = rows # the last used window is the last item
+        return rows
+
+    def find(self, key):
+        '''Return position of the row with the key or None.'''
+        columns = [a for a, desc in self.order]
+        row = self.db.execute(
+            'SELECT %s FROM (%s) WHERE %s = ?' % (', '.join(columns), self.source, self.key),
+            self.params + (key,)).fetchone()
+        if not row:
+            return None
+
+        # Count rows which are before the row in the current order.
+        conditions, params = [], []
+        for i, (column, desc) in enumerate(self.order):
+            parts = ['%s = ?' % a for a in columns[:i]]
+            parts.append('%s %s ?' % (column, '>' if desc else '<'))
+            conditions.append('(%s)' % ' AND '.join(parts))
+            params.extend(row[:i + 1])
+        return self.db.execute(
+            'SELECT count(*) FROM (%s) WHERE %s' % (self.source, ' OR '.join(conditions)),
+            self.params + tuple(params)).fetchone()[0]
+
+    def get_iter_for_key(self, key):
+        position = self.find(key)
+        return self.get_iter((position,)) if position is not None else None
+
+    def copy(self):
+        '''
+        Return a new model for the same query with the current order.
+        Positions of changed rows are not known without fetching
+        all of them, so views set a new model after changes in the source.
+        '''
+        return LazyListModel(self.db, self.source, self.params, self.columns,
+                             self.column_types, self.convert, self.key, self.order)
+
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY
+
+    def on_get_n_columns(self):
+        return len(self.column_types)
+
+    def on_get_column_type(self, index):
+        return self.column_types[index]
+
+    def on_get_iter(self, path):
+        n = path[0]
+        return n if n < self._n_rows else None
+
+    def on_get_path(self, rowref):
+        return (rowref,)
+
+    def on_get_value(self, rowref, column):
+        rows = self._get_window(rowref // WINDOW_SIZE)
+        i = rowref % WINDOW_SIZE
+        if i < len(rows):
+            return rows[i][column]
+        # Source is changed, but the new model is not set yet.
+        return 0 if self.column_types[column] is int else None
+
+    def on_iter_next(self, rowref):
+        n = rowref + 1
+        return n if n < self._n_rows else None
+
+    def on_iter_children(self, rowref):
+        if rowref is None and self._n_rows:
+            return 0
+        return None
+
+    def on_iter_has_child(self, rowref):
+        return False
+
+    def on_iter_n_children(self, rowref):
+        return self._n_rows if rowref is None else 0
+
+    def on_iter_nth_child(self, rowref, n):
+        if rowref is None and n < self._n_rows:
+            return n
+        return None
+
+    def on_iter_parent(self, rowref):
+        return None
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+# The module doesn't import zim or gtk, so it is tested without them.
+
+import re
+
+
+
+GLOB_CHARS = '*?['
+MAX_GROUPS = 90 # python 2 'sre' supports only 100 groups in one regex
+
+
+def _glob_to_regex(pattern):
+    '''
+    Return regex for the glob pattern without the end of string marker.
+    Like in 'fnmatch' "[seq]" and "[!seq]" match characters, but "*" and "?"
+    don't match ":", so they stay in one level of page names, "**" matches
+    any characters including ":".
+    '''
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            if pattern[i:i + 1] == '*':
+                i += 1
+                parts.append('.*')
+            else:
+                parts.append('[^:]*')
+        elif c == '?':
+            parts.append('[^:]')
+        elif c == '[':
+            j = i
+            if pattern[j:j + 1] == '!':
+                j += 1
+            if pattern[j:j + 1] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                parts.append('\\[')
+            else:
+                chars = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if chars[0] == '!':
+                    chars = '^' + chars[1:]
+                elif chars[0] == '^':
+                    chars = '\\' + chars
+                parts.append('[%s]' % chars)
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts)
+
+
+class TagRulesMatcher(object):
+    '''
+    This class chooses icons for tags by rules with patterns:
+    exact names ("project"), prefixes ("proj-*") and globs ("*-2017", "t?do").
+    Prefixes are kept in a trie, so they are checked in one walk over
+    characters of the tag, all globs are compiled into one regex.
+    Results are memoized per tag, so the number of rules doesn't
+    matter for tags which were already resolved.
+    If several rules match a tag the rule with lower priority value
+    is used, then the more specific pattern (with more literal
+    characters), then the first one.
+    '''
+
+    def __init__(self, rules):
+        self._exact = {} # tag -> (rank, icon)
+        self._trie = {} # char -> node, key None in a node keeps (rank, icon)
+        self._globs = [] # list of (compiled regex, list of (rank, icon) for groups)
+        self._memo = {} # tag -> (rank, icon) or None
+
+        globs = []
+        for order, (pattern, icon, priority) in enumerate(rules):
+            specificity = len(pattern) - sum(pattern.count(c) for c in GLOB_CHARS)
+            rank = (priority, -specificity, order)
+            body = pattern[:-1] if pattern.endswith('*') else None
+            if body is not None and not any(c in body for c in GLOB_CHARS):
+                node = self._trie
+                for c in body:
+                    node = node.setdefault(c, {})
+                node[None] = min(node.get(None, (rank, icon)), (rank, icon))
+            elif any(c in pattern for c in GLOB_CHARS):
+                globs.append((rank, icon, pattern))
+            else:
+                self._exact[pattern] = min(self._exact.get(pattern, (rank, icon)), (rank, icon))
+
+        # Alternatives are sorted by rank, so the first matched group is the best.
+        globs.sort()
+        for i in range(0, len(globs), MAX_GROUPS):
+            chunk = globs[i:i + MAX_GROUPS]
+            regex = '(?:%s)\\Z' % '|'.join('(%s)' % _glob_to_regex(a[2]) for a in chunk)
+            self._globs.append((re.compile(regex, re.S | re.U), [a[:2] for a in chunk]))
+
+    def match(self, tag):
+        '''Return icon for the tag or None.'''
+        best = self.match_rank(tag)
+        return best[1] if best else None
+
+    def match_rank(self, tag):
+        '''
+        Return tuple ((priority, -specificity, order), icon)
+        for the best rule or None.
+        '''
+        try:
+            return self._memo[tag]
+        except KeyError:
+            pass
+
+        best = self._exact.get(tag)
+        node = self._trie
+        if None in node:
+            best = min(best or node[None], node[None])
+        for c in tag:
+            node = node.get(c)
+            if node is None:
+                break
+            if None in node:
+                best = min(best or node[None], node[None])
+
+        for regex, ranks in self._globs:
+            m = regex.match(tag)
+            if m:
+                best = min(best or ranks[m.lastindex - 1], ranks[m.lastindex - 1])
+                break # next chunks have only worse ranks
+
+        self._memo[tag] = best
+        return best
+
+
+class PageNameRulesMatcher(object):
+    '''
+    This class chooses icons for pages by glob patterns for page names,
+    e.g. "Journal:*:*:*" or "**:Meeting*". "*" matches one level
+    of the name, "**" matches any number of levels. All patterns are
+    compiled into one regex with a named group for every rule, so a name
+    is checked with one match and the name of the matched group gives
+    the rule. Results are not memoized, one match is as cheap as a lookup
+    and the memo would keep every page of the notebook.
+    Rules are ordered like in L{TagRulesMatcher}: by priority,
+    then by the number of literal characters, then by order.
+    '''
+
+    def __init__(self, rules):
+        self._regexes = [] # list of (compiled regex, list of icons for groups)
+
+        ranked = []
+        for order, (pattern, icon, priority) in enumerate(rules):
+            specificity = len(pattern) - sum(pattern.count(c) for c in GLOB_CHARS)
+            ranked.append(((priority, -specificity, order), pattern, icon))
+        ranked.sort()
+
+        # Alternatives are sorted by rank, so the first matched group is the best.
+        for i in range(0, len(ranked), MAX_GROUPS):
+            chunk = ranked[i:i + MAX_GROUPS]
+            regex = '(?:%s)\\Z' % '|'.join('(?P<r%i>%s)' % (n, _glob_to_regex(a[1]))
+                                           for n, a in enumerate(chunk))
+            self._regexes.append((re.compile(regex, re.S | re.U), [a[2] for a in chunk]))
+
+    def match(self, pagename):
+        '''Return icon for the page or None.'''
+        for regex, icons in self._regexes:
+            m = regex.match(pagename)
+            if m:
+                return icons[int(m.lastgroup[1:])] # next chunks have only worse ranks
+        return None
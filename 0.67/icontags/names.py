@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+# The module doesn't import zim or gtk, so it is tested without them.
+
+import bisect
+
+
+
+TAG_PREFIX = '@' # qualifier for tags, e.g. '@project'
+ICON_PREFIX = 'icon:' # qualifier for icons, e.g. 'icon:calendar'
+MAX_RESULTS = 500 # stop searching after this number of matches
+
+
+class PageNames(object):
+    '''
+    This class keeps names of all pages in memory to search
+    pages by prefix or substring of their names.
+    Names are loaded with one query and updated with 'add_name'
+    and 'remove_name'.
+    For the substring search all names are joined in one string,
+    so it is searched with 'str.find' instead of a loop in python.
+    Names are searched without case, names which differ only
+    in case share one key.
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        self._keys = [] # sorted lowercase names
+        self._names = {} # lowercase name -> sorted list of names
+        self._text = None # all keys joined by '\n', built on demand
+        self._offsets = None # positions of keys in 'self._text'
+        self.load()
+
+    def load(self):
+        '''Load names of all pages.'''
+        self._names = {}
+        for (name,) in self.db.execute('SELECT name FROM pages ORDER BY name'):
+            if name: # not root
+                self._names.setdefault(name.lower(), []).append(name)
+        self._keys = sorted(self._names)
+        self._text = None
+
+    def add_name(self, name):
+        key = name.lower()
+        names = self._names.get(key)
+        if names is None:
+            self._names[key] = [name]
+            bisect.insort(self._keys, key)
+            self._text = None
+        elif name not in names:
+            bisect.insort(names, name)
+
+    def remove_name(self, name):
+        key = name.lower()
+        names = self._names.get(key)
+        if not names or name not in names:
+            return
+        names.remove(name)
+        if not names:
+            del self._names[key]
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+            self._text = None
+
+    def _build_text(self):
+        self._offsets = []
+        pos = 0
+        for key in self._keys:
+            self._offsets.append(pos)
+            pos += len(key) + 1
+        self._text = '\n'.join(self._keys)
+
+    def iter_prefix(self, prefix):
+        '''Yield keys which start with 'prefix' in sorted order.'''
+        i = bisect.bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            yield self._keys[i]
+            i += 1
+
+    def iter_substring(self, text):
+        '''Yield keys which contain 'text' in sorted order.'''
+        if self._text is None:
+            self._build_text()
+
+        pos = self._text.find(text)
+        while pos >= 0:
+            i = bisect.bisect_right(self._offsets, pos) - 1
+            yield self._keys[i]
+            # Continue from the next key.
+            end = self._offsets[i + 1] if i + 1 < len(self._offsets) else len(self._text)
+            pos = self._text.find(text, end)
+
+    def search(self, query):
+        '''
+        Return list of page names for the query.
+        The query contains words to search in page names and optional
+        qualifiers: '@tag' for pages with a tag and 'icon:name'
+        for pages which show an icon (also an inherited one).
+        Pages which names start with
+        the first word are returned first.
+        '''
+        words, tags, icons = [], [], []
+        for word in query.lower().split():
+            if word.startswith(TAG_PREFIX) and len(word) > 1:
+                tags.append(word[len(TAG_PREFIX):])
+            elif word.startswith(ICON_PREFIX) and len(word) > len(ICON_PREFIX):
+                icons.append(word[len(ICON_PREFIX):])
+            else:
+                words.append(word)
+
+        allowed = None # set of keys or None if not restricted
+        for tag in tags:
+            allowed = self._intersect(allowed, self.db.execute(
+                '''
+                SELECT pages.name FROM tagsources
+                JOIN tags ON tags.id = tagsources.tag
+                JOIN pages ON pages.id = tagsources.source
+                WHERE lower(tags.name) = ?''', (tag,)))
+        for icon in icons:
+            allowed = self._intersect(allowed, self.db.execute(
+                'SELECT id FROM iconresolved WHERE icon = ?', (icon,)))
+
+        if not (words or tags or icons):
+            return []
+        if not words:
+            results = []
+            for key in sorted(allowed):
+                results.extend(self._names.get(key, ()))
+                if len(results) >= MAX_RESULTS:
+                    break
+            return results[:MAX_RESULTS]
+
+        def match(key):
+            return (allowed is None or key in allowed) and \
+                   all(word in key for word in words[1:])
+
+        results, seen = [], set()
+        # Prefix matches for the full name and for the basename first.
+        first = words[0]
+        for source in (self.iter_prefix(first), self.iter_substring(':' + first),
+                       self.iter_substring(first)):
+            for key in source:
+                if key not in seen and match(key):
+                    seen.add(key)
+                    results.extend(self._names[key])
+                    if len(results) >= MAX_RESULTS:
+                        return results[:MAX_RESULTS]
+        return results
+
+    def _intersect(self, allowed, rows):
+        keys = set(a[0].lower() for a in rows)
+        return keys if allowed is None else (allowed & keys)
+
+
+def subtree_ranges(pagename, excluded):
+    '''
+    Return ranges of names of all subpages of the page without pages
+    from 'excluded' and their subpages. Ranges are tuples
+    (start, start is included, end), the end is not included.
+    Subpages of "name" are "name:" <= id < "name;", but names like
+    "name2", "name-1" or "name 2" are sorted between "name" and "name:",
+    so every excluded page is skipped alone and with the range
+    of its subpages, not with all names from "name" to "name;".
+    '''
+    skipped = [] # tuples (first skipped name, start of the next range, included)
+    for name in excluded:
+        skipped.append((name, name, False))
+        skipped.append((name + ':', name + ';', True))
+    skipped.sort()
+
+    ranges = []
+    start, included = pagename + ':', True
+    for first, next_start, next_included in skipped:
+        if first < start or (first == start and not included):
+            continue # in the subtree of a skipped page
+        ranges.append((start, included, first))
+        start, included = next_start, next_included
+    ranges.append((start, included, pagename + ';'))
+    return ranges
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import logging
+
+from .iconutils import ICONS
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+# Table contains page.name and the name of the icon set for the page
+# from the icIndex popup menu. Rows are not removed with pages,
+# so icons are kept while pages are deleted and inserted again by reindexing.
+
+class IconOverridesTable(object):
+    '''
+    This class keeps icons set for pages without changing their text.
+    Like L{TagIconsTable} icons are imported once from the plugin
+    uistate ('Icons for Pages') and all changes are copied back to it,
+    so they survive the rebuild of the index.
+    '''
+    PROPERTY_NAME = 'icontags-overrides'
+    DB_FORMAT = '0.1'
+    UISTATE_KEY = 'Icons for Pages'
+    INIT_SCRIPT = '''
+        CREATE TABLE IF NOT EXISTS iconoverrides (
+        id TEXT PRIMARY KEY,
+        icon TEXT
+        );
+        '''
+
+    TEARDOWN_SCRIPT = '''
+        DROP TABLE IF EXISTS "iconoverrides";
+        DELETE FROM zim_index WHERE key = %r;
+        ''' % PROPERTY_NAME
+
+    def __init__(self, index, uistate):
+        self.index = index
+        self.db = index._db # XXX
+        self.uistate = uistate
+        self.uistate.setdefault(self.UISTATE_KEY, {}) # pagename -> icon
+
+        # Table is created by 'init_plugin_tables'.
+        if self.index.get_property(self.PROPERTY_NAME) != self.DB_FORMAT:
+            self.db.execute('DELETE FROM iconoverrides')
+            self.db.executemany(
+                'INSERT OR REPLACE INTO iconoverrides (id, icon) VALUES (?, ?)',
+                ((a, b) for a, b in self.uistate[self.UISTATE_KEY].iteritems()
+                 if b in ICONS))
+            self.index.set_property(self.PROPERTY_NAME, self.DB_FORMAT)
+            logger.debug('IconTags: Icons for pages are imported from uistate')
+
+    def get_icon(self, pagename):
+        '''Return icon set for the page or None.'''
+        row = self.db.execute(
+            'SELECT icon FROM iconoverrides WHERE id = ?', (pagename,)).fetchone()
+        return row[0] if row else None
+
+    def get_mapping(self):
+        '''Return dict with icons for pages.'''
+        return dict(self.db.execute('SELECT id, icon FROM iconoverrides'))
+
+    def set_icon(self, pagename, icon):
+        '''
+        Set the icon for the page or remove it if icon is None.
+        Changes are committed by L{IconsResolver} with resolved icons.
+        '''
+        mapping = dict(self.uistate[self.UISTATE_KEY])
+        if icon:
+            self.db.execute(
+                'INSERT OR REPLACE INTO iconoverrides (id, icon) VALUES (?, ?)',
+                (pagename, icon))
+            mapping[pagename] = icon
+        else:
+            self.db.execute('DELETE FROM iconoverrides WHERE id = ?', (pagename,))
+            mapping.pop(pagename, None)
+        self.uistate[self.UISTATE_KEY] = mapping
@@ -10,69 +10,136 @@ import gtk
 import pango
 import logging
 
+from collections import OrderedDict
+
 from zim.gui.pageindex import PageTreeStore, PageTreeView, \
     NAME_COL, TIP_COL, STYLE_COL, \
     FGCOLOR_COL, WEIGHT_COL, N_CHILD_COL
 from zim.notebook import Path
-from zim.gui.widgets import encode_markup_text, BrowserTreeView
+from zim.gui.widgets import encode_markup_text, BrowserTreeView, \
+    Dialog, ErrorDialog, ScrolledWindow
 from zim.signals import ConnectorMixin
 from zim.gui.clipboard import INTERNAL_PAGELIST_TARGET
-from zim.notebook.index.tags import TagsView
 from zim.notebook.index.pages import PageIndexRecord
 from zim.notebook.index.pages import IndexNotFoundError
 
-from .tagsmanager import TagsManagerDialog
+from .tagsmanager import TagsManagerDialog, IconRulesDialog
 from .iconutils import render_icon, getIconMarkup
-from .iconutils import NO_IMAGE, SEVERAL_ICONS, FOLDER_ICON, \
-    FOLDER_TAGS_ICON, FILE_ICON, FILE_TAGS_ICON, RESERVED_ICON_NAMES, ICONS
+from .iconutils import NO_IMAGE, FOLDER_ICON, FILE_ICON, \
+    RESERVED_ICON_NAMES, ICONS
 from .indexer import IconsView
+from .resolver import IconsResolver
+from .tagicons import TagIconsTable
+from .overrides import IconOverridesTable
+from .rules import IconRulesTable, SEVERAL_ICONS_ERROR
+from .filters import TaggedPagesFilter, TagExpressionFilter, parse_expression
+from .worker import RowValuesWorker
+from .search import PageNamesIndex, TAG_PREFIX
+from .stats import STATS, timed, timer
+from .profiling import PROFILER, profiled
 
 logger = logging.getLogger('zim.plugins.icontags')
 
 
 
 ICON_COL = 8 #: Column with icons
+CACHE_SIZE = 1000 # max number of pages with cached values
+MAX_CHANGED_PAGES = 1000 # more pages changed before the first show are resolved by rebuild
 
 
-class IconTagsPluginWidget(ConnectorMixin, gtk.ScrolledWindow):
+class IconTagsPluginWidget(ConnectorMixin, gtk.VBox):
     '''Main Widget.'''
 
     def __init__(self, index, ui, uistate): # XXX
-        gtk.ScrolledWindow.__init__(self)
-        self.set_policy(gtk.POLICY_NEVER, gtk.POLICY_AUTOMATIC)
-        self.set_shadow_type(gtk.SHADOW_IN)
+        gtk.VBox.__init__(self)
+        self.scrolled_window = gtk.ScrolledWindow()
+        self.scrolled_window.set_policy(gtk.POLICY_NEVER, gtk.POLICY_AUTOMATIC)
+        self.scrolled_window.set_shadow_type(gtk.SHADOW_IN)
 
         self.ui = ui
         self.index = index
         self.iconsindex = None
+        self.resolver = None # created on first use, see '_get_resolver'
+        self._use_shortcodes = None # set by 'setIndexer'
+        self._changed_pages = set() # pages changed before the resolver is created
+        self._resolved_signature = None
+
+        # Compute values for rows in the background if the index is in a file,
+        # the worker is started with the first model.
+        dbpath = getattr(index, 'dbpath', None) # XXX
+        self._dbpath = dbpath if dbpath and dbpath != ':memory:' else None
+        self.worker = None
 
         self.treeview = IconsTreeView(ui) # XXX
-        self.add(self.treeview)
+        self.scrolled_window.add(self.treeview)
+
+        # Search entry is shown when typing in the treeview.
+        self.search_entry = gtk.Entry()
+        self.search_entry.set_no_show_all(True)
+        self.search_entry.connect('changed', lambda o: self.search())
+        self.search_entry.connect('activate', self.on_search_activate)
+        self.search_entry.connect('key-press-event', self.on_search_key_press)
+        self.search_entry.connect('focus-out-event', lambda *a: self.stop_search())
+        self.pack_start(self.search_entry, False)
+        self.pack_start(self.scrolled_window, True)
+        self._pagenames = None # index for the search, loaded on first use
+        self._search_results = []
+        self._search_pos = 0
 
         self.uistate = uistate
         self.uistate.setdefault('Open pages', 'default') # values 'default, collapse, disable'
         self.treeview.change_view(self.uistate['Open pages'])
 
         self.uistate.setdefault('show tags', False) # show tags with names
-        self.uistate.setdefault('Icons for Tags', {}) # set icons for available tags
-
-        # All available tags in the notebook.
-        tags = [a.name for a in TagsView.new_from_index(index).list_all_tags()]
 
-        # Check that tags and icons are still available.
-        self.uistate['Icons for Tags'] = dict(
-            [(tag, icon) for (tag, icon) in self.uistate['Icons for Tags'].iteritems()
-             if ( (tag in tags) and (icon in ICONS) )] )
+        # Icons for tags are kept in the index, the table checks
+        # that tags and icons are still available. Tables are
+        # created with the resolver.
+        self.tagicons = None
+        self.rulestable = None
+        self.overrides = None
+        self._several_icons = SEVERAL_ICONS_ERROR
+        self._shortcode_first = True
+        self._inherit_icons = False
+        self._profiling_update = False # True if the index update is profiled
+        self._index_updating = False
 
         self._show_tagged = False # if True - show only pages with tags
+        self._tagged_pages = None # loaded on first use
+        self.uistate.setdefault('pages filter', '') # expression to filter pages
+        self._expression_filter = None # filter for 'pages filter'
 
+        # Model is loaded when the panel is shown for the first time.
+        self._shown = False
+        self.connectto(self, 'map', self.on_map)
         self.connectto(self.treeview, 'populate-popup', self.on_populate_popup)
+        self.connectto(self.treeview, 'key-press-event', self.on_treeview_key_press)
+        # The model stays connected during index updates, rows are
+        # inserted, deleted and changed by signals of the pages indexer.
         self.connectto_all(ui, ( # XXX
             'open-page',
-            ('start-index-update', lambda o: self.disconnect_model()),
-            ('end-index-update', lambda o: self.reload_model()), ))
-
-        self.reload_model()
+            ('start-index-update', lambda o: self._set_index_updating(True)),
+            ('end-index-update', lambda o: self._set_index_updating(False)), ))
+        self.connectto_all(index.update_iter.pages, (
+            ('page-row-inserted', lambda o, row: self._on_page_changed(row['name'])),
+            ('page-row-changed', lambda o, row, *a: self._on_page_changed(row['name'])),
+            ('page-row-deleted', lambda o, row: self._on_page_changed(row['name'])), ))
+        self.connectto_all(index.update_iter.tags, (
+            ('tag-added-to-page', lambda o, row, pagerow: self._on_page_changed(pagerow['name'])),
+            ('tag-removed-from-page', lambda o, row, pagerow: self._on_page_changed(pagerow['name'])), ))
+
+        # Model is loaded in 'setIndexer', when it is known
+        # whether icon shortcodes are used.
+
+    def set_icon_options(self, several_icons, shortcode_first, inherit):
+        '''
+        Set how to choose an icon for pages with several icons and
+        whether subpages inherit icons, it is used by the resolver
+        created in '_get_resolver'.
+        '''
+        self._several_icons = several_icons
+        self._shortcode_first = shortcode_first
+        self._inherit_icons = inherit
 
     def setIndexer(self, isset):
         """This function is called from outside to set value."""
@@ -80,8 +147,144 @@ class IconTagsPluginWidget(ConnectorMixin, gtk.ScrolledWindow):
             self.iconsindex = IconsView.new_from_index(self.index)
         else:
             self.iconsindex = None
+
+        self._use_shortcodes = isset
+        if self.resolver:
+            # Resolver is created again with new settings.
+            self.resolver.commit()
+            self.resolver.disconnect_all()
+            self.resolver = None
+        if self._expression_filter:
+            # Filter is connected to the resolver.
+            self._expression_filter.disconnect_all()
+            self._expression_filter = None
         self.reload_model()
 
+    def _get_resolver(self):
+        '''
+        Return the resolver, create it and tables of settings on first use,
+        so nothing is loaded until the panel or the Tags Manager is shown.
+        '''
+        if self.resolver:
+            return self.resolver
+
+        if not self.tagicons:
+            self.tagicons = TagIconsTable(self.index, self.uistate)
+            self.rulestable = IconRulesTable(self.index, self.uistate)
+            self.overrides = IconOverridesTable(self.index, self.uistate)
+
+        changed, self._changed_pages = self._changed_pages, set()
+        update = changed and len(changed) <= MAX_CHANGED_PAGES and self._resolved_signature
+        if update:
+            # Only changed pages are resolved, otherwise the table is rebuilt.
+            self.index.set_property(IconsResolver.PROPERTY_NAME, self._resolved_signature)
+        self.resolver = IconsResolver(self.index, self.tagicons, self.rulestable,
+                                      self.overrides, self._use_shortcodes,
+                                      self._several_icons, self._shortcode_first,
+                                      self._inherit_icons)
+        self.resolver.set_index_updating(self._index_updating)
+        if update:
+            self.resolver.update_pages(changed)
+        return self.resolver
+
+    def _on_page_changed(self, pagename):
+        '''
+        Remember pages changed before the resolver is created. The table
+        with resolved icons is marked as outdated together with the index,
+        so it is rebuilt if the widget is closed before the resolver is created.
+        '''
+        if self.resolver:
+            return # the resolver is connected to the index
+        if not self._changed_pages:
+            self._resolved_signature = self.index.get_property(IconsResolver.PROPERTY_NAME)
+            self.index.set_property(IconsResolver.PROPERTY_NAME, '')
+        self._changed_pages.add(pagename)
+
+    def _set_index_updating(self, updating):
+        # The whole index update is one operation for the profiler.
+        if updating:
+            self._profiling_update = PROFILER.start('index_update')
+        elif self._profiling_update:
+            self._profiling_update = False
+            PROFILER.stop()
+
+        self._index_updating = updating
+        if self.resolver:
+            self.resolver.set_index_updating(updating)
+        model = self.treeview.get_base_model()
+        if model:
+            model.set_index_updating(updating)
+
+    def teardown(self):
+        '''Disconnect the widget from the index and the ui.'''
+        self.disconnect_all()
+        self.treeview.disconnect_index()
+        if self._profiling_update:
+            self._profiling_update = False
+            PROFILER.stop()
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
+        if self.resolver:
+            self.resolver.commit()
+            self.resolver.disconnect_all()
+            self.resolver = None
+        if self._tagged_pages:
+            self._tagged_pages.disconnect_all()
+            self._tagged_pages = None
+        if self._expression_filter:
+            self._expression_filter.disconnect_all()
+            self._expression_filter = None
+        if self._pagenames:
+            self._pagenames.disconnect_all()
+            self._pagenames = None
+
+    def _get_tagged_pages(self):
+        '''Return filter with tagged pages, load it if necessary.'''
+        if not self._tagged_pages:
+            self._tagged_pages = TaggedPagesFilter(self.index)
+            self.connectto(self._tagged_pages, 'visibility-changed',
+                           self.on_visibility_changed)
+        return self._tagged_pages
+
+    def _get_pages_filter(self):
+        '''
+        Return the filter to use in the tree: filter by expression,
+        filter for pages with tags or None to show all pages.
+        The expression overrides 'Show only Pages with Tags',
+        the menu item is disabled while the expression is set.
+        '''
+        expression = self.uistate['pages filter']
+        if expression:
+            if not (self._expression_filter and
+                    self._expression_filter.expression == expression):
+                if self._expression_filter:
+                    self._expression_filter.disconnect_all()
+                try:
+                    self._expression_filter = TagExpressionFilter(
+                        self.index, expression, self._get_resolver())
+                except ValueError:
+                    logger.exception('IconTags: Wrong pages filter: %s', expression)
+                    self.uistate['pages filter'] = ''
+                    return self._get_pages_filter()
+                self.connectto(self._expression_filter, 'visibility-changed',
+                               self.on_visibility_changed)
+            return self._expression_filter
+        if self._show_tagged:
+            return self._get_tagged_pages()
+        return None
+
+    def on_visibility_changed(self, o, ids):
+        '''Update rows which should be shown or hidden in the filtered tree.'''
+        model = self.treeview.get_base_model()
+        if not (model and self.treeview.pagesfilter is o):
+            return # filter is not used
+        for id in ids:
+            row = self.index._db.execute( # XXX
+                'SELECT name FROM pages WHERE id = ?', (id,)).fetchone()
+            if row:
+                model.update_page(row[0])
+
     def disconnect_model(self):
         '''
         Stop the model from listening to the index. Used to
@@ -90,34 +293,37 @@ class IconTagsPluginWidget(ConnectorMixin, gtk.ScrolledWindow):
         '''
         self.treeview.disconnect_index()
 
+    @profiled('reload_model')
+    @timed('panel.reload_model')
     def reload_model(self):
         '''
         Re-initialize the treeview model. This is called when
         reloading the index to get rid of out-of-sync model errors
         without need to close the app first.
         '''
-        # Save expanded paths.
-        paths = []
-        def func(treeview, path):
-            paths.append(path)
-        self.treeview.map_expanded_rows(func)
-        model = self.treeview.get_model()
-
-        if isinstance(model, gtk.TreeModelFilter):
-            # Convert to TreeModel format.
-            paths = [model.convert_path_to_child_path(a) for a in paths]
-
-        model = IconsTreeStore(self.index, self.iconsindex,
-                               self.uistate['show tags'], self.uistate['Icons for Tags'])
-        self.treeview.set_model(model, self._show_tagged)
-
-        # Expand saved paths.
-        model = self.treeview.get_model()
-        for path in paths:
-            if isinstance(model, gtk.TreeModelFilter):
-                # Convert to TreeModelFilter format.
-                path = model.convert_child_path_to_path(path)
-            self.treeview.expand_row(path, open_all = False)
+        if self._use_shortcodes is None or not self._shown:
+            return # not yet initialized or shown, see 'setIndexer' and 'on_map'
+
+        resolver = self._get_resolver()
+        if self._dbpath and not self.worker:
+            self.worker = RowValuesWorker(self._dbpath, resolver.tagsindex)
+
+        paths = self.treeview.get_expanded_paths()
+        model = IconsTreeStore(self.index, resolver,
+                               self.uistate['show tags'], self.worker)
+        self.treeview.set_model(model, self._get_pages_filter())
+        self.treeview.expand_paths(paths)
+
+    @timed('panel.first_show')
+    def on_map(self, widget):
+        '''Load the model when the panel is shown for the first time.'''
+        if self._shown:
+            return
+        self._shown = True
+        self.reload_model()
+        page = getattr(self.ui, 'page', None) # XXX
+        if page:
+            self.on_open_page(self.ui, page, page)
 
     def on_open_page(self, ui, page, path):
         treepath = self.treeview.set_current_page(path, vivificate = True)
@@ -131,15 +337,101 @@ class IconTagsPluginWidget(ConnectorMixin, gtk.ScrolledWindow):
                 # Select and expand.
                 self.treeview.select_treepath(treepath)
 
+    @profiled('toggle_show_tagged')
     def toggle_show_tagged(self):
         '''Show all pages or only pages with tags.'''
         self._show_tagged = not self._show_tagged
-        self.reload_model()
+        self.treeview.set_pages_filter(self._get_pages_filter())
+
+    def set_pages_filter(self, expression):
+        '''
+        Show only pages matching the expression with tags and icons.
+        :param expression: string like "@project AND NOT @done",
+        empty string to disable the filter.
+        '''
+        self.uistate['pages filter'] = expression
+        self.treeview.set_pages_filter(self._get_pages_filter())
 
     def toggle_show_tags(self):
         '''Show/hide tags near the pagename.'''
         self.uistate['show tags'] = not self.uistate['show tags']
-        self.reload_model()
+        model = self.treeview.get_base_model()
+        if model:
+            model.set_show_tags(self.uistate['show tags'])
+            self.treeview.refresh_visible_rows()
+
+    def on_treeview_key_press(self, treeview, event):
+        '''
+        Start search if a letter, a digit, '@' or <Ctrl>F is pressed.
+        Other keys are left to the treeview, e.g. '+', '-', '*', '/'
+        expand and collapse rows and <BackSpace> goes to the parent.
+        '''
+        if event.state & (gtk.gdk.CONTROL_MASK | gtk.gdk.MOD1_MASK):
+            if event.state & gtk.gdk.CONTROL_MASK and \
+               gtk.gdk.keyval_name(event.keyval) in ('f', 'F'):
+                self.start_search('')
+                return True
+            return False
+
+        char = unichr(gtk.gdk.keyval_to_unicode(event.keyval))
+        if char.isalnum() or char == TAG_PREFIX:
+            self.start_search(char)
+            return True
+        return False
+
+    def start_search(self, text):
+        '''Show search entry with a given text.'''
+        self.search_entry.show()
+        self.search_entry.grab_focus()
+        self.search_entry.set_text(text)
+        self.search_entry.set_position(-1)
+
+    def stop_search(self):
+        '''Hide search entry.'''
+        if self.search_entry.get_property('visible'):
+            self.search_entry.hide()
+            self._search_results = []
+            self.treeview.grab_focus()
+
+    def search(self):
+        '''
+        Search pages in the whole notebook and go to the first match.
+        Words are searched in page names, '@tag' and 'icon:name'
+        can be used to search pages with tags and icons.
+        '''
+        text = self.search_entry.get_text().decode('utf-8')
+        if not self._pagenames:
+            self._pagenames = PageNamesIndex(self.index)
+        self._search_results = self._pagenames.search(text)
+        self._search_pos = -1
+        self._goto_search_result(1)
+
+    def _goto_search_result(self, step):
+        '''Go to the next (step = 1) or previous (step = -1) found page.'''
+        n = len(self._search_results)
+        for i in range(n):
+            pos = (self._search_pos + step * (i + 1)) % n
+            if self.treeview.jump_to_page(Path(self._search_results[pos])):
+                self._search_pos = pos
+                return
+        # Nothing found or all pages are hidden.
+        self._search_pos = -1
+
+    def on_search_key_press(self, entry, event):
+        key = gtk.gdk.keyval_name(event.keyval)
+        if key == 'Escape':
+            self.stop_search()
+        elif key in ('Down', 'Up'):
+            self._goto_search_result(1 if key == 'Down' else -1)
+        else:
+            return False
+        return True
+
+    def on_search_activate(self, entry):
+        '''Open the found page.'''
+        if self._search_pos >= 0:
+            self.ui.open_page(Path(self._search_results[self._search_pos]))
+        self.stop_search()
 
     def show_lines(self, value):
         """This function is called from outside to show/hide vertical lines."""
@@ -152,15 +444,27 @@ class IconTagsPluginWidget(ConnectorMixin, gtk.ScrolledWindow):
         # Add menu with view options.
         view_menu = gtk.Menu()
         # Add options to show tags and tagged pages.
+        # The expression filter is used instead of pages with tags.
         items = ( (_('Show only Pages with Tags'), self._show_tagged,
-                   lambda o: self.toggle_show_tagged()),
+                   not self.uistate['pages filter'], lambda o: self.toggle_show_tagged()),
                   (_('Show Tags'), self.uistate['show tags'],
-                   lambda o: self.toggle_show_tags()) )
-        for name, active, func in items:
+                   True, lambda o: self.toggle_show_tags()) )
+        for name, active, sensitive, func in items:
             item = gtk.CheckMenuItem(name)
             item.set_active(active)
+            item.set_sensitive(sensitive)
             item.connect('activate', func)
             view_menu.append(item)
+
+        item = gtk.CheckMenuItem(_('Filter Pages...'))
+        item.set_active(bool(self.uistate['pages filter']))
+        item.connect('activate', lambda o: self.run_filter_dialog())
+        view_menu.append(item)
+
+        item = gtk.MenuItem(_('Icon Rules for Page Names...'))
+        item.set_sensitive(bool(self.resolver))
+        item.connect('activate', lambda o: self.run_name_rules_dialog())
+        view_menu.append(item)
         view_menu.append(gtk.SeparatorMenuItem())
 
         # Add options to switch between views.
@@ -184,10 +488,65 @@ class IconTagsPluginWidget(ConnectorMixin, gtk.ScrolledWindow):
         item.set_submenu(view_menu)
         menu.prepend(item)
 
+        # Add menu to set an icon for the selected page.
+        path = self.treeview.get_selected_path()
+        if path and not path.isroot and self.resolver:
+            item = gtk.MenuItem(_('Page Icon'))
+            item.set_submenu(self._get_page_icon_menu(path.name))
+            menu.prepend(item)
+
         menu.show_all()
 
+    def _get_page_icon_menu(self, pagename):
+        '''Create menu with icons to set for the page without changing its text.'''
+        current = self.overrides.get_icon(pagename)
+        menu = gtk.Menu()
+
+        item = gtk.MenuItem(_('None'))
+        item.set_sensitive(current is not None)
+        item.connect('activate', lambda o: self.resolver.set_page_icon(pagename, None))
+        menu.append(item)
+        menu.append(gtk.SeparatorMenuItem())
+
+        icons = sorted([(a, render_icon(b)) for (a,b) in ICONS.iteritems()
+                        if a not in RESERVED_ICON_NAMES])
+        for name, icon in icons:
+            image = gtk.Image()
+            image.set_from_pixbuf(icon)
+            item = gtk.ImageMenuItem(name)
+            item.set_image(image)
+            item.set_use_underline(False)
+            item.zim_icon_name = name
+            item.connect('activate', lambda item:
+                         self.resolver.set_page_icon(pagename, item.zim_icon_name))
+            menu.append(item)
+        return menu
+
+    def run_filter_dialog(self):
+        '''Ask for the expression to filter pages.'''
+        expression = PagesFilterDialog(self.get_toplevel(), self.uistate['pages filter']).run()
+        if expression is not None: # empty string removes the filter
+            self.set_pages_filter(expression)
+
+    def run_name_rules_dialog(self):
+        '''Edit rules which choose icons by page names.'''
+        rules = IconRulesDialog(self.get_toplevel(), _('Icon Rules for Page Names'), # T: dialog title
+                                _('Icons for pages without a shortcode or tags with icons,\n'
+                                  'patterns are globs ("Journal:*:*:*", "**:Meeting*"),\n'
+                                  '"*" matches one level of names, "**" any levels.\n'
+                                  'Rules with lower priority values are preferred.'),
+                                self.resolver.name_rules).run()
+        if rules is not None:
+            self.resolver.set_name_rules(rules)
+
     def update_page(self, pagename):
-        self.treeview.get_model().update_page(pagename)
+        if self.resolver:
+            self.resolver.update_page(pagename)
+        else:
+            self._on_page_changed(pagename)
+        model = self.treeview.get_base_model()
+        if model:
+            model.update_page(pagename)
 
     def insert_icon(self, pageview):
         '''Create widget to choose an icon and insert an icon shortcode.'''
@@ -212,24 +571,81 @@ class IconTagsPluginWidget(ConnectorMixin, gtk.ScrolledWindow):
         menu.popup(None, None, None, 3, 0)
         menu.show_all()
 
+    @profiled('show_tagsmanager')
     def show_tagsmanager(self, window):
         '''Run TagsManager dialog.'''
-        def update(dialog):
-            if dialog.result:
-                self.reload_model()
-
-        dialog = TagsManagerDialog.unique(self.ui, window, self.index, self.uistate)
-        dialog.connect('destroy', update)
+        # Icons for pages are updated by the resolver after the dialog is closed.
+        dialog = TagsManagerDialog.unique(self.ui, window, self.index,
+                                          self.uistate, self._get_resolver())
         dialog.present()
 
 
+class PagesFilterDialog(Dialog):
+    '''Dialog to enter the expression to filter pages in the tree.'''
+
+    def __init__(self, window, expression):
+        Dialog.__init__(self, window, _('Filter Pages'), # T: dialog title
+                        buttons=gtk.BUTTONS_OK_CANCEL)
+        self.add_text(_('Show only pages matching tags and icons, e.g.\n'
+                        '"@project AND NOT @done", "@home OR icon:important".\n'
+                        'Leave empty to show all pages.'))
+        self.add_form((('expression', 'string', _('Filter')),),
+                      {'expression': expression})
+
+    def do_response_ok(self):
+        expression = (self.form['expression'] or '').strip()
+        if expression:
+            try:
+                parse_expression(expression)
+            except ValueError as error:
+                ErrorDialog(self, unicode(error)).run()
+                return False
+        self.result = expression
+        return True
+
+
+class StatisticsDialog(Dialog):
+    '''Dialog with counters and timings collected by L{Statistics}.'''
+
+    def __init__(self, window):
+        Dialog.__init__(self, window, _('IconTags Statistics'), # T: dialog title
+                        buttons=gtk.BUTTONS_CLOSE,
+                        defaultwindowsize=(600, 400) )
+        if not STATS.enabled:
+            self.add_text(_('Statistics are not collected, enable them in the plugin preferences.'))
+
+        self.textview = gtk.TextView()
+        self.textview.set_editable(False)
+        self.textview.modify_font(pango.FontDescription('monospace'))
+        self.vbox.pack_start(ScrolledWindow(self.textview), True)
+
+        hbox = gtk.HBox(spacing = 5)
+        for label, func in ((_('Refresh'), lambda o: self.update()),
+                            (_('Reset'), lambda o: (STATS.reset(), self.update())),
+                            (_('Write to Log'), lambda o: STATS.log())):
+            button = gtk.Button(label)
+            button.connect('clicked', func)
+            hbox.pack_start(button, False)
+        self.vbox.pack_start(hbox, False)
+        self.update()
+
+    def update(self):
+        self.textview.get_buffer().set_text(STATS.format())
+
+
 class IconsTreeView(PageTreeView):
     '''This class output the tree with pages.'''
 
     def __init__(self, ui, model = None):
         self._PageTreeView_init_(ui)
         self.view = 'default' # set_current_page behaviour
+        self.pagesfilter = None # if set - show only pages from the filter
         self.set_name('zim-icontags-pagelist')
+
+        # Names of expanded pages, used to collapse only them in 'collapse' view.
+        self._expanded = set()
+        self.connect('row-expanded', self.on_row_expanded)
+        self.connect('row-collapsed', self.on_row_collapsed)
         if model:
             self.set_model(model)
 
@@ -267,8 +683,8 @@ class IconsTreeView(PageTreeView):
 
         self.set_headers_visible(False)
 
-        self.set_enable_search(True)
-        self.set_search_column(0)
+        # The search is done by 'IconTagsPluginWidget' in the whole notebook.
+        self.set_enable_search(False)
 
         self.enable_model_drag_source(
             gtk.gdk.BUTTON1_MASK, (INTERNAL_PAGELIST_TARGET,),
@@ -288,8 +704,7 @@ class IconsTreeView(PageTreeView):
         recommended to create or change page names since not all pages
         are shown.
         '''
-        model = self.get_model()
-        if not isinstance(model, gtk.TreeModelFilter):
+        if not self.pagesfilter:
             PageTreeView.do_initialize_popup(self, menu)
             return
 
@@ -308,40 +723,132 @@ class IconsTreeView(PageTreeView):
         self.populate_popup_expand_collapse(menu)
         menu.show_all()
 
-    def set_model(self, model, _show_tagged = False):
+    def set_model(self, model, pagesfilter = None):
         '''
         Set the model to be used.
-        :param _show_tagged: if True enable tagged mode.
+        :param pagesfilter: L{TaggedPagesFilter} object to enable tagged mode.
         '''
         # disconnect previous model
-        oldmodel = self.get_model()
-        if oldmodel:
-            if isinstance(oldmodel, gtk.TreeModelFilter):
-                oldmodel = oldmodel.get_model()
-            oldmodel.disconnect_all()
+        self.disconnect_index()
 
-        if _show_tagged:
+        self.pagesfilter = pagesfilter
+        self._expanded.clear()
+        if pagesfilter:
             model = self._init_modelfilter(model)
         PageTreeView.set_model(self, model)
 
-    def _init_modelfilter(self, model):
+    def get_base_model(self):
+        '''Return L{IconsTreeStore} also if it is wrapped by the filter.'''
+        model = self.get_model()
+        if isinstance(model, gtk.TreeModelFilter):
+            model = model.get_model()
+        return model
+
+    def disconnect_index(self):
+        '''Stop the model from listening to the index and the plugin.'''
+        model = self.get_base_model()
+        if model:
+            model.disconnect_all()
+
+    def get_treepath(self, path):
+        '''
+        Return the treepath for the page or None if it is not shown.
+        :param path: a notebook L{Path} object for the page.
+        '''
+        model = self.get_model()
+        if model is None:
+            return None
+        if isinstance(model, gtk.TreeModelFilter):
+            return model.get_treepath(path)
+        try:
+            return model.find(path)
+        except IndexNotFoundError:
+            return None
+
+    def set_pages_filter(self, pagesfilter):
+        '''
+        Change the filter for the current model without reloading it.
+        The model is wrapped by gtk.TreeModelFilter only while a filter
+        is set. Expanded rows which are still visible stay expanded.
+        :param pagesfilter: L{TaggedPagesFilter} object or None to show all pages.
+        '''
+        model = self.get_model()
+        oldfilter, self.pagesfilter = self.pagesfilter, pagesfilter
+        if not model:
+            return
+
+        paths = self.get_expanded_paths()
+        if oldfilter and pagesfilter:
+            model.refilter()
+        else:
+            model = self.get_base_model()
+            if pagesfilter:
+                model = self._init_modelfilter(model)
+            PageTreeView.set_model(self, model)
+        self.expand_paths(paths)
+
+    def get_expanded_paths(self):
+        '''Return expanded paths in the format of the base model.'''
+        model = self.get_model()
+        paths = []
+        if isinstance(model, gtk.TreeModelFilter):
+            func = lambda treeview, path: paths.append(model.convert_path_to_child_path(path))
+        else:
+            func = lambda treeview, path: paths.append(path)
+        if model:
+            self.map_expanded_rows(func)
+        return paths
+
+    def expand_paths(self, paths):
+        '''Expand paths given in the format of the base model.'''
+        model = self.get_model()
+        filtered = isinstance(model, gtk.TreeModelFilter)
+        for path in paths:
+            if filtered:
+                path = model.convert_child_path_to_path(path)
+            if path:
+                self.expand_row(path, open_all = False)
+
+    def refresh_visible_rows(self):
         '''
-        Introduce gtk.TreeModelFilter to show only pages with tags.
+        Emit 'row-changed' for rows in the visible area of the view
+        to update their values. Other rows are updated when shown.
         '''
-        tagsview = TagsView.new_from_index(model.index)
+        model = self.get_model()
+        visible = self.get_visible_range() if model else None
+        if not visible:
+            return
 
+        start, end = visible
+        iter = model.get_iter(start)
+        while iter:
+            path = model.get_path(iter)
+            model.row_changed(path, iter)
+            if path == end:
+                break
+
+            # Go to the next row in the order it is shown.
+            if self.row_expanded(path) and model.iter_has_child(iter):
+                iter = model.iter_children(iter)
+                continue
+            while iter:
+                next_iter = model.iter_next(iter)
+                if next_iter:
+                    iter = next_iter
+                    break
+                iter = model.iter_parent(iter)
+
+    def _init_modelfilter(self, model):
+        '''
+        Introduce gtk.TreeModelFilter to show only pages
+        from 'self.pagesfilter' (e.g. pages with tags and their parents).
+        Methods of L{IconsTreeStore} are taken from 'get_base_model'.
+        '''
         def func(model, iter):
             '''Function to filter pages.'''
-            if model.iter_has_child(iter):
-                return True # parent will be seen
-            else:
-                # Show only tagged pages.
-                try:
-                    # Check if there is any tag present.
-                    next(tagsview.list_tags(model.get_indexpath(iter)))
-                except StopIteration:
-                    return False
+            if not self.pagesfilter:
                 return True
+            return self.pagesfilter.is_visible(model.get_user_data(iter).row['id'])
 
         modelfilter = model.filter_new(root = None)
         modelfilter.set_visible_func(func)
@@ -370,6 +877,13 @@ class IconsTreeView(PageTreeView):
             else:
                 return None
 
+        def find(path):
+            '''Get a gtk TreePath for a L{Path}, raise error if it is hidden'''
+            treepath = modelfilter.convert_child_path_to_path(model.find(path))
+            if not treepath:
+                raise IndexNotFoundError(path.name)
+            return treepath
+
         def set_current_page(path):
             treepath = model.set_current_page(path)
             if treepath:
@@ -379,12 +893,56 @@ class IconsTreeView(PageTreeView):
 
         modelfilter.get_indexpath = get_indexpath
         modelfilter.get_treepath = get_treepath
+        modelfilter.find = find
         modelfilter.index = model.index
         modelfilter.set_current_page = set_current_page
-        modelfilter.update_page = model.update_page
 
         return modelfilter
 
+    def on_row_expanded(self, treeview, treeiter, treepath):
+        page = self.get_model().get_indexpath(treeiter)
+        if page:
+            self._expanded.add(page.name)
+
+    def on_row_collapsed(self, treeview, treeiter, treepath):
+        # Children are collapsed together with the parent.
+        page = self.get_model().get_indexpath(treeiter)
+        if page:
+            prefix = page.name + ':'
+            self._expanded = set(a for a in self._expanded
+                                 if a != page.name and not a.startswith(prefix))
+
+    def collapse_other_pages(self, path):
+        '''
+        Collapse expanded pages which are not parents of the page.
+        Only tracked expanded pages are checked, so it doesn't
+        depend on the size of the tree.
+        :param path: a notebook L{Path} object for the page.
+        '''
+        keep = set(a.name for a in path.parents())
+        keep.add(path.name)
+
+        # Collapse top pages first, their children are collapsed with them.
+        for name in sorted(self._expanded - keep, key=lambda a: a.count(':')):
+            if name not in self._expanded:
+                continue # already collapsed with its parent
+            treepath = self.get_treepath(Path(name))
+            if treepath:
+                self.collapse_row(treepath)
+            self._expanded.discard(name) # also if the row is not shown
+
+    def jump_to_page(self, path):
+        '''
+        Expand parents, select and scroll to the page.
+        :param path: a notebook L{Path} object for the page.
+        :returns: False if the page is not shown.
+        '''
+        treepath = self.get_treepath(path)
+        if not treepath:
+            return False
+        self.select_treepath(treepath)
+        return True
+
     def set_current_page(self, path, vivificate = False):
         '''
         Ensure that parent with tagged pages will autoexpand
@@ -398,15 +956,15 @@ class IconsTreeView(PageTreeView):
 
         if self.view == 'collapse':
             # Collapse all other pages and expand only current page.
-            self.collapse_all()
+            self.collapse_other_pages(path)
 
-        if (not isinstance(model, gtk.TreeModelFilter)) or model.get_treepath(path):
+        if (not self.pagesfilter) or self.get_treepath(path):
             return PageTreeView.set_current_page(self, path, vivificate)
 
         # Path may be invisible due to modelfilter.
         if path.parent and (not path.parent.isroot) and (self.view != 'disable'):
             # Expand parent path if it is available.
-            parent_treepath = model.get_treepath(path.parent)
+            parent_treepath = self.get_treepath(path.parent)
             if parent_treepath:
                 self.expand_to_path(parent_treepath)
         return None
@@ -416,12 +974,15 @@ class IconsTreeView(PageTreeView):
 class IconsTreeStore(PageTreeStore):
     '''
     Model to show tags and icons alongside the pagename.
+    Icons are taken from the table with resolved icons (see L{IconsResolver}).
     This model uses cache for storing page's properties for 'on_get_value' function
     to avoid excessive SQL queries and improve performance.
     Cache is a dict with values for NAME_COL, TIP_COL and ICON_COL for each cached page;
     cache[path.name] = (NAME_COL value, TIP_COL value, ICON_COL value).
     Icons are stored in cache as strings, to render them to images use 'render_icon'.
-    The size of cache is limited and it is cleared automatically after some time.
+    The size of cache is limited by CACHE_SIZE, the least recently used
+    pages are removed first. Visible rows are used on every redraw,
+    so only pages outside the visible range are removed.
     '''
     COLUMN_TYPES = (
     gobject.TYPE_STRING, # NAME_COL
@@ -435,15 +996,21 @@ class IconsTreeStore(PageTreeStore):
     gobject.TYPE_OBJECT # ICON_COL
     )
 
-    def __init__(self, index, iconindex, show_tags, icons_for_tags):
+    def __init__(self, index, resolver, show_tags, worker = None):
         self.index = index
-        self.iconindex = iconindex
-        self.icons_for_tags = icons_for_tags
+        self.resolver = resolver
+        self.tagsindex = resolver.tagsindex
         self.show_tags = show_tags
 
+        # Values for rows are computed by the worker if it is given.
+        self.worker = worker
+        self._pending = {} # pagename -> (request id, haschildren)
+        self._request_id = 0
+        self._index_updating = False
+        self._changed_while_updating = set()
+
         # Cache pagenames with tags.
-        self._pagenames_cache = {}
-        self._clear_cache_scheduled = False
+        self._pagenames_cache = OrderedDict() # the last used page is the last item
 
         PageTreeStore.__init__(self, index)
         self._connect()
@@ -454,82 +1021,116 @@ class IconsTreeStore(PageTreeStore):
         Columns 'NAME_COL', 'TIP_COL' and 'ICON_COL' use cache,
         other columns works with default methods.
         '''
+        if column not in (NAME_COL, TIP_COL, ICON_COL):
+            return PageTreeStore.on_get_value(self, iter, column)
 
-        if (column == NAME_COL) or (column == TIP_COL):
-            try:
-                return self._pagenames_cache[iter.row['name']][column]
-            except KeyError:
-                pass
-        elif column == ICON_COL:
-            try:
-                return render_icon(self._pagenames_cache[iter.row['name']][column])
-            except KeyError:
-                pass
+        stats = STATS.enabled
+        try:
+            value = self._get_cached_value(iter.row['name'], column)
+        except KeyError:
+            if stats:
+                STATS.incr('treestore.cache_misses')
         else:
-            return PageTreeStore.on_get_value(self, iter, column)
+            if stats:
+                STATS.incr('treestore.cache_hits')
+            return value
 
         # Value is not in cache.
-        # Find tags, icons and put values to cache.
         page = PageIndexRecord(iter.row)
-        tags = [a.name for a in TagsView.new_from_index(self.index).list_tags(page)]
-        icon = None
-
-        if self.iconindex:
-            icon = self.iconindex.get_icon(iter.row['name'])
-
-        if icon:
-            icon = ICONS.get(icon, ICONS[NO_IMAGE])
-        elif tags:
-            # Check icons for tags.
-            _icons = [self.icons_for_tags[a] for a in tags
-                      if a in self.icons_for_tags]
-            if _icons:
-                # Check whether all icons are the same.
-                if len( set(_icons) ) > 1:
-                    icon = ICONS[SEVERAL_ICONS]
-                else:
-                    icon = ICONS[_icons[0]]
-            elif page.haschildren:
-                icon = ICONS[FOLDER_TAGS_ICON]
-            else:
-                icon = ICONS[FILE_TAGS_ICON]
+        if self.worker and not self.resolver.uncommitted:
+            # Values are computed in the background, show placeholder until then.
+            # The worker doesn't see changes of the resolver until they are committed.
+            if page.name not in self._pending:
+                self._request_id += 1
+                self._pending[page.name] = (self._request_id, page.haschildren)
+                self.worker.request(page.name, self._request_id, self.on_values_loaded)
+                if stats:
+                    STATS.incr('treestore.worker_requests')
+            if column == ICON_COL:
+                return render_icon(ICONS[FOLDER_ICON if page.haschildren else FILE_ICON])
+            return page.basename if column == NAME_COL else encode_markup_text(page.basename)
+
+        # Find icon, tags and put values to cache.
+        start = timer() if stats else None
+        resolved = self.resolver.get_icon(page.name)
+        if resolved:
+            icon, has_tags = resolved
         else:
-            if page.haschildren:
-                icon = ICONS[FOLDER_ICON]
-            else:
-                icon = ICONS[FILE_ICON]
-
+            # Page is not yet in the table, it will be updated by the resolver.
+            icon, has_tags = None, False
+
+        tags = []
+        if has_tags and self.show_tags:
+            tags = self.tagsindex.list_tags(page.name)
+        if stats:
+            STATS.add_time('treestore.sql', timer() - start)
+        self._set_cache(page.name, page.haschildren, icon, tags)
+
+        return self._get_cached_value(page.name, column)
+
+    def _get_cached_value(self, pagename, column):
+        '''Return value from cache, raise KeyError if it is not there.'''
+        values = self._pagenames_cache.pop(pagename)
+        self._pagenames_cache[pagename] = values
+        value = values[column]
+        return render_icon(value) if column == ICON_COL else value
+
+    def _set_cache(self, pagename, haschildren, icon, tags):
+        '''Put values for NAME_COL, TIP_COL and ICON_COL to cache.'''
+        if not icon:
+            icon = FOLDER_ICON if haschildren else FILE_ICON
+        icon = ICONS.get(icon, ICONS[NO_IMAGE])
+
+        basename = Path(pagename).basename
         if tags and self.show_tags: # show tags after page name
-            name = '{} ({})'.format(page.basename, ', '.join(tags))
+            name = '{} ({})'.format(basename, ', '.join(tags))
         else:
-            name = page.basename
-
-        self._pagenames_cache[iter.row['name']] = {NAME_COL: name,
-                                            TIP_COL: encode_markup_text(name),
-                                            ICON_COL: icon}
-
-        # Launch function to clear cache.
-        if not self._clear_cache_scheduled:
-            self._clear_pagenames_cache()
+            name = basename
 
-        return self.on_get_value(iter, column)
-
-    def _clear_pagenames_cache(self):
-        if not self._clear_cache_scheduled:
-            def _clear():
-                '''Clear tags cache.'''
-                if len(self._pagenames_cache) > 200:
-                    self._pagenames_cache = {}
-                self._clear_cache_scheduled = False
-                return False # to not call again
-
-            gobject.timeout_add(500, _clear)
-            self._clear_cache_scheduled = True
+        self._pagenames_cache.pop(pagename, None)
+        self._pagenames_cache[pagename] = {NAME_COL: name,
+                                           TIP_COL: encode_markup_text(name),
+                                           ICON_COL: icon}
+        if len(self._pagenames_cache) > CACHE_SIZE:
+            self._pagenames_cache.popitem(last = False)
+
+    def on_values_loaded(self, values):
+        '''Callback for the worker: fill cache and update rows.'''
+        for pagename, token, icon, tags in values:
+            pending = self._pending.get(pagename)
+            if not pending or pending[0] != token:
+                continue # page was changed after the request
+            del self._pending[pagename]
+            self._set_cache(pagename, pending[1], icon, tags)
+            self._emit_row_changed(pagename)
+
+    def set_index_updating(self, updating):
+        '''
+        The worker reads only committed data, so pages changed during
+        the index update are requested again when the update is finished.
+        '''
+        self._index_updating = updating
+        if not updating:
+            pagenames, self._changed_while_updating = self._changed_while_updating, set()
+            for pagename in pagenames:
+                self.update_page(pagename)
+
+    def set_show_tags(self, show_tags):
+        '''Show/hide tags near the pagename, rows should be updated by the view.'''
+        self.show_tags = show_tags
+        self._pagenames_cache.clear()
+        self._pending = {}
 
     def update_page(self, pagename):
         '''Update page in the cache and in the treeview.'''
 
         self._pagenames_cache.pop(pagename, None)
+        self._pending.pop(pagename, None)
+        if self._index_updating and self.worker:
+            self._changed_while_updating.add(pagename)
+        self._emit_row_changed(pagename)
+
+    def _emit_row_changed(self, pagename):
         try:
             treepath = self.find(Path(pagename))
         except IndexNotFoundError:
@@ -539,10 +1140,23 @@ class IconsTreeStore(PageTreeStore):
             self.emit('row-changed', treepath, treeiter)
 
     def _connect(self):
-        def on_tag_changed(o, row, pagerow):
-            self.update_page(pagerow['name'])
+        # Rows are inserted, deleted and changed in the view by PageTreeStore,
+        # here only cached values are removed.
+        def on_page_row_changed(o, row, *a):
+            self._pagenames_cache.pop(row['name'], None)
+            self._pending.pop(row['name'], None)
+
+        self.connectto_all(self.index.update_iter.pages, (
+            ('page-row-changed', on_page_row_changed),
+            ('page-row-deleted', on_page_row_changed),
+        ))
+
+        def on_tag_changed(o, pagename, tag):
+            self.update_page(pagename)
 
-        self.connectto_all(self.index.update_iter.tags, (
-            ('tag-added-to-page', on_tag_changed),
-            ('tag-removed-from-page', on_tag_changed),
+        self.connectto_all(self.tagsindex, (
+            ('tag-added', on_tag_changed),
+            ('tag-removed', on_tag_changed),
         ))
+        self.connectto(self.resolver, 'icon-changed',
+                       lambda o, pagename: self.update_page(pagename))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import time
+import pstats
+import cProfile
+import tempfile
+import functools
+import logging
+
+from StringIO import StringIO
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+# Operations are profiled from the start if the variable is set,
+# its value is the folder for traces ('1' to use the default folder).
+ENVIRON_KEY = 'ZIM_ICONTAGS_PROFILE'
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'icontags-profiles')
+TOP_N = 15 # number of functions in the summary written to the log
+
+
+class OperationsProfiler(object):
+    '''
+    Profiler for plugin operations. Every operation is profiled
+    separately and written to a timestamped '.pstats' file, which can
+    be opened with 'python -m pstats' or snakeviz. A summary with the
+    top functions by cumulative time is written to the log.
+    Operations started inside another operation are part of its trace.
+    '''
+
+    def __init__(self):
+        value = os.environ.get(ENVIRON_KEY)
+        self.enabled = bool(value)
+        self.directory = value if value and value != '1' else DEFAULT_DIRECTORY
+        self._profile = None
+        self._name = None
+        self._n_traces = 0
+
+    def start(self, name):
+        '''Start to profile the operation, return False if it is not profiled.'''
+        if not self.enabled or self._profile:
+            return False
+        self._name = name
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return True
+
+    def stop(self):
+        '''Stop to profile the current operation and save its trace.'''
+        if not self._profile:
+            return
+        profile, self._profile = self._profile, None
+        profile.disable()
+
+        # Number of the trace keeps names unique for operations in one second.
+        self._n_traces += 1
+        path = os.path.join(self.directory, 'icontags-{}-{}-{}.pstats'.format(
+            time.strftime('%Y%m%d-%H%M%S'), self._n_traces, self._name))
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            profile.dump_stats(path)
+        except (IOError, OSError):
+            logger.exception('IconTags: Error while saving profile: %s', path)
+            path = None
+
+        stream = StringIO()
+        stats = pstats.Stats(profile, stream = stream)
+        stats.sort_stats('cumulative').print_stats(TOP_N)
+        logger.info('IconTags: Profile of "%s" (%.3f s) saved to %s\n%s', self._name,
+                    stats.total_tt, path, stream.getvalue())
+
+
+PROFILER = OperationsProfiler()
+
+
+def profiled(name):
+    '''Decorator to profile every call as the operation 'name'.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.start(name):
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PROFILER.stop()
+        return wrapper
+    return decorator
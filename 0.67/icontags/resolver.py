@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import hashlib
+import logging
+import sqlite3
+import gobject
+
+from zim.signals import SignalEmitter, ConnectorMixin
+
+from .tagsindex import PageTagsIndex
+from .rules import TagIconsEngine, SEVERAL_ICONS_ERROR
+from .matchers import PageNameRulesMatcher
+from .names import subtree_ranges
+from .iconutils import NO_IMAGE, FOLDER_ICON, \
+    FOLDER_TAGS_ICON, FILE_ICON, FILE_TAGS_ICON, ICONS
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+MAX_RANGES = 200 # ranges of names in one query, sqlite has a limit of 999 parameters
+
+# Table contains page.name, the final icon to show for the page,
+# the own icon of the page (from the shortcode or tags, may be inherited
+# by subpages) and a flag whether the page has tags.
+# Icons are stored as names (keys of ICONS), not as rendered images.
+# There is one row for every page in the notebook.
+
+class IconsResolver(SignalEmitter, ConnectorMixin):
+    '''
+    This class keeps the table with resolved icons for all pages.
+    An icon for a page depends on the icon set for the page
+    (see L{IconOverridesTable}), the icon shortcode, tags of the page,
+    icons assigned to tags (see L{TagIconsTable}), rules for tags
+    (see L{TagIconsEngine}), rules for page names
+    (see L{PageNameRulesMatcher}) and on the presence of subpages.
+    If 'inherit' is True pages without own icons show the icon of
+    the nearest parent with an own icon. Inherited icons are cached for
+    every namespace and the cache is dropped for the subtree
+    of a page when its own icon is changed.
+    The table is updated only for pages which are changed.
+    The table is created by 'init_plugin_tables'. Changes made during
+    index updates are committed by zim with the index, other changes
+    (the rebuild and changes of settings) are committed by the resolver
+    in an idle callback outside index updates. Until then 'uncommitted'
+    is True and other connections (see L{RowValuesWorker}) see old values.
+    '''
+    PROPERTY_NAME = 'icontags-resolved'
+    FORMAT_PROPERTY = 'icontags-resolved-format'
+    DB_FORMAT = '0.2'
+    INIT_SCRIPT = '''
+        CREATE TABLE IF NOT EXISTS iconresolved (
+        id TEXT PRIMARY KEY,
+        icon TEXT,
+        own TEXT,
+        has_tags BOOLEAN
+        );
+        CREATE INDEX IF NOT EXISTS iconresolved_icon ON iconresolved(icon);
+        '''
+
+    TEARDOWN_SCRIPT = '''
+        DROP TABLE IF EXISTS "iconresolved";
+        DELETE FROM zim_index WHERE key IN (%r, %r);
+        ''' % (PROPERTY_NAME, FORMAT_PROPERTY)
+
+    # define signals we want to use - (closure type, return type and arg types)
+    __signals__ = {'icon-changed': (None, None, (object,))}
+
+    def __init__(self, index, tagicons, rulestable, overrides, use_shortcodes,
+                 several_icons = SEVERAL_ICONS_ERROR, shortcode_first = True,
+                 inherit = False):
+        self.index = index
+        self.db = index._db # XXX
+        self.tagicons = tagicons
+        self.icons_for_tags = tagicons.get_mapping()
+        self.rulestable = rulestable
+        self.tag_rules = rulestable.get_rules('tag')
+        self.engine = TagIconsEngine(self.icons_for_tags, self.tag_rules, several_icons)
+        self.name_rules = rulestable.get_rules('name')
+        self.name_matcher = PageNameRulesMatcher(self.name_rules)
+        self.overrides = overrides
+        self.use_shortcodes = use_shortcodes
+        self.shortcode_first = shortcode_first
+        self.inherit = inherit
+        self._namespace_icons = {} # namespace -> icon for its subpages or None
+        self.tagsindex = PageTagsIndex.new_from_index(index)
+        self.uncommitted = False # True after changes until they are committed
+        self._index_updating = False
+        self._commit_id = None
+
+        if self.index.get_property(self.PROPERTY_NAME) != self._signature():
+            self.rebuild()
+        # Tables of settings are checked before the resolver is created.
+        self.queue_commit()
+
+        self.connectto_all(index.update_iter.pages, (
+            ('page-row-inserted', lambda o, row: self.update_page(row['name'])),
+            ('page-row-changed', lambda o, row, *a: self.update_page(row['name'])),
+            ('page-row-deleted', lambda o, row: self._remove(row['name'])),
+        ))
+
+        def on_tag_changed(o, pagename, tag):
+            self.update_page(pagename)
+
+        self.connectto_all(self.tagsindex, (
+            ('tag-added', on_tag_changed),
+            ('tag-removed', on_tag_changed),
+        ))
+
+    def _signature(self):
+        '''
+        Return a string which changes if the table should be rebuilt
+        because of changes in settings.
+        '''
+        key = repr((self.DB_FORMAT, self.use_shortcodes, self.shortcode_first,
+                    self.inherit, self.engine.mode,
+                    sorted(self.icons_for_tags.iteritems()), self.tag_rules,
+                    self.name_rules))
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get_tag_icon(self, tag):
+        '''Return icon assigned to the tag or chosen by rules, or None.'''
+        return self.engine.get_tag_icon(tag)
+
+    def resolve_own(self, pagename, shortcode, tags, override = None):
+        '''
+        Return the own icon of a page or None.
+        The icon set for the page has the top priority, then the shortcode
+        and tags are checked, then rules for page names.
+        :param shortcode: icon name from the shortcode or None.
+        :param tags: list with names of tags for the page.
+        :param override: icon set for the page or None.
+        '''
+        if override:
+            return override if override in ICONS else NO_IMAGE
+
+        tags_icon = self.engine.resolve_tags(tags) if tags else None
+        if shortcode and (self.shortcode_first or not tags_icon):
+            return shortcode if shortcode in ICONS else NO_IMAGE
+        return tags_icon or self.name_matcher.match(pagename)
+
+    def resolve(self, pagename, haschildren, own, has_tags, owns = None):
+        '''
+        Return the name of the icon to show for a page.
+        :param haschildren: True if the page has subpages.
+        :param own: own icon of the page or None.
+        :param has_tags: True if the page has tags.
+        :param owns: dict with own icons of all pages, used to rebuild
+        the table, otherwise own icons of parents are taken from the table.
+        '''
+        if own:
+            return own
+
+        if self.inherit:
+            icon = self._get_namespace_icon(pagename.rpartition(':')[0], owns)
+            if icon:
+                return icon
+
+        if has_tags:
+            return FOLDER_TAGS_ICON if haschildren else FILE_TAGS_ICON
+        return FOLDER_ICON if haschildren else FILE_ICON
+
+    def _get_namespace_icon(self, namespace, owns = None):
+        '''Return icon inherited by subpages of the namespace or None.'''
+        if not namespace:
+            return None
+        try:
+            return self._namespace_icons[namespace]
+        except KeyError:
+            pass
+
+        if owns is not None:
+            icon = owns.get(namespace)
+        else:
+            row = self.db.execute(
+                'SELECT own FROM iconresolved WHERE id = ?', (namespace,)).fetchone()
+            icon = row[0] if row else None
+        if not icon:
+            icon = self._get_namespace_icon(namespace.rpartition(':')[0], owns)
+
+        self._namespace_icons[namespace] = icon
+        return icon
+
+    def _drop_namespace_icons(self, pagename):
+        '''Drop cached icons for the page and all its subpages.'''
+        prefix = pagename + ':'
+        for namespace in [a for a in self._namespace_icons
+                          if a == pagename or a.startswith(prefix)]:
+            del self._namespace_icons[namespace]
+
+    def get_icon(self, pagename):
+        '''
+        Returns a tuple (icon name, has tags) for a given pagename
+        or None if the page is not in the table.
+        '''
+        row = self.db.execute(
+            'SELECT icon, has_tags FROM iconresolved WHERE id = ?',
+            (pagename,)).fetchone()
+        if row:
+            return row[0], bool(row[1])
+        return None
+
+    def rebuild(self):
+        '''Resolve icons for all pages in the notebook.'''
+        shortcodes = {}
+        if self.use_shortcodes:
+            try:
+                shortcodes = dict(self.db.execute('SELECT id, icon FROM iconlist'))
+            except sqlite3.OperationalError:
+                logger.debug('IconTags: No iconlist in index.')
+        overrides = self.overrides.get_mapping()
+
+        # Icons for tags are memoized by the engine for every set of tags,
+        # so pages with the same tags are resolved once.
+        rows = self.db.execute(
+            '''
+            SELECT pages.name, pages.n_children, group_concat(tags.name, '\n')
+            FROM pages
+            LEFT JOIN tagsources ON tagsources.source = pages.id
+            LEFT JOIN tags ON tags.id = tagsources.tag
+            GROUP BY pages.id''')
+
+        pages, owns = [], {}
+        for name, n_children, tags in rows:
+            tags = tags.split('\n') if tags else []
+            own = self.resolve_own(name, shortcodes.get(name), tags, overrides.get(name))
+            if own:
+                owns[name] = own
+            pages.append((name, n_children > 0, own, bool(tags)))
+
+        # Icons of parents are taken from 'owns', not from the table.
+        self._namespace_icons = {}
+        values = [(name, self.resolve(name, haschildren, own, has_tags, owns), own, has_tags)
+                  for name, haschildren, own, has_tags in pages]
+
+        self.db.execute('DELETE FROM iconresolved')
+        self.db.executemany(
+            'INSERT INTO iconresolved (id, icon, own, has_tags) VALUES (?, ?, ?, ?)',
+            values)
+        self.index.set_property(self.PROPERTY_NAME, self._signature())
+        self.queue_commit()
+        logger.debug('IconTags: Icons resolved for %i pages', len(values))
+
+    def set_index_updating(self, updating):
+        '''
+        Changes are not committed during index updates, zim commits
+        them together with the index when the update is finished.
+        '''
+        if self._index_updating and not updating:
+            self.uncommitted = False
+        self._index_updating = updating
+
+    def queue_commit(self):
+        '''Commit changes in an idle callback, outside index updates.'''
+        self.uncommitted = True
+        if not self._commit_id:
+            self._commit_id = gobject.idle_add(self._on_commit)
+
+    def commit(self):
+        '''Commit changes now, if the index is not being updated.'''
+        if self._commit_id:
+            gobject.source_remove(self._commit_id)
+            self._commit_id = None
+        if self._index_updating or not self.uncommitted:
+            return # committed by zim with the index
+        try:
+            self.db.commit()
+        except sqlite3.Error:
+            logger.exception('IconTags: Error while committing icons')
+        else:
+            self.uncommitted = False
+
+    def _on_commit(self):
+        self._commit_id = None
+        self.commit()
+        return False # to not call again
+
+    def update_page(self, pagename):
+        '''Resolve the icon for one page and update the table.'''
+        for name in self._update_page(pagename):
+            self.emit('icon-changed', name)
+
+    def _update_page(self, pagename):
+        '''
+        Update the table and return list of pages with changed rows,
+        subpages are changed if they inherit the icon of the page.
+        '''
+        row = self.db.execute(
+            'SELECT id, n_children FROM pages WHERE name = ?',
+            (pagename,)).fetchone()
+        if not row:
+            return self._delete(pagename)
+
+        tags = self.tagsindex.list_tags(pagename)
+
+        shortcode = None
+        if self.use_shortcodes:
+            try:
+                result = self.db.execute(
+                    'SELECT icon FROM iconlist WHERE id = ?',
+                    (pagename,)).fetchone()
+            except sqlite3.OperationalError:
+                result = None
+            if result:
+                shortcode = result[0]
+
+        own = self.resolve_own(pagename, shortcode, tags,
+                               self.overrides.get_icon(pagename))
+        icon = self.resolve(pagename, row[1] > 0, own, bool(tags))
+        return self._set(pagename, icon, own, bool(tags))
+
+    def _set(self, pagename, icon, own, has_tags):
+        old = self.db.execute(
+            'SELECT icon, own, has_tags FROM iconresolved WHERE id = ?',
+            (pagename,)).fetchone()
+        if old and (old[0], old[1], bool(old[2])) == (icon, own, has_tags):
+            return []
+        self.db.execute(
+            '''
+            INSERT OR REPLACE INTO iconresolved (id, icon, own, has_tags)
+            VALUES (?, ?, ?, ?)''', (pagename, icon, own, has_tags))
+
+        changed = [pagename]
+        if self.inherit and (old[1] if old else None) != own:
+            changed.extend(self._update_subtree(pagename))
+        return changed
+
+    def _update_subtree(self, pagename):
+        '''
+        Update inherited icons for all subpages of the page,
+        return list of changed pages.
+        Subpages are selected by ranges of names (see L{subtree_ranges}),
+        subpages with own icons and their subtrees are excluded, they
+        keep their icons. So rows are updated with one query for every
+        range, not one query for every subpage.
+        '''
+        self._drop_namespace_icons(pagename)
+        owns = [name for (name,) in self.db.execute(
+            '''
+            SELECT id FROM iconresolved
+            WHERE id >= ? AND id < ? AND own IS NOT NULL
+            ORDER BY id''', (pagename + ':', pagename + ';'))]
+        ranges = subtree_ranges(pagename, owns)
+
+        # All pages in the ranges inherit the same icon.
+        icon = self._get_namespace_icon(pagename)
+        if icon:
+            expr, expr_params = '?', (icon,)
+        else:
+            expr = '''
+                CASE WHEN (SELECT n_children FROM pages WHERE pages.name = iconresolved.id) > 0
+                THEN (CASE WHEN has_tags THEN ? ELSE ? END)
+                ELSE (CASE WHEN has_tags THEN ? ELSE ? END) END'''
+            expr_params = (FOLDER_TAGS_ICON, FOLDER_ICON, FILE_TAGS_ICON, FILE_ICON)
+
+        changed = []
+        for i in range(0, len(ranges), MAX_RANGES):
+            chunk = ranges[i:i + MAX_RANGES]
+            where = 'own IS NULL AND icon IS NOT (%s) AND (%s)' % (
+                expr, ' OR '.join('(id %s ? AND id < ?)' % ('>=' if included else '>')
+                                  for start, included, end in chunk))
+            params = expr_params + tuple(a for start, included, end in chunk for a in (start, end))
+            changed.extend(name for (name,) in self.db.execute(
+                'SELECT id FROM iconresolved WHERE ' + where, params))
+            self.db.execute('UPDATE iconresolved SET icon = (%s) WHERE %s' % (expr, where),
+                            expr_params + params)
+        return changed
+
+    def _delete(self, pagename):
+        row = self.db.execute(
+            'SELECT own FROM iconresolved WHERE id = ?', (pagename,)).fetchone()
+        if not row:
+            return []
+        self.db.execute('DELETE FROM iconresolved WHERE id = ?', (pagename,))
+        changed = [pagename]
+        if self.inherit and row[0]:
+            changed.extend(self._update_subtree(pagename))
+        return changed
+
+    def _remove(self, pagename):
+        for name in self._delete(pagename):
+            self.emit('icon-changed', name)
+
+    def set_page_icon(self, pagename, icon):
+        '''
+        Set the icon for the page without changing its text,
+        remove it if icon is None. Only the row of the page
+        (and subpages which inherit its icon) is updated.
+        '''
+        if icon == self.overrides.get_icon(pagename):
+            return
+        self.overrides.set_icon(pagename, icon)
+        self.update_pages([pagename])
+
+    def set_icons_for_tags(self, icons_for_tags):
+        '''
+        Set new icons for tags and update icons
+        only for pages with changed tags.
+        The table with icons for tags and resolved icons
+        are changed in one transaction.
+        '''
+        old, new = self.icons_for_tags, dict(icons_for_tags)
+        changed = [tag for tag in set(old) | set(new)
+                   if old.get(tag) != new.get(tag)]
+        self.icons_for_tags = new
+        if not changed:
+            return
+
+        self.engine.set_icons_for_tags(new)
+        self.tagicons.set_mapping(new)
+        self._update_tags(changed)
+
+    def set_tag_rules(self, rules):
+        '''
+        Set new rules for tags and update icons only for pages
+        with tags which icons are changed by the rules.
+        '''
+        rules = [tuple(a) for a in rules]
+        if rules == self.tag_rules:
+            return
+
+        old = self.engine
+        self.tag_rules = rules
+        self.engine = TagIconsEngine(self.icons_for_tags, rules, old.mode)
+        self.rulestable.set_rules('tag', rules)
+        # Priorities of rules matter for pages with several icons.
+        changed = [tag for tag in self.tagsindex.list_all_tags()
+                   if old.get_rank(tag) != self.engine.get_rank(tag)]
+        self._update_tags(changed)
+
+    def set_name_rules(self, rules):
+        '''
+        Set new rules for page names and update icons only
+        for pages which match different rules.
+        '''
+        rules = [tuple(a) for a in rules]
+        if rules == self.name_rules:
+            return
+
+        old = self.name_matcher
+        self.name_rules = rules
+        self.name_matcher = PageNameRulesMatcher(rules)
+        self.rulestable.set_rules('name', rules)
+        self.update_pages([name for (name,) in self.db.execute('SELECT name FROM pages')
+                            if name and old.match(name) != self.name_matcher.match(name)])
+
+    def _update_tags(self, changed):
+        '''Update pages with the tags and emit signals.'''
+        pagenames = set()
+        for tag in changed:
+            pagenames.update(self.tagsindex.list_pages(tag))
+        self.update_pages(pagenames)
+
+    def update_pages(self, pagenames):
+        '''
+        Update pages after changes of settings and emit signals,
+        changes are committed in an idle callback.
+        '''
+        changed = []
+        for pagename in pagenames:
+            changed.extend(self._update_page(pagename))
+        self.index.set_property(self.PROPERTY_NAME, self._signature())
+        self.queue_commit()
+        for pagename in changed:
+            self.emit('icon-changed', pagename)
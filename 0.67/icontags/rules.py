@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import logging
+
+from .iconutils import ICONS, SEVERAL_ICONS
+from .matchers import TagRulesMatcher
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+EXPLICIT_PRIORITY = 0 # priority of icons assigned to tags
+
+# How to choose an icon for a page with several tags with different icons.
+SEVERAL_ICONS_ERROR = 'error' # show SEVERAL_ICONS
+SEVERAL_ICONS_PRIORITY = 'priority' # icon of the tag with the best priority
+SEVERAL_ICONS_SPECIFIC = 'specific' # icon of the most specific tag
+SEVERAL_ICONS_MODES = (SEVERAL_ICONS_ERROR, SEVERAL_ICONS_PRIORITY, SEVERAL_ICONS_SPECIFIC)
+
+# Table contains rules to choose icons: kind of the rule ('tag' or 'name'),
+# a pattern, the name of the icon and the priority of the rule
+# (rules with lower values are preferred).
+
+class IconRulesTable(object):
+    '''
+    This class keeps rules for icons in the index.
+    Like L{TagIconsTable} rules are imported once from the plugin
+    uistate ('Icon Rules') and all changes are copied back to it.
+    '''
+    PROPERTY_NAME = 'icontags-rules'
+    DB_FORMAT = '0.1'
+    UISTATE_KEY = 'Icon Rules'
+    INIT_SCRIPT = '''
+        CREATE TABLE IF NOT EXISTS iconrules (
+        kind TEXT,
+        pattern TEXT,
+        icon TEXT,
+        priority INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS iconrules_kind ON iconrules(kind);
+        '''
+
+    TEARDOWN_SCRIPT = '''
+        DROP TABLE IF EXISTS "iconrules";
+        DELETE FROM zim_index WHERE key = %r;
+        ''' % PROPERTY_NAME
+
+    def __init__(self, index, uistate):
+        self.index = index
+        self.db = index._db # XXX
+        self.uistate = uistate
+        self.uistate.setdefault(self.UISTATE_KEY, []) # list of (kind, pattern, icon, priority)
+
+        # Table is created by 'init_plugin_tables'.
+        if self.index.get_property(self.PROPERTY_NAME) != self.DB_FORMAT:
+            self.db.execute('DELETE FROM iconrules')
+            self.db.executemany(
+                'INSERT INTO iconrules (kind, pattern, icon, priority) VALUES (?, ?, ?, ?)',
+                (tuple(a) for a in self.uistate[self.UISTATE_KEY] if len(a) == 4))
+            self.index.set_property(self.PROPERTY_NAME, self.DB_FORMAT)
+
+    def get_rules(self, kind):
+        '''Return list of tuples (pattern, icon, priority) in the order of adding.'''
+        return [(pattern, icon, priority) for pattern, icon, priority in self.db.execute(
+                'SELECT pattern, icon, priority FROM iconrules WHERE kind = ? ORDER BY rowid',
+                (kind,)) if icon in ICONS]
+
+    def set_rules(self, kind, rules):
+        '''
+        Replace rules of the kind and copy all rules to the uistate.
+        Changes are committed by L{IconsResolver} with resolved icons.
+        '''
+        self.db.execute('DELETE FROM iconrules WHERE kind = ?', (kind,))
+        self.db.executemany(
+            'INSERT INTO iconrules (kind, pattern, icon, priority) VALUES (?, ?, ?, ?)',
+            ((kind,) + tuple(a) for a in rules))
+        self.uistate[self.UISTATE_KEY] = [list(a) for a in self.db.execute(
+            'SELECT kind, pattern, icon, priority FROM iconrules ORDER BY rowid')]
+
+
+class TagIconsEngine(object):
+    '''
+    This class chooses one icon for a set of tags. Icons for tags are
+    assigned explicitly or chosen by L{TagRulesMatcher}. If tags have
+    different icons the result depends on the mode:
+      - 'error': SEVERAL_ICONS is returned
+      - 'priority': icon of the tag with the lowest priority value
+        (assigned icons have priority 0), then the most specific one
+      - 'specific': icon of the most specific tag (assigned icons
+        and exact rules match the whole tag name), then by priority
+    Many pages have the same tags, so results are memoized
+    by the set of tags. The memo is dropped when rules are changed,
+    create a new engine for new rules or mode.
+    '''
+
+    def __init__(self, icons_for_tags, tag_rules, mode = SEVERAL_ICONS_ERROR):
+        self.icons_for_tags = icons_for_tags
+        self.matcher = TagRulesMatcher(tag_rules)
+        self.mode = mode if mode in SEVERAL_ICONS_MODES else SEVERAL_ICONS_ERROR
+        self._memo = {} # frozenset of tags -> icon or None
+
+    def set_icons_for_tags(self, icons_for_tags):
+        self.icons_for_tags = icons_for_tags
+        self._memo.clear()
+
+    def get_tag_icon(self, tag):
+        '''Return icon assigned to the tag or chosen by rules, or None.'''
+        return self.icons_for_tags.get(tag) or self.matcher.match(tag)
+
+    def get_rank(self, tag):
+        '''Return tuple (priority, specificity, icon) for the tag or None.'''
+        icon = self.icons_for_tags.get(tag)
+        if icon:
+            return EXPLICIT_PRIORITY, len(tag), icon
+        best = self.matcher.match_rank(tag)
+        if best:
+            (priority, neg_specificity, order), icon = best
+            return priority, -neg_specificity, icon
+        return None
+
+    def resolve_tags(self, tags):
+        '''Return icon for the page with the tags or None if tags have no icons.'''
+        key = frozenset(tags)
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+
+        ranks = [(self.get_rank(tag), tag) for tag in key]
+        ranks = [(a[0], a[1], a[2], tag) for a, tag in ranks if a]
+        icons = set(a[2] for a in ranks)
+        if len(icons) < 2:
+            icon = icons.pop() if icons else None
+        elif self.mode == SEVERAL_ICONS_PRIORITY:
+            icon = min(ranks, key = lambda a: (a[0], -a[1], a[3]))[2]
+        elif self.mode == SEVERAL_ICONS_SPECIFIC:
+            icon = min(ranks, key = lambda a: (-a[1], a[0], a[3]))[2]
+        else:
+            icon = SEVERAL_ICONS
+
+        self._memo[key] = icon
+        return icon
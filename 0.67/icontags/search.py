@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import logging
+
+from zim.signals import ConnectorMixin
+
+from .names import PageNames, TAG_PREFIX, ICON_PREFIX, MAX_RESULTS
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+
+class PageNamesIndex(PageNames, ConnectorMixin):
+    '''
+    L{PageNames} for the notebook index, names are updated by signals.
+    '''
+
+    def __init__(self, index):
+        PageNames.__init__(self, index._db) # XXX
+        self.connectto_all(index.update_iter.pages, (
+            'page-row-inserted', 'page-row-deleted'))
+
+    def on_page_row_inserted(self, o, row):
+        self.add_name(row['name'])
+
+    def on_page_row_deleted(self, o, row):
+        self.remove_name(row['name'])
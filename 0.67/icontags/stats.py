@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import functools
+import logging
+
+from timeit import default_timer as timer
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+# Statistics are collected from the start if the variable is set,
+# otherwise they are enabled by the plugin preference.
+ENVIRON_KEY = 'ZIM_ICONTAGS_STATS'
+N_BUCKETS = 24 # buckets of histograms: < 1us, < 2us, < 4us ... >= 4s
+
+
+class Histogram(object):
+    '''
+    Latency histogram with buckets for powers of two of microseconds.
+    Only numbers are kept, so adding a value is cheap.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * N_BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        n = min(int(seconds * 1e6).bit_length(), N_BUCKETS - 1)
+        self.buckets[n] += 1
+
+    def percentile(self, fraction):
+        '''Return the upper bound of the bucket with the percentile in seconds.'''
+        limit = fraction * self.count
+        n_values = 0
+        for n, count in enumerate(self.buckets):
+            n_values += count
+            if n_values >= limit:
+                return min((1 << n) / 1e6, self.max)
+        return self.max
+
+
+class Statistics(object):
+    '''
+    Counters and latency histograms for hot paths of the plugin.
+    Callers check 'enabled' before they measure anything, so
+    disabled statistics cost one attribute lookup.
+    '''
+
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.counters = {} # name -> number
+        self.histograms = {} # name -> Histogram
+
+    def incr(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        try:
+            histogram = self.histograms[name]
+        except KeyError:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def format(self):
+        '''Return text with all counters and histograms.'''
+        lines = ['Counters:']
+        for name, value in sorted(self.counters.iteritems()):
+            lines.append('  {:<32} {:>10}'.format(name, value))
+
+        lines.append('Timings (ms): count, total, mean, p50, p90, p99, max')
+        for name, h in sorted(self.histograms.iteritems()):
+            lines.append('  {:<32} {:>8} {:>10.1f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f}'.format(
+                name, h.count, h.total * 1e3, h.total * 1e3 / h.count,
+                h.percentile(0.5) * 1e3, h.percentile(0.9) * 1e3,
+                h.percentile(0.99) * 1e3, h.max * 1e3))
+        return '\n'.join(lines)
+
+    def log(self):
+        '''Write all statistics to the log.'''
+        logger.info('IconTags: Statistics\n%s', self.format())
+
+
+STATS = Statistics(bool(os.environ.get(ENVIRON_KEY)))
+
+
+def timed(name):
+    '''Decorator to add the time of every call to the histogram 'name'.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not STATS.enabled:
+                return func(*args, **kwargs)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STATS.add_time(name, timer() - start)
+        return wrapper
+    return decorator
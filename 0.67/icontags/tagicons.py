@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import logging
+
+from .iconutils import ICONS
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+# Table contains tag.name and the name of the icon assigned to the tag.
+# It is kept in the index next to zim tables with tags,
+# so icons for tags can be checked and resolved with joins.
+
+class TagIconsTable(object):
+    '''
+    This class keeps icons assigned to tags in the index.
+    Icons are imported once from the plugin uistate ('Icons for Tags')
+    and all changes are copied back to it, so the uistate
+    still has the mapping if the index is rebuilt.
+    '''
+    PROPERTY_NAME = 'icontags-tagicons'
+    DB_FORMAT = '0.1'
+    UISTATE_KEY = 'Icons for Tags'
+    INIT_SCRIPT = '''
+        CREATE TABLE IF NOT EXISTS tagicons (
+        tag TEXT PRIMARY KEY,
+        icon TEXT
+        );
+        CREATE INDEX IF NOT EXISTS tagicons_icon ON tagicons(icon);
+        '''
+
+    TEARDOWN_SCRIPT = '''
+        DROP TABLE IF EXISTS "tagicons";
+        DELETE FROM zim_index WHERE key = %r;
+        ''' % PROPERTY_NAME
+
+    def __init__(self, index, uistate):
+        self.index = index
+        self.db = index._db # XXX
+        self.uistate = uistate
+        self.uistate.setdefault(self.UISTATE_KEY, {}) # set icons for available tags
+
+        # Table is created by 'init_plugin_tables'.
+        if self.index.get_property(self.PROPERTY_NAME) != self.DB_FORMAT:
+            self.db.execute('DELETE FROM tagicons')
+            self.db.executemany(
+                'INSERT OR REPLACE INTO tagicons (tag, icon) VALUES (?, ?)',
+                self.uistate[self.UISTATE_KEY].iteritems())
+            self.index.set_property(self.PROPERTY_NAME, self.DB_FORMAT)
+            logger.debug('IconTags: Icons for tags are imported from uistate')
+
+        self.validate()
+        self.uistate[self.UISTATE_KEY] = self.get_mapping()
+
+    def validate(self):
+        '''Remove icons for tags which are not available and unknown icons.'''
+        self.db.execute(
+            '''
+            DELETE FROM tagicons WHERE tag IN (
+                SELECT tagicons.tag FROM tagicons
+                LEFT JOIN tags ON tags.name = tagicons.tag
+                WHERE tags.id IS NULL)''')
+        unknown = [a for (a,) in self.db.execute('SELECT DISTINCT icon FROM tagicons')
+                   if a not in ICONS]
+        self.db.executemany('DELETE FROM tagicons WHERE icon = ?',
+                            ((a,) for a in unknown))
+
+    def get_mapping(self):
+        '''Return dict with icons for tags.'''
+        return dict(self.db.execute('SELECT tag, icon FROM tagicons'))
+
+    def set_mapping(self, icons_for_tags):
+        '''
+        Replace icons for tags and copy them to the uistate.
+        Changes are committed by L{IconsResolver} with resolved icons.
+        '''
+        self.db.execute('DELETE FROM tagicons')
+        self.db.executemany(
+            'INSERT INTO tagicons (tag, icon) VALUES (?, ?)',
+            icons_for_tags.iteritems())
+        self.uistate[self.UISTATE_KEY] = dict(icons_for_tags)
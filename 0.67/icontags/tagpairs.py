@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+# The module doesn't import zim or gtk, so it is tested without them.
+
+import re
+
+
+
+# Tags are merge candidates if most pages of the smaller tag
+# also have the other tag.
+MERGE_MIN_OVERLAP = 0.8
+MERGE_MIN_PAGES = 2 # ignore pairs with fewer common pages
+
+_SEPARATORS_RE = re.compile(r'[-_.\s]+', re.U)
+
+
+def _normalize_tag(tag):
+    '''Return a name to compare similar tags, e.g. 'To-Do' and 'todos'.'''
+    name = _SEPARATORS_RE.sub('', tag.lower())
+    if len(name) > 3 and name.endswith('s'):
+        name = name[:-1]
+    return name
+
+
+class TagPairs(object):
+    '''
+    Sparse matrix with the number of pages for every pair of tags
+    present on the same page. It is computed in one pass over
+    pages of 'tagsindex' (see L{PageTagsIndex}) and updated
+    with 'add_tag' and 'remove_tag'.
+    '''
+
+    def __init__(self, tagsindex):
+        self.tagsindex = tagsindex
+        self._pairs = {} # tag -> {other tag: number of pages with both tags}
+        self.load()
+
+    def load(self):
+        '''Count pairs of tags for all pages.'''
+        pairs = {}
+        for tags in self.tagsindex.iter_page_tags():
+            for i, a in enumerate(tags):
+                for b in tags[i + 1:]:
+                    row = pairs.setdefault(a, {})
+                    row[b] = row.get(b, 0) + 1
+                    row = pairs.setdefault(b, {})
+                    row[a] = row.get(a, 0) + 1
+        self._pairs = pairs
+
+    def _change(self, tag, others, delta):
+        for other in others:
+            if other == tag:
+                continue
+            for a, b in ((tag, other), (other, tag)):
+                row = self._pairs.setdefault(a, {})
+                n = row.get(b, 0) + delta
+                if n > 0:
+                    row[b] = n
+                else:
+                    row.pop(b, None)
+                    if not row:
+                        del self._pairs[a]
+
+    def add_tag(self, pagename, tag):
+        self._change(tag, self.tagsindex.list_tags(pagename), 1)
+
+    def remove_tag(self, pagename, tag):
+        # The tag is already removed from the page.
+        self._change(tag, self.tagsindex.list_tags(pagename), -1)
+
+    def n_common_pages(self, tag, other):
+        '''Return number of pages with both tags.'''
+        return self._pairs.get(tag, {}).get(other, 0)
+
+    def list_related(self, tag):
+        '''
+        Return list of tuples (other tag, number of common pages, overlap)
+        sorted by number of common pages; overlap is the part of pages
+        with 'tag' which also have 'other tag'.
+        '''
+        n_pages = self.tagsindex.n_list_pages(tag) or 1
+        related = [(other, n, float(n) / n_pages)
+                   for other, n in self._pairs.get(tag, {}).iteritems()]
+        related.sort(key=lambda a: (-a[1], a[0]))
+        return related
+
+    def list_merge_candidates(self):
+        '''
+        Return list of tuples (tag, other tag, number of common pages, overlap)
+        for tags which probably mean the same: most pages of one tag
+        have the other tag or tags have similar names.
+        '''
+        candidates = {}
+        n_pages = self.tagsindex.n_list_pages
+        for tag, row in self._pairs.iteritems():
+            for other, n in row.iteritems():
+                if tag >= other or n < MERGE_MIN_PAGES:
+                    continue
+                overlap = float(n) / (min(n_pages(tag), n_pages(other)) or 1)
+                if overlap >= MERGE_MIN_OVERLAP:
+                    candidates[(tag, other)] = (n, overlap)
+
+        # Tags with similar names.
+        names = {}
+        for tag in self.tagsindex.list_all_tags():
+            names.setdefault(_normalize_tag(tag), []).append(tag)
+        for tags in names.itervalues():
+            tags.sort()
+            for i, tag in enumerate(tags):
+                for other in tags[i + 1:]:
+                    if (tag, other) not in candidates:
+                        n = self.n_common_pages(tag, other)
+                        overlap = float(n) / (min(n_pages(tag), n_pages(other)) or 1)
+                        candidates[(tag, other)] = (n, overlap)
+
+        result = [a + b for a, b in candidates.iteritems()]
+        result.sort(key=lambda a: (-a[3], -a[2], a[0]))
+        return result
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import weakref
+import logging
+
+from zim.signals import SignalEmitter, ConnectorMixin
+from zim.utils import natural_sort_key
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+
+class PageTagsIndex(SignalEmitter, ConnectorMixin):
+    '''
+    In memory index with tags for every page and pages for every tag.
+    It is loaded with one query and updated by signals of the tags indexer,
+    so plugin views can get tags without SQL queries.
+    There is one shared object for a notebook index, use 'new_from_index'.
+    Tags for a page are stored as tuples and replaced on change,
+    so they can be read from other threads.
+    '''
+
+    # define signals we want to use - (closure type, return type and arg types)
+    # Signals are emitted after the index is updated with (pagename, tag).
+    __signals__ = {
+        'tag-added': (None, None, (object, object)),
+        'tag-removed': (None, None, (object, object)),
+    }
+
+    _instances = weakref.WeakKeyDictionary() # index -> PageTagsIndex
+
+    @classmethod
+    def new_from_index(cls, index):
+        '''Return the shared object for the index.'''
+        try:
+            return cls._instances[index]
+        except KeyError:
+            obj = cls(index)
+            cls._instances[index] = obj
+            return obj
+
+    def __init__(self, index):
+        self.db = index._db # XXX
+        self._page_tags = {} # pagename -> tuple of tags
+        self._tag_pages = {} # tag -> set of pagenames
+        self.load()
+
+        def on_tag_added(o, row, pagerow):
+            self._add(pagerow['name'], row['name'])
+
+        def on_tag_removed(o, row, pagerow):
+            self._remove(pagerow['name'], row['name'])
+
+        self.connectto_all(index.update_iter.tags, (
+            ('tag-added-to-page', on_tag_added),
+            ('tag-removed-from-page', on_tag_removed),
+        ))
+        self.connectto(index.update_iter.pages, 'page-row-deleted',
+                       lambda o, row: self._remove_page(row['name']))
+
+    def load(self):
+        '''Load all tags for all pages.'''
+        page_tags, tag_pages = {}, {}
+        for pagename, tag in self.db.execute(
+                '''
+                SELECT pages.name, tags.name FROM tagsources
+                JOIN pages ON pages.id = tagsources.source
+                JOIN tags ON tags.id = tagsources.tag'''):
+            page_tags.setdefault(pagename, []).append(tag)
+            tag_pages.setdefault(tag, set()).add(pagename)
+
+        self._page_tags = dict((a, tuple(sorted(b, key=natural_sort_key)))
+                               for a, b in page_tags.iteritems())
+        self._tag_pages = tag_pages
+        logger.debug('IconTags: Tags loaded for %i pages', len(page_tags))
+
+    def list_tags(self, pagename):
+        '''Return tuple with tags for the page.'''
+        return self._page_tags.get(pagename, ())
+
+    def iter_page_tags(self):
+        '''Yield tuples with tags for all pages which have tags.'''
+        return self._page_tags.itervalues()
+
+    def has_tags(self, pagename):
+        return pagename in self._page_tags
+
+    def list_pages(self, tag):
+        '''Return set with names of pages for the tag, don't change it.'''
+        return self._tag_pages.get(tag, frozenset())
+
+    def n_list_pages(self, tag):
+        return len(self._tag_pages.get(tag, ()))
+
+    def list_all_tags(self):
+        '''Return list with all tags which have pages.'''
+        return self._tag_pages.keys()
+
+    def _add(self, pagename, tag):
+        tags = self._page_tags.get(pagename, ())
+        if tag in tags:
+            return
+        self._page_tags[pagename] = tuple(sorted(tags + (tag,), key=natural_sort_key))
+        self._tag_pages.setdefault(tag, set()).add(pagename)
+        self.emit('tag-added', pagename, tag)
+
+    def _remove(self, pagename, tag):
+        tags = self._page_tags.get(pagename, ())
+        if tag not in tags:
+            return
+        tags = tuple(a for a in tags if a != tag)
+        if tags:
+            self._page_tags[pagename] = tags
+        else:
+            del self._page_tags[pagename]
+
+        pages = self._tag_pages[tag]
+        pages.discard(pagename)
+        if not pages:
+            del self._tag_pages[tag]
+        self.emit('tag-removed', pagename, tag)
+
+    def _remove_page(self, pagename):
+        for tag in self.list_tags(pagename):
+            self._remove(pagename, tag)
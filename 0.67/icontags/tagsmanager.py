@@ -4,14 +4,24 @@
 # released under the GNU GPL version 3.
 # This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
 
+import re
+import gobject
 import gtk
 import pango
 
 from zim.notebook import Path
-from zim.gui.widgets import  ScrolledWindow, Dialog, SingleClickTreeView
-from zim.notebook.index.tags import TagsView
+from zim.gui.widgets import  ScrolledWindow, Dialog, SingleClickTreeView, \
+    ErrorDialog, QuestionDialog
 
 from .iconutils import render_icon, RESERVED_ICON_NAMES, ICONS
+from .tagsindex import PageTagsIndex
+from .cooccurrence import TagsCooccurrence
+from .tagsoperations import TagsOperation, TagsOperationDialog
+from .listmodel import LazyListModel
+from .stats import timed
+
+
+_TAG_NAME_RE = re.compile(r'^\w+$', re.U)
 
 
 
@@ -20,7 +30,7 @@ class TagsManagerDialog(Dialog):
     Tags Manager dialog to do some basic operations with
     tags and to set icons for tags.
     '''
-    def __init__(self, window, index, uistate):
+    def __init__(self, window, index, uistate, resolver):
 
         Dialog.__init__(self, window, _('Tags Manager (IconTags plugin)'), # T: dialog title
                         buttons=gtk.BUTTONS_OK_CANCEL,
@@ -30,25 +40,55 @@ class TagsManagerDialog(Dialog):
         # which is already determined for this class.
         self._window = window
         self.plugin_uistate = uistate
+        self.resolver = resolver
         self.show_pages_button = gtk.ToggleButton('Show Pages')
         self.show_pages_button.connect('toggled', self.toggle_show_pages)
         self.add_extra_button(self.show_pages_button)
+        self.show_related_button = gtk.ToggleButton(_('Related Tags')) # T: button label
+        self.show_related_button.connect('toggled', self.toggle_show_related)
+        self.add_extra_button(self.show_related_button)
+        merge_button = gtk.Button(_('Merge Candidates')) # T: button label
+        merge_button.connect('clicked', self.show_merge_candidates)
+        self.add_extra_button(merge_button)
+        rules_button = gtk.Button(_('Rules')) # T: button label
+        rules_button.connect('clicked', self.edit_tag_rules)
+        self.add_extra_button(rules_button)
+
+        self.index = index
+        self._cooccurrence = None # loaded when it is needed first time
+        self._related_update_id = None
 
-        self.treeview_tags = TagsManagerTagsView(index, self.plugin_uistate['Icons for Tags'])
+        self.treeview_tags = TagsManagerTagsView(index, resolver.icons_for_tags)
         self.treeview_pages = TagsManagerPagesView(index, window.ui)
+        self.treeview_related = TagsManagerRelatedView()
         self.scrolled_widget = ScrolledWindow(self.treeview_tags)
-        self.vbox.pack_start(self.scrolled_widget, True)
+        self.scrolled_related = ScrolledWindow(self.treeview_related)
+        self.scrolled_related.set_no_show_all(True)
+        pane = gtk.HPaned()
+        pane.pack1(self.scrolled_widget, resize = True)
+        pane.pack2(self.scrolled_related, resize = False)
+        self.vbox.pack_start(pane, True)
 
         self.treeview_tags.connect('row-activated', self.get_tag)
+        self.treeview_tags.connect('button-press-event', self.on_tags_button_press)
+        self.treeview_tags.get_selection().connect('changed',
+                                                   lambda o: self.update_related())
+        self.treeview_related.connect('row-activated', lambda treeview, path, column:
+                                      self.select_tag(treeview.get_tag(path)))
+        self.connect('destroy', self.on_destroy)
 
         # Enable left/right arrows to navigate between views.
         self.treeview_tags.connect('key-release-event', self.toggle_view)
         self.treeview_pages.connect('key-release-event', self.toggle_view)
 
-        # Update if tags change.
+        # Update only changed rows if tags change.
         self.connectto_all(index.update_iter.tags, (
-            ('tag-row-inserted', lambda *a: self.update()),
-            ('tag-row-deleted', lambda *a: self.update())
+            ('tag-row-inserted', lambda o, row: self.treeview_tags.update_tag(row['name'])),
+            ('tag-row-deleted', lambda o, row: self.treeview_tags.remove_tag(row['name']))
+        ))
+        self.connectto_all(PageTagsIndex.new_from_index(index), (
+            ('tag-added', self.on_page_tags_changed),
+            ('tag-removed', self.on_page_tags_changed)
         ))
 
         self.show_all()
@@ -67,10 +107,130 @@ class TagsManagerDialog(Dialog):
         tag = '@' + model.get_value(model.get_iter(path), treeview.TAG_COL)
         self._window.pageview.view.get_buffer().insert_tag_at_cursor(tag)
 
-    def update(self):
-        '''Update both tags and pages trees.'''
-        self.treeview_tags.refill_model()
-        self.treeview_pages.refill_model(self.treeview_pages.current_tag)
+    def on_page_tags_changed(self, o, pagename, tag):
+        self.treeview_tags.update_tag(tag)
+        self.treeview_pages.update_page(pagename, tag)
+
+        # Co-occurrence counts are updated by the same signal,
+        # so the related tags are shown after all handlers are called.
+        if self.show_related_button.get_active() and not self._related_update_id:
+            self._related_update_id = gobject.idle_add(self._on_related_update)
+
+    def on_destroy(self, o):
+        self.treeview_tags.cancel_refresh()
+        self.treeview_pages.cancel_refresh()
+        if self._related_update_id:
+            gobject.source_remove(self._related_update_id)
+            self._related_update_id = None
+
+    def _on_related_update(self):
+        self._related_update_id = None
+        self.update_related()
+        return False # to not call again
+
+    @property
+    def cooccurrence(self):
+        if self._cooccurrence is None:
+            self._cooccurrence = TagsCooccurrence.new_from_index(self.index)
+        return self._cooccurrence
+
+    def get_selected_tag(self):
+        return self.treeview_tags.get_selected_key()
+
+    def select_tag(self, tag):
+        '''Select the tag in the tags view.'''
+        self.show_pages_button.set_active(False)
+        self.treeview_tags.select_key(tag, scroll = True)
+
+    def update_related(self):
+        '''Show tags related to the selected tag.'''
+        if self.show_related_button.get_active():
+            tag = self.get_selected_tag()
+            self.treeview_related.set_tags(
+                tag, self.cooccurrence.list_related(tag) if tag else [])
+
+    def toggle_show_related(self, button):
+        ''' 'Related Tags' button is clicked.'''
+        if button.get_active():
+            self.scrolled_related.set_no_show_all(False)
+            self.scrolled_related.show_all()
+            self.update_related()
+        else:
+            self.scrolled_related.hide()
+            self.scrolled_related.set_no_show_all(True)
+
+    def show_merge_candidates(self, button):
+        ''' 'Merge Candidates' button is clicked.'''
+        dialog = MergeCandidatesDialog(self, self.cooccurrence)
+        dialog.run()
+
+    def edit_tag_rules(self, button):
+        ''' 'Rules' button is clicked.'''
+        rules = IconRulesDialog(self, _('Icon Rules for Tags'), # T: dialog title
+                                _('Icons for tags without an assigned icon, patterns are\n'
+                                  'names ("todo"), prefixes ("proj-*") or globs ("*-2017").\n'
+                                  'Rules with lower priority values are preferred.'),
+                                self.resolver.tag_rules).run()
+        if rules is not None:
+            self.resolver.set_tag_rules(rules)
+
+    def on_tags_button_press(self, treeview, event):
+        '''Show menu with operations for the tag by the right click.'''
+        if event.button != 3:
+            return False
+        pathinfo = treeview.get_path_at_pos(int(event.x), int(event.y))
+        if not pathinfo:
+            return False
+        path = pathinfo[0]
+        treeview.get_selection().select_path(path)
+        tag = unicode(treeview.model.get_value(treeview.model.get_iter(path),
+                                               treeview.TAG_COL), 'utf-8')
+
+        menu = gtk.Menu()
+        for label, callback in (
+                (_('Rename or Merge...'), self.rename_tag), # T: menu item
+                (_('Delete from Pages'), self.delete_tag)): # T: menu item
+            item = gtk.MenuItem(label)
+            item.connect('activate', lambda item, callback=callback: callback(tag))
+            menu.append(item)
+        menu.show_all()
+        menu.popup(None, None, None, event.button, event.time)
+        return True
+
+    def rename_tag(self, tag):
+        '''Rename the tag in all pages, existing name merges tags.'''
+        new_tag = RenameTagDialog(self, tag).run()
+        if new_tag:
+            self.run_tags_operation(TagsOperation([tag], new_tag))
+
+    def delete_tag(self, tag):
+        '''Remove the tag from all pages.'''
+        n_pages = PageTagsIndex.new_from_index(self.index).n_list_pages(tag)
+        if QuestionDialog(self, (
+                _('Delete tag?'), # T: dialog title
+                _('Tag "@%s" will be removed from %i pages.') % (tag, n_pages)
+                )).run():
+            self.run_tags_operation(TagsOperation([tag]))
+
+    def run_tags_operation(self, operation):
+        '''Apply the operation to pages with its tags and update icons for tags.'''
+        tagsindex = PageTagsIndex.new_from_index(self.index)
+        pagenames = set()
+        for tag in operation.tags:
+            pagenames.update(tagsindex.list_pages(tag))
+
+        dialog = TagsOperationDialog(self, self._window.ui, self.index,
+                                     operation, pagenames)
+        dialog.run()
+
+        # Icons follow the changed tags in the dialog, like other
+        # changes of icons they are saved only with the OK button.
+        self.treeview_tags.icons_for_tags = operation.update_icons_for_tags(
+            self.treeview_tags.icons_for_tags, dialog.result)
+
+        for tag in operation.tags + [operation.new_tag]:
+            if tag:
+                self.treeview_tags.update_tag(tag)
 
     def toggle_show_pages(self, button):
         ''' 'Show Pages' button is clicked.'''
@@ -82,7 +242,7 @@ class TagsManagerDialog(Dialog):
             self.scrolled_widget.add(self.treeview_pages)
             # Set values for 'self.treeview_pages'.
             if iter:
-                selected_tag = model.get_value(iter, self.treeview_tags.TAG_COL)
+                selected_tag = unicode(model.get_value(iter, self.treeview_tags.TAG_COL), 'utf-8')
                 self.treeview_pages.refill_model(selected_tag)
         else:
             self.scrolled_widget.add(self.treeview_tags)
@@ -94,32 +254,154 @@ class TagsManagerDialog(Dialog):
 
     def do_response_ok(self, *a):
         ''' OK button is pressed.'''
-        self.plugin_uistate['Icons for Tags'] = self.treeview_tags.icons_for_tags
+        # Icons are saved in the index and copied to the uistate,
+        # icons are updated only for pages with changed tags.
+        self.resolver.set_icons_for_tags(self.treeview_tags.icons_for_tags)
         self.result = True
         return True
 
 
-class TagsManagerTagsView(SingleClickTreeView):
+class RenameTagDialog(Dialog):
+    '''Dialog to enter a new name for the tag.'''
+
+    def __init__(self, parent, tag):
+        Dialog.__init__(self, parent, _('Rename Tag'), # T: dialog title
+                        buttons=gtk.BUTTONS_OK_CANCEL)
+        self.tag = tag
+        self.add_text(_('Rename "@%s" in all pages.\n'
+                        'If a tag with the new name exists, tags are merged.') % tag)
+        self.add_form((('name', 'string', _('Name')),), {'name': tag})
+
+    def do_response_ok(self):
+        name = (self.form['name'] or '').strip().lstrip('@')
+        if not _TAG_NAME_RE.match(name):
+            ErrorDialog(self, _('Not a valid tag name: %s') % name).run()
+            return False
+        self.result = name if name != self.tag else None
+        return True
+
+
+class _LazyListView(SingleClickTreeView):
+    '''
+    Base class for views with L{LazyListModel}. Rows have fixed height,
+    so the view doesn't ask for values of rows which are not shown.
+    Clicked column headers sort rows by SQL.
+    '''
+    KEY_COL = 0 # column with the key of L{LazyListModel}
+
+    def __init__(self):
+        SingleClickTreeView.__init__(self)
+        self.set_fixed_height_mode(True)
+        self.model = None
+        self._orders = {} # column -> list of tuples (sql column, descending)
+        self._sort_column = None
+        self._sort_reverse = False
+        self._refresh_id = None
+
+    def append_lazy_column(self, col, order = None, width = None):
+        '''Add column, 'order' is a list of tuples (sql column, descending).'''
+        col.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+        if width:
+            col.set_fixed_width(width)
+        if order:
+            self._orders[col] = order
+            col.set_clickable(True)
+            col.connect('clicked', self.on_column_clicked)
+        self.append_column(col)
+
+    def get_order(self):
+        return [(a, desc != self._sort_reverse) for a, desc in self._orders[self._sort_column]]
+
+    def set_sort(self, col, reverse = False):
+        '''Sort rows by the column.'''
+        for a in self.get_columns():
+            a.set_sort_indicator(a is col)
+        col.set_sort_order(gtk.SORT_DESCENDING if reverse else gtk.SORT_ASCENDING)
+        self._sort_column, self._sort_reverse = col, reverse
+
+        if self.model is not None:
+            key = self.get_selected_key()
+            self.model.set_order(self.get_order())
+            # Rebuild rows in the view for the new order.
+            self.set_model(None)
+            self.set_model(self.model)
+            if key:
+                self.select_key(key)
+
+    def on_column_clicked(self, col):
+        self.set_sort(col, not self._sort_reverse if col is self._sort_column else False)
+
+    def set_lazy_model(self, model):
+        self.cancel_refresh() # the new model has all changes
+        self.model = model
+        self.set_model(model)
+
+    def get_selected_key(self):
+        model, iter = self.get_selection().get_selected()
+        if iter:
+            return unicode(model.get_value(iter, self.KEY_COL), 'utf-8')
+        return None
+
+    def select_key(self, key, scroll = False):
+        iter = self.model.get_iter_for_key(key) if self.model else None
+        if iter:
+            path = self.model.get_path(iter)
+            self.get_selection().select_path(path)
+            if scroll:
+                self.scroll_to_cell(path)
+        return iter
+
+    def queue_refresh(self):
+        '''
+        Set a new model once after all current changes,
+        the selection and the first visible row are kept.
+        '''
+        if self.model is not None and not self._refresh_id:
+            self._refresh_id = gobject.idle_add(self._on_refresh)
+
+    def _on_refresh(self):
+        self._refresh_id = None
+        key = self.get_selected_key()
+        visible = self.get_visible_range()
+        self.set_lazy_model(self.model.copy())
+        if visible and visible[0][0] < len(self.model):
+            self.scroll_to_cell(visible[0], None, True, 0.0, 0.0)
+        if key:
+            self.select_key(key)
+        return False # to not call again
+
+    def cancel_refresh(self):
+        if self._refresh_id:
+            gobject.source_remove(self._refresh_id)
+            self._refresh_id = None
+
+
+class TagsManagerTagsView(_LazyListView):
     '''
     Class to show tags with icons in a treeview.
     Is used in Tags Manager Dialog.
+    Tags with numbers of pages and icons are kept in a temporary
+    table with indexes for every order, rows are fetched by L{LazyListModel}.
+    After changes in the table the view sets a new model.
     '''
     TAG_COL = 0 # column with tag name
     ICON_COL = 1 # column with icon image
-    ICON_NAME = 2 # column to sort ICON_COL
+    ICON_NAME = 2 # column with icon name
     N_PAGES_COL = 3 # column to show number of pages
+    KEY_COL = TAG_COL
+
+    SOURCE = 'SELECT tag, sortkey, icon, n_pages FROM icontags_tagcounts'
 
     def __init__(self, index, preferences):
-        self.index = index
+        self.db = index._db # XXX
+        self.tagsindex = PageTagsIndex.new_from_index(index)
         # Icons corresponding to tags, prevent unnecessary changing.
         self.icons_for_tags = preferences.copy()
+        _LazyListView.__init__(self)
 
-        self.model = gtk.ListStore(str, gtk.gdk.Pixbuf, str, int) # TAG_COL, ICON_COL, ICON_NAME, N_PAGES_COL
-        SingleClickTreeView.__init__(self, self.model)
-
-        cells = (('Tags', self.TAG_COL, True),
-                 ('Pages', self.N_PAGES_COL, False))
-        for name, col_id, expand in cells:
+        columns = (('Tags', self.TAG_COL, True, [('sortkey', False), ('tag', False)]),
+                   ('Pages', self.N_PAGES_COL, False, [('n_pages', True), ('sortkey', False)]))
+        for name, col_id, expand, order in columns:
             cell = gtk.CellRendererText()
             cell.set_property('ellipsize', pango.ELLIPSIZE_END)
             cell.set_property('cell-background', 'white')
@@ -127,34 +409,61 @@ class TagsManagerTagsView(SingleClickTreeView):
             col.set_attributes(cell, text = col_id)
             col.set_resizable(expand)
             col.set_expand(expand)
-            col.set_sort_column_id(col_id)
-            self.append_column(col)
+            self.append_lazy_column(col, order, None if expand else 60)
+            if col_id == self.N_PAGES_COL:
+                pages_column = col
 
         cell = gtk.CellRendererPixbuf()
         cell.set_property('cell-background', 'white')
-        col = gtk.TreeViewColumn('Icon', cell)
-        col.set_attributes(cell, pixbuf = self.ICON_COL)
-        col.set_resizable(False)
-        col.set_expand(False)
-        col.set_sort_column_id(self.ICON_NAME)
-        self.append_column(col)
+        self.icon_column = gtk.TreeViewColumn('Icon', cell)
+        self.icon_column.set_attributes(cell, pixbuf = self.ICON_COL)
+        self.icon_column.set_resizable(False)
+        self.icon_column.set_expand(False)
+        self.append_lazy_column(self.icon_column, [('icon', False), ('sortkey', False)], 50)
 
+        # Sort tags by number of pages and then by names.
+        self.set_sort(pages_column)
+        self._init_table()
         self.refill_model()
 
+    def _init_table(self):
+        '''
+        Create the temporary table once for the connection. Schema changes
+        commit the current transaction of the index, so they are not
+        repeated on every refill.
+        '''
+        if self.db.execute("SELECT 1 FROM sqlite_temp_master "
+                           "WHERE name = 'icontags_tagcounts'").fetchone():
+            return
+        self.db.execute(
+            '''
+            CREATE TEMP TABLE icontags_tagcounts (
+                tag TEXT PRIMARY KEY,
+                sortkey TEXT,
+                icon TEXT,
+                n_pages INTEGER
+            )''')
+        for name, columns in (('n_pages', 'n_pages, sortkey'),
+                              ('sortkey', 'sortkey'),
+                              ('icon', 'icon, sortkey')):
+            self.db.execute(
+                'CREATE INDEX temp.icontags_tagcounts_%s '
+                'ON icontags_tagcounts(%s)' % (name, columns))
+
     def row_activated(self, path, column):
-        if column.get_sort_column_id() != self.ICON_NAME:
+        if column is not self.icon_column:
             return False
 
         def set_icon(path, icon_name = None):
 
             tag = self.model.get_value(self.model.get_iter(path), self.TAG_COL)
-            tag = unicode(tag) #  to use with non latin characters
+            tag = unicode(tag, 'utf-8') #  to use with non latin characters
 
             if icon_name:
                 self.icons_for_tags[tag] = icon_name
             else:
                 self.icons_for_tags.pop(tag, None)
-            self.refill_model()
+            self.update_tag(tag)
             return True
 
         menu = gtk.Menu()
@@ -178,27 +487,57 @@ class TagsManagerTagsView(SingleClickTreeView):
         menu.show_all()
         menu.popup(None, None, None, 3, 0)
 
+    @timed('tagsmanager.refill_tags')
     def refill_model(self):
         '''Update model.'''
-        self.model.clear()
-
-        tagview = TagsView.new_from_index(self.index)
-        for tag in [a.name for a in tagview.list_all_tags()]:
-            if tag in self.icons_for_tags:
-                icon_name = self.icons_for_tags[tag]
-                rendered_icon = render_icon(ICONS[icon_name])
-            else:
-                icon_name, rendered_icon = None, None
-
-            self.model.append([tag, rendered_icon, icon_name,
-                               tagview.n_list_pages(tag)])
-
-        # Sort tags by number of pages and then by names.
-        self.model.set_sort_column_id(self.TAG_COL, order = gtk.SORT_ASCENDING)
-        self.model.set_sort_column_id(self.N_PAGES_COL, order = gtk.SORT_DESCENDING)
-
-
-class TagsManagerPagesView(SingleClickTreeView):
+        # Tags with numbers of pages are taken with one query.
+        self.db.execute('DELETE FROM icontags_tagcounts')
+        self.db.execute(
+            '''
+            INSERT INTO icontags_tagcounts
+            SELECT tags.name, lower(tags.name), '', count(tagsources.source) FROM tags
+            LEFT JOIN tagsources ON tagsources.tag = tags.id
+            GROUP BY tags.id''')
+        self.db.executemany(
+            'UPDATE icontags_tagcounts SET icon = ? WHERE tag = ?',
+            ((b, a) for a, b in self.icons_for_tags.iteritems()))
+
+        self.set_lazy_model(LazyListModel(
+            self.db, self.SOURCE, (), ('tag', 'icon', 'n_pages'),
+            (str, gtk.gdk.Pixbuf, str, int), self._convert, 'tag', self.get_order()))
+
+    def _convert(self, row):
+        '''Return values for the row from (tag, icon name, number of pages).'''
+        tag, icon_name, n_pages = row
+        if icon_name in ICONS:
+            return tag, render_icon(ICONS[icon_name]), icon_name, n_pages
+        return tag, None, None, n_pages
+
+    def _get_iter(self, tag):
+        return self.model.get_iter_for_key(tag)
+
+    def update_tag(self, tag):
+        '''
+        Update the row for the tag or insert it if the tag exists.
+        Only visible rows are fetched again.
+        '''
+        values = (self.icons_for_tags.get(tag, ''), self.tagsindex.n_list_pages(tag), tag)
+        cursor = self.db.execute(
+            'UPDATE icontags_tagcounts SET icon = ?, n_pages = ? WHERE tag = ?', values)
+        if not cursor.rowcount:
+            self.db.execute(
+                '''
+                INSERT INTO icontags_tagcounts
+                SELECT name, lower(name), ?, ? FROM tags WHERE name = ?''', values)
+        self.queue_refresh()
+
+    def remove_tag(self, tag):
+        '''Remove the row for the tag.'''
+        self.db.execute('DELETE FROM icontags_tagcounts WHERE tag = ?', (tag,))
+        self.queue_refresh()
+
+
+class TagsManagerPagesView(_LazyListView):
     '''
     Class to show pages for a selected tag.
     Is used in Tags Manager Dialog.
@@ -206,19 +545,28 @@ class TagsManagerPagesView(SingleClickTreeView):
     PAGE_COL = 0 # column with page name
     TAGS_N_COL = 1 # column with number of tags for the page
     TAGS_COL = 2 # column with all tags for the page
+    KEY_COL = PAGE_COL
+
+    # Pages with numbers of tags for the tag.
+    SOURCE = '''
+        SELECT pages.name AS name, count(ts.tag) AS n_tags
+        FROM tagsources AS current
+        JOIN pages ON pages.id = current.source
+        LEFT JOIN tagsources AS ts ON ts.source = current.source
+        WHERE current.tag = (SELECT id FROM tags WHERE name = ?)
+        GROUP BY pages.id'''
 
     def __init__(self, index, ui):
-        self.tagview = TagsView.new_from_index(index)
+        self.db = index._db # XXX
+        self.tagsindex = PageTagsIndex.new_from_index(index)
         self.ui = ui
         self.current_tag = None
+        _LazyListView.__init__(self)
 
-        self.model = gtk.ListStore(str, int, str) # PAGE_COL, TAGS_COL
-        SingleClickTreeView.__init__(self, self.model)
-
-        cells = (('Page', self.PAGE_COL, True),
-                 ('N', self.TAGS_N_COL, False),
-                 ('Tags', self.TAGS_COL, True))
-        for name, col_id, expand in cells:
+        columns = (('Page', self.PAGE_COL, True, [('name', False)]),
+                   ('N', self.TAGS_N_COL, False, [('n_tags', False), ('name', False)]),
+                   ('Tags', self.TAGS_COL, True, None))
+        for name, col_id, expand, order in columns:
             cell = gtk.CellRendererText()
             cell.set_property('ellipsize', pango.ELLIPSIZE_END)
             cell.set_property('cell-background', 'white')
@@ -226,32 +574,216 @@ class TagsManagerPagesView(SingleClickTreeView):
             col.set_attributes(cell, text = col_id)
             col.set_resizable(expand)
             col.set_expand(expand)
-            col.set_sort_column_id(col_id)
-            self.append_column(col)
+            self.append_lazy_column(col, order, None if expand else 40)
+            if col_id == self.PAGE_COL:
+                # Sort pages by names.
+                self.set_sort(col, reverse = True)
 
         self.connect('row-activated', lambda treeview, path, column:
                               self.row_activated(path, column))
         self.refill_model()
 
+    @timed('tagsmanager.refill_pages')
     def refill_model(self, tag = None):
         '''Update model.'''
-        self.model.clear()
-        self.current_tag = tag
-
-        if tag:
-            tag = unicode(tag) #  to use with non latin names
-
-            for page in self.tagview.list_pages(tag):
-                # Exclude current tag to not include it in sorting.
-                tags = [tag] + sorted([a.name for a in self.tagview.list_tags(page)
-                               if a.name != tag])
-                self.model.append([page.name, len(tags), ', '.join(tags)])
-
-        # Sort pages by names.
-        self.model.set_sort_column_id(self.PAGE_COL, order = gtk.SORT_DESCENDING)
+        if isinstance(tag, str): # tags from gtk models are utf-8 strings
+            tag = unicode(tag, 'utf-8') #  to use with non latin names
+        self.current_tag = tag or None
+        self.set_lazy_model(LazyListModel(
+            self.db, self.SOURCE, (self.current_tag,), ('name', 'n_tags'),
+            (str, int, str), self._convert, 'name', self.get_order()))
+
+    def _convert(self, row):
+        '''Return values for the row from (pagename, number of tags).'''
+        pagename, n_tags = row
+        # Exclude current tag to not include it in sorting.
+        tags = [self.current_tag] + sorted([a for a in self.tagsindex.list_tags(pagename)
+                                            if a != self.current_tag])
+        return (pagename, n_tags, ', '.join(tags))
+
+    def update_page(self, pagename, tag):
+        '''
+        Refresh the view after the tag is added to or removed from the page,
+        only visible rows are fetched again.
+        '''
+        if self.current_tag and (tag == self.current_tag or
+                                 pagename in self.tagsindex.list_pages(self.current_tag)):
+            self.queue_refresh()
 
     def row_activated(self, path, column):
         '''Open page in the view.'''
         name = self.model.get_value(self.model.get_iter(path), self.PAGE_COL)
         self.ui.open_page(Path(name))
 
+
+class TagsManagerRelatedView(SingleClickTreeView):
+    '''
+    Class to show tags which are present on the same pages
+    as a selected tag. Is used in Tags Manager Dialog.
+    '''
+    TAG_COL = 0 # column with tag name
+    N_PAGES_COL = 1 # column with number of common pages
+    OVERLAP_COL = 2 # column with percent of pages of the selected tag
+
+    def __init__(self):
+        self.current_tag = None
+        self.model = gtk.ListStore(str, int, int) # TAG_COL, N_PAGES_COL, OVERLAP_COL
+        SingleClickTreeView.__init__(self, self.model)
+
+        cells = (('Related Tags', self.TAG_COL, True),
+                 ('Pages', self.N_PAGES_COL, False),
+                 ('%', self.OVERLAP_COL, False))
+        for name, col_id, expand in cells:
+            cell = gtk.CellRendererText()
+            cell.set_property('ellipsize', pango.ELLIPSIZE_END)
+            cell.set_property('cell-background', 'white')
+            col = gtk.TreeViewColumn(name, cell)
+            col.set_attributes(cell, text = col_id)
+            col.set_resizable(expand)
+            col.set_expand(expand)
+            col.set_sort_column_id(col_id)
+            self.append_column(col)
+
+    def set_tags(self, tag, related):
+        '''
+        Show related tags, 'related' is a list of tuples
+        (tag, number of common pages, overlap) from L{TagsCooccurrence}.
+        '''
+        self.current_tag = tag
+        model = gtk.ListStore(str, int, int) # TAG_COL, N_PAGES_COL, OVERLAP_COL
+        for other, n_pages, overlap in related:
+            model.append((other, n_pages, int(round(overlap * 100))))
+        self.model = model
+        self.set_model(model)
+
+    def get_tag(self, path):
+        return unicode(self.model.get_value(self.model.get_iter(path), self.TAG_COL), 'utf-8')
+
+
+class MergeCandidatesDialog(Dialog):
+    '''
+    Dialog with pairs of tags which are probably used for the same:
+    most pages with one tag also have the other tag or tags
+    have similar names. Activated row selects the tag in Tags Manager.
+    '''
+
+    def __init__(self, manager, cooccurrence):
+        Dialog.__init__(self, manager, _('Merge Candidates'), # T: dialog title
+                        buttons=gtk.BUTTONS_CLOSE,
+                        defaultwindowsize=(450, 350) )
+        self.manager = manager
+
+        self.model = gtk.ListStore(str, str, int, int) # tag, other tag, common pages, overlap
+        for tag, other, n_pages, overlap in cooccurrence.list_merge_candidates():
+            self.model.append((tag, other, n_pages, int(round(overlap * 100))))
+
+        self.treeview = SingleClickTreeView(self.model)
+        cells = (('Tag', 0, True), ('Tag', 1, True),
+                 ('Pages', 2, False), ('%', 3, False))
+        for name, col_id, expand in cells:
+            cell = gtk.CellRendererText()
+            cell.set_property('ellipsize', pango.ELLIPSIZE_END)
+            col = gtk.TreeViewColumn(name, cell)
+            col.set_attributes(cell, text = col_id)
+            col.set_resizable(expand)
+            col.set_expand(expand)
+            col.set_sort_column_id(col_id)
+            self.treeview.append_column(col)
+        self.treeview.connect('row-activated', self.on_row_activated)
+
+        self.vbox.pack_start(ScrolledWindow(self.treeview), True)
+        self.show_all()
+
+    def on_row_activated(self, treeview, path, column):
+        iter = self.model.get_iter(path)
+        col = 1 if column.get_sort_column_id() == 1 else 0
+        self.manager.select_tag(unicode(self.model.get_value(iter, col), 'utf-8'))
+
+
+class IconRulesDialog(Dialog):
+    '''
+    Dialog to edit rules for icons: list of tuples (pattern, icon, priority).
+    After 'run' attribute 'result' is the new list or None.
+    '''
+    PATTERN_COL = 0
+    ICON_COL = 1
+    PRIORITY_COL = 2
+
+    def __init__(self, parent, title, text, rules):
+        Dialog.__init__(self, parent, title,
+                        buttons=gtk.BUTTONS_OK_CANCEL,
+                        defaultwindowsize=(400, 300) )
+        self.add_text(text)
+
+        self.model = gtk.ListStore(str, str, int) # PATTERN_COL, ICON_COL, PRIORITY_COL
+        for rule in rules:
+            self.model.append(rule)
+
+        self.treeview = gtk.TreeView(self.model)
+        cell = gtk.CellRendererText()
+        cell.set_property('editable', True)
+        cell.connect('edited', self.on_edited, self.PATTERN_COL, unicode)
+        col = gtk.TreeViewColumn(_('Pattern'), cell, text = self.PATTERN_COL)
+        col.set_expand(True)
+        self.treeview.append_column(col)
+
+        icons = gtk.ListStore(str)
+        for name in sorted(a for a in ICONS if a not in RESERVED_ICON_NAMES):
+            icons.append((name,))
+        cell = gtk.CellRendererCombo()
+        cell.set_property('model', icons)
+        cell.set_property('text-column', 0)
+        cell.set_property('has-entry', False)
+        cell.set_property('editable', True)
+        cell.connect('edited', self.on_edited, self.ICON_COL, unicode)
+        self.treeview.append_column(
+            gtk.TreeViewColumn(_('Icon'), cell, text = self.ICON_COL))
+
+        cell = gtk.CellRendererText()
+        cell.set_property('editable', True)
+        cell.connect('edited', self.on_edited, self.PRIORITY_COL, int)
+        self.treeview.append_column(
+            gtk.TreeViewColumn(_('Priority'), cell, text = self.PRIORITY_COL))
+
+        self.vbox.pack_start(ScrolledWindow(self.treeview), True)
+
+        hbox = gtk.HButtonBox()
+        hbox.set_layout(gtk.BUTTONBOX_START)
+        for stock, callback in ((gtk.STOCK_ADD, self.add_rule),
+                                (gtk.STOCK_REMOVE, self.remove_rule)):
+            button = gtk.Button(stock = stock)
+            button.connect('clicked', callback)
+            hbox.add(button)
+        self.vbox.pack_start(hbox, False)
+        self.show_all()
+
+    def on_edited(self, cell, path, text, column, convert):
+        try:
+            value = convert(text.decode('utf-8').strip())
+        except ValueError:
+            return
+        self.model[path][column] = value
+
+    def add_rule(self, button):
+        iter = self.model.append(('', '', 0))
+        self.treeview.set_cursor(self.model.get_path(iter),
+                                 self.treeview.get_column(self.PATTERN_COL), True)
+
+    def remove_rule(self, button):
+        model, iter = self.treeview.get_selection().get_selected()
+        if iter:
+            model.remove(iter)
+
+    def do_response_ok(self):
+        rules = []
+        for row in self.model:
+            pattern = unicode(row[self.PATTERN_COL], 'utf-8')
+            icon = unicode(row[self.ICON_COL], 'utf-8')
+            if not pattern and not icon:
+                continue # empty row
+            if not pattern or icon not in ICONS:
+                ErrorDialog(self, _('Rule needs a pattern and an icon: %s') % pattern).run()
+                return False
+            rules.append((pattern, icon, row[self.PRIORITY_COL]))
+        self.result = rules
+        return True
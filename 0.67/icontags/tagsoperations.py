@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import io
+import gobject
+import gtk
+import threading
+import Queue
+import logging
+
+from zim.notebook import Path
+from zim.gui.widgets import Dialog
+
+from .tagstext import TagsOperation
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+N_WORKERS = 4 # number of threads which rewrite page sources
+BATCH_SIZE = 50 # number of files taken by a thread at once
+PROGRESS_INTERVAL = 100 # ms between updates of the progress bar
+
+
+class TagsRewriter(object):
+    '''
+    Pool of threads which apply L{TagsOperation} to files in batches.
+    Every file is written to a temporary file and renamed,
+    so a cancelled operation doesn't leave broken files.
+    '''
+
+    def __init__(self, operation, paths, n_workers = N_WORKERS):
+        self.operation = operation
+        self.total = len(paths)
+        self.n_done = 0
+        self.changed = [] # paths of rewritten files
+        self.errors = [] # (path, error) for files which were not rewritten
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        for i in range(0, len(paths), BATCH_SIZE):
+            self._queue.put(paths[i:i + BATCH_SIZE])
+
+        self._threads = [threading.Thread(target=self._run, name='IconTagsRewriter')
+                         for i in range(min(n_workers, self._queue.qsize()))]
+
+    def start(self):
+        gobject.threads_init()
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def cancel(self):
+        '''Stop after files which are being rewritten now.'''
+        self._cancelled.set()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    @property
+    def done(self):
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _run(self):
+        while not self._cancelled.is_set():
+            try:
+                batch = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+
+            changed, errors = [], []
+            for path in batch:
+                if self._cancelled.is_set():
+                    break
+                try:
+                    if self._rewrite(path):
+                        changed.append(path)
+                except (IOError, OSError, UnicodeError) as error:
+                    logger.exception('IconTags: Error while rewriting file: %s', path)
+                    errors.append((path, error))
+
+            with self._lock:
+                self.n_done += len(batch)
+                self.changed.extend(changed)
+                self.errors.extend(errors)
+
+    def _rewrite(self, path):
+        '''Rewrite the file, return True if it was changed.'''
+        with io.open(path, encoding = 'utf-8', newline = '') as file:
+            text = file.read()
+        text, n = self.operation.replace(text)
+        if not n:
+            return False
+
+        tmp_path = path + '.icontags~'
+        with io.open(tmp_path, 'w', encoding = 'utf-8', newline = '') as file:
+            file.write(text)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path) # rename doesn't replace files on windows
+        os.rename(tmp_path, path)
+        return True
+
+
+def _get_source_file(notebook, pagename):
+    '''Return zim File object with the source of the page.'''
+    file, folder = notebook.layout.map_page(Path(pagename))
+    return file
+
+
+def reindex_files(index, files):
+    '''Update the index only for changed files, other pages are not checked.'''
+    for file in files:
+        index.update_file(file)
+
+
+class TagsOperationDialog(Dialog):
+    '''
+    Dialog with progress of L{TagsOperation} for given pages.
+    The operation can be cancelled, in any case changed pages are
+    reindexed once after all workers are stopped.
+    After 'run' attribute 'result' is True if the operation was completed.
+    '''
+
+    def __init__(self, parent, ui, index, operation, pagenames):
+        Dialog.__init__(self, parent, _('Updating Tags'), # T: dialog title
+                        buttons=gtk.BUTTONS_CANCEL)
+        self.ui = ui
+        self.index = index
+        self.result = False
+
+        # Save changes in the open page before its file is rewritten.
+        page = ui.page
+        self._current_page = page.name if page and page.name in pagenames else None
+        if self._current_page:
+            ui.save_page()
+
+        self._files = {} # path -> zim File object
+        for pagename in pagenames:
+            file = _get_source_file(ui.notebook, pagename)
+            if file and file.exists():
+                self._files[file.path] = file
+
+        self.progressbar = gtk.ProgressBar()
+        self.vbox.pack_start(self.progressbar, False)
+
+        self.rewriter = TagsRewriter(operation, sorted(self._files))
+        self.rewriter.start()
+        self._timer_id = gobject.timeout_add(PROGRESS_INTERVAL, self._on_timer)
+        self.connect('destroy', self.on_destroy)
+        self.show_all()
+
+    def _on_timer(self):
+        rewriter = self.rewriter
+        fraction = float(rewriter.n_done) / rewriter.total if rewriter.total else 1.0
+        self.progressbar.set_fraction(fraction)
+        self.progressbar.set_text('%i / %i' % (rewriter.n_done, rewriter.total))
+        if rewriter.done:
+            self._timer_id = None
+            self.result = True
+            self._finish()
+            self.response(gtk.RESPONSE_OK)
+            return False # to not call again
+        return True
+
+    def _finish(self):
+        self.rewriter.join()
+        changed = [self._files[a] for a in self.rewriter.changed]
+        logger.debug('IconTags: %i pages rewritten', len(changed))
+        if changed:
+            reindex_files(self.index, changed)
+        if self._current_page:
+            self.ui.reload_page()
+        if self.rewriter.errors:
+            logger.error('IconTags: %i pages were not updated', len(self.rewriter.errors))
+
+    def do_response_ok(self):
+        return True
+
+    def on_destroy(self, o):
+        # Dialog is cancelled or closed before workers are finished.
+        if self._timer_id:
+            gobject.source_remove(self._timer_id)
+            self._timer_id = None
+            self.rewriter.cancel()
+            self._finish()
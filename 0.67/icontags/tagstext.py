@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+# The module doesn't import zim or gtk, so it is tested without them.
+
+import re
+
+
+
+# Parts of the text where tags are not parsed: verbatim blocks ('''),
+# inline verbatim ('') and objects like code blocks ({{{code: ...}}}).
+SKIP_RE = r"'''[\s\S]*?'''|''[^\n]*?''|\{\{\{[\s\S]*?\}\}\}"
+
+
+class TagsOperation(object):
+    '''
+    Rename, merge or delete tags in the text of pages.
+    If 'new_tag' is given all 'tags' are replaced by it (to rename
+    a tag or merge several tags into one), otherwise they are deleted.
+    Tags are matched as zim parses them: '@' after a space or at the
+    beginning of a line and the name up to the end of the word.
+    Verbatim text and code blocks are not changed, zim doesn't parse
+    tags there.
+    '''
+
+    def __init__(self, tags, new_tag = None):
+        self.tags = list(tags)
+        self.new_tag = new_tag
+        regex = r'(?<![^\s])@(?:%s)(?!\w)' % '|'.join(re.escape(a) for a in self.tags)
+        if not new_tag:
+            regex += r'[ \t]?' # remove one space after deleted tag
+        # Skipped parts are matched first and kept as they are.
+        self._regex = re.compile('(%s)|%s' % (SKIP_RE, regex), re.U)
+
+    def replace(self, text):
+        '''Return new text and number of replacements.'''
+        new = '@' + self.new_tag if self.new_tag else ''
+        counter = [0]
+
+        def replace(match):
+            if match.group(1) is not None:
+                return match.group(1)
+            counter[0] += 1
+            return new
+
+        text = self._regex.sub(replace, text)
+        return text, counter[0]
+
+    def update_icons_for_tags(self, icons_for_tags, completed = True):
+        '''
+        Return new mapping with icons for tags after the operation.
+        If the operation was not completed, old tags keep their icons.
+        '''
+        mapping = icons_for_tags.copy()
+        icons = [mapping[a] for a in self.tags if a in mapping]
+        if completed:
+            for tag in self.tags:
+                mapping.pop(tag, None)
+        if self.new_tag and icons and self.new_tag not in mapping:
+            mapping[self.new_tag] = icons[0]
+        return mapping
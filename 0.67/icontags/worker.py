@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import gobject
+import sqlite3
+import threading
+import Queue
+import logging
+
+
+
+logger = logging.getLogger('zim.plugins.icontags')
+
+BATCH_SIZE = 100 # max number of rows to compute before posting results
+
+
+class RowValuesWorker(object):
+    '''
+    This class computes values for rows of the tree (icon and tags)
+    in a separate thread with its own read-only connection to the index.
+    Results are posted back to the main loop in batches with 'gobject.idle_add'.
+    Use it as: "worker.request(pagename, token, callback)", the callback is
+    called in the main thread as "callback([(pagename, token, icon, tags), ...])",
+    token is any object to distinguish requests.
+    If values can't be loaded, icon is None and tags are empty,
+    so the page is shown with the default icon.
+    Tags are taken from L{PageTagsIndex}, which is safe to read from the thread.
+    '''
+
+    def __init__(self, dbpath, tagsindex):
+        self.dbpath = dbpath
+        self.tagsindex = tagsindex
+        self._queue = Queue.Queue()
+        self._results = []
+        self._lock = threading.Lock()
+        self._flush_scheduled = False
+
+        gobject.threads_init()
+        self._thread = threading.Thread(target=self._run,
+                                        name='IconTagsRowValuesWorker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request(self, pagename, token, callback):
+        '''Add page to the queue.'''
+        self._queue.put((pagename, token, callback))
+
+    def stop(self):
+        '''Stop the thread, pages in the queue are not computed.'''
+        self._queue.put(None)
+
+    def _run(self):
+        db = sqlite3.connect(self.dbpath, check_same_thread=False)
+        db.execute('PRAGMA query_only = ON')
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                # Take all available requests up to the batch size.
+                batch = [item]
+                stop = False
+                while len(batch) < BATCH_SIZE:
+                    try:
+                        item = self._queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+
+                results = []
+                for pagename, token, callback in batch:
+                    try:
+                        icon, tags = self._get_values(db, pagename)
+                    except sqlite3.Error:
+                        logger.exception('IconTags: Error while loading page: %s', pagename)
+                        icon, tags = None, ()
+                    results.append((callback, pagename, token, icon, tags))
+                self._post(results)
+
+                if stop:
+                    break
+        finally:
+            db.close()
+
+    def _get_values(self, db, pagename):
+        '''Return resolved icon name (or None) and list of tags for the page.'''
+        row = db.execute(
+            'SELECT icon, has_tags FROM iconresolved WHERE id = ?',
+            (pagename,)).fetchone()
+        if not row:
+            return None, []
+
+        icon, has_tags = row
+        tags = self.tagsindex.list_tags(pagename) if has_tags else ()
+        return icon, tags
+
+    def _post(self, results):
+        with self._lock:
+            self._results.extend(results)
+            if self._flush_scheduled or not self._results:
+                return
+            self._flush_scheduled = True
+        gobject.idle_add(self._flush)
+
+    def _flush(self):
+        '''Call callbacks with results in the main thread.'''
+        with self._lock:
+            results, self._results = self._results, []
+            self._flush_scheduled = False
+
+        callbacks = {}
+        for callback, pagename, token, icon, tags in results:
+            callbacks.setdefault(callback, []).append((pagename, token, icon, tags))
+        for callback, values in callbacks.iteritems():
+            callback(values)
+        return False # to not call again
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import sys
+import sqlite3
+import unittest
+import __builtin__
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'icontags')
+sys.path.insert(0, PLUGIN_DIR)
+
+if not hasattr(__builtin__, '_'):
+    import gettext
+    gettext.install('zim', unicode = True)
+
+from expression import parse_expression, compile_sql, match_expression
+
+
+class TestParseExpression(unittest.TestCase):
+
+    def testWords(self):
+        self.assertEqual(parse_expression(u'@Project'), ('tag', u'project'))
+        self.assertEqual(parse_expression(u'ICON:Calendar'), ('icon', u'calendar'))
+
+    def testOperators(self):
+        # 'AND' can be omitted and binds stronger than 'OR'.
+        self.assertEqual(parse_expression(u'@a @b OR NOT @c'),
+                         ('or', ('and', ('tag', u'a'), ('tag', u'b')), ('not', ('tag', u'c'))))
+        self.assertEqual(parse_expression(u'@a and (@b or icon:x)'),
+                         ('and', ('tag', u'a'), ('or', ('tag', u'b'), ('icon', u'x'))))
+        self.assertEqual(parse_expression(u'NOT NOT @a'), ('not', ('not', ('tag', u'a'))))
+
+    def testErrors(self):
+        for expression in (u'', u'@', u'icon:', u'word', u'(@a', u'@a)', u'@a OR', u'NOT'):
+            self.assertRaises(ValueError, parse_expression, expression)
+
+
+class TestEvaluateExpression(unittest.TestCase):
+
+    PAGES = {1: ((u'a', u'b'), u'x'), 2: ((u'a',), None), 3: ((), u'x'), 4: ((u'c',), u'y')}
+    EXPRESSIONS = (u'@a', u'icon:x', u'@a @b', u'@a OR icon:y', u'NOT @a',
+                   u'NOT (@a OR @c) icon:x', u'@a AND NOT icon:x')
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.executescript('''
+            CREATE TABLE pages (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE tagsources (source INTEGER, tag INTEGER);
+            CREATE TABLE iconresolved (id TEXT, icon TEXT);
+            ''')
+        tag_ids = {}
+        for id, (tags, icon) in self.PAGES.items():
+            name = u'Page%i' % id
+            self.db.execute('INSERT INTO pages VALUES (?, ?)', (id, name))
+            self.db.execute('INSERT INTO iconresolved VALUES (?, ?)', (name, icon))
+            for tag in tags:
+                tag_id = tag_ids.setdefault(tag, len(tag_ids) + 1)
+                self.db.execute('INSERT INTO tagsources VALUES (?, ?)', (id, tag_id))
+        self.db.executemany('INSERT INTO tags VALUES (?, ?)',
+                            [(id, tag.upper()) for tag, id in tag_ids.items()])
+
+    def testMatch(self):
+        tree = parse_expression(u'@a AND NOT icon:x')
+        self.assertTrue(match_expression(tree, set([u'a']), None))
+        self.assertFalse(match_expression(tree, set([u'a']), u'x'))
+        self.assertFalse(match_expression(tree, set(), u'y'))
+
+    def testSqlAgreesWithMatch(self):
+        for expression in self.EXPRESSIONS:
+            tree = parse_expression(expression)
+            params = []
+            sql = compile_sql(tree, params)
+            found = set(a[0] for a in self.db.execute(sql, params))
+            expected = set(id for id, (tags, icon) in self.PAGES.items()
+                           if match_expression(tree, set(tags), icon))
+            self.assertEqual(found, expected, expression)
+
+
+if __name__ == '__main__':
+    unittest.main()
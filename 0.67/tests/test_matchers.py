@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import sys
+import unittest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'icontags')
+sys.path.insert(0, PLUGIN_DIR)
+
+from matchers import TagRulesMatcher, PageNameRulesMatcher, MAX_GROUPS
+
+
+class TestTagRulesMatcher(unittest.TestCase):
+
+    def testKindsOfPatterns(self):
+        matcher = TagRulesMatcher([(u'project', u'exact', 1),
+                                   (u'proj-*', u'prefix', 1),
+                                   (u'*-2017', u'glob', 1),
+                                   (u't?do', u'question', 1)])
+        self.assertEqual(matcher.match(u'project'), u'exact')
+        self.assertEqual(matcher.match(u'proj-zim'), u'prefix')
+        self.assertEqual(matcher.match(u'report-2017'), u'glob')
+        self.assertEqual(matcher.match(u'todo'), u'question')
+        self.assertEqual(matcher.match(u'projects'), None)
+
+    def testRanking(self):
+        # Lower priority value first.
+        matcher = TagRulesMatcher([(u'a*', u'first', 2), (u'*b', u'second', 1)])
+        self.assertEqual(matcher.match(u'ab'), u'second')
+        # Then more literal characters.
+        matcher = TagRulesMatcher([(u'a*', u'short', 1), (u'ab*', u'long', 1), (u'*bc', u'glob', 1)])
+        self.assertEqual(matcher.match(u'abc'), u'long')
+        # Then the first rule.
+        matcher = TagRulesMatcher([(u'a*', u'first', 1), (u'*b', u'second', 1)])
+        self.assertEqual(matcher.match(u'ab'), u'first')
+        self.assertEqual(matcher.match_rank(u'ab'), ((1, -1, 0), u'first'))
+
+    def testManyGlobs(self):
+        rules = [(u'*-%i' % i, u'icon%i' % i, 1) for i in range(MAX_GROUPS * 2 + 5)]
+        rules.append((u'x*-?', u'best', 0))
+        matcher = TagRulesMatcher(rules)
+        self.assertEqual(matcher.match(u'tag-%i' % (MAX_GROUPS + 3)), u'icon%i' % (MAX_GROUPS + 3))
+        self.assertEqual(matcher.match(u'x-1'), u'best')
+
+
+class TestPageNameRulesMatcher(unittest.TestCase):
+
+    def testLevels(self):
+        matcher = PageNameRulesMatcher([(u'Journal:*:*', u'calendar', 1),
+                                        (u'**:Meeting*', u'users', 1),
+                                        (u'Projects:[!_]*', u'project', 1)])
+        self.assertEqual(matcher.match(u'Journal:2017:05'), u'calendar')
+        self.assertEqual(matcher.match(u'Journal:2017:05:01'), None)
+        self.assertEqual(matcher.match(u'Work:Team:Meeting 1'), u'users')
+        self.assertEqual(matcher.match(u'Meeting'), None)
+        self.assertEqual(matcher.match(u'Projects:Zim'), u'project')
+        self.assertEqual(matcher.match(u'Projects:_Archive'), None)
+        self.assertEqual(matcher.match(u'Projects:Zim:Notes'), None)
+
+    def testRanking(self):
+        matcher = PageNameRulesMatcher([(u'**', u'any', 2),
+                                        (u'A:*', u'short', 1),
+                                        (u'A:B*', u'long', 1),
+                                        (u'A:?', u'late', 1)])
+        self.assertEqual(matcher.match(u'A:Bc'), u'long')
+        self.assertEqual(matcher.match(u'A:C'), u'short')
+        self.assertEqual(matcher.match(u'C'), u'any')
+
+    def testManyRules(self):
+        rules = [(u'P%i:*' % i, u'icon%i' % i, 1) for i in range(MAX_GROUPS * 2 + 5)]
+        matcher = PageNameRulesMatcher(rules)
+        self.assertEqual(matcher.match(u'P%i:Page' % (MAX_GROUPS * 2)), u'icon%i' % (MAX_GROUPS * 2))
+        self.assertEqual(matcher.match(u'P1:Page:Sub'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import sys
+import sqlite3
+import unittest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'icontags')
+sys.path.insert(0, PLUGIN_DIR)
+
+import names
+from names import PageNames, subtree_ranges
+
+
+class TestPageNames(unittest.TestCase):
+
+    PAGES = (u'', u'Home', u'Notes', u'Notes:Home Office', u'Projects',
+             u'Projects:Zim', u'Projects:Zim:Homepage', u'Archive:Shome', u'notes')
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.executescript('''
+            CREATE TABLE pages (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE tagsources (source INTEGER, tag INTEGER);
+            CREATE TABLE iconresolved (id TEXT, icon TEXT);
+            INSERT INTO tags VALUES (1, 'Work');
+            ''')
+        for id, name in enumerate(self.PAGES):
+            self.db.execute('INSERT INTO pages VALUES (?, ?)', (id, name))
+        self.db.execute('INSERT INTO tagsources VALUES (5, 1)') # Projects:Zim
+        self.db.execute('INSERT INTO tagsources VALUES (6, 1)') # Projects:Zim:Homepage
+        self.db.execute("INSERT INTO iconresolved VALUES ('Notes:Home Office', 'home')")
+        self.names = PageNames(self.db)
+
+    def testOrderOfResults(self):
+        # Prefix of the name, then prefix of a part, then any substring.
+        self.assertEqual(self.names.search(u'HOM'),
+                         [u'Home', u'Notes:Home Office', u'Projects:Zim:Homepage', u'Archive:Shome'])
+        self.assertEqual(self.names.search(u'home off'), [u'Notes:Home Office'])
+        self.assertEqual(self.names.search(u'missing'), [])
+        self.assertEqual(self.names.search(u' '), [])
+
+    def testCase(self):
+        self.assertEqual(self.names.search(u'notes'), [u'Notes', u'notes', u'Notes:Home Office'])
+        self.names.remove_name(u'notes')
+        self.assertEqual(self.names.search(u'notes'), [u'Notes', u'Notes:Home Office'])
+
+    def testQualifiers(self):
+        self.assertEqual(self.names.search(u'@work'), [u'Projects:Zim', u'Projects:Zim:Homepage'])
+        self.assertEqual(self.names.search(u'hom @work'), [u'Projects:Zim:Homepage'])
+        self.assertEqual(self.names.search(u'icon:home'), [u'Notes:Home Office'])
+        self.assertEqual(self.names.search(u'@work icon:home'), [])
+
+    def testChanges(self):
+        self.names.search(u'x') # text for the substring search is built
+        self.names.add_name(u'Tasks:Homework')
+        self.names.remove_name(u'Home')
+        self.names.remove_name(u'Unknown')
+        self.assertEqual(self.names.search(u'hom'),
+                         [u'Notes:Home Office', u'Projects:Zim:Homepage',
+                          u'Tasks:Homework', u'Archive:Shome'])
+
+    def testMaxResults(self):
+        for i in range(names.MAX_RESULTS + 10):
+            self.names.add_name(u'Many:Page%i' % i)
+        self.assertEqual(len(self.names.search(u'page')), names.MAX_RESULTS)
+
+
+class TestSubtreeRanges(unittest.TestCase):
+
+    def testSiblingsWithSamePrefix(self):
+        ranges = subtree_ranges(u'A', [u'A:B', u'A:B:C', u'A:B2', u'A:B:C:D'])
+        self.assertEqual(ranges, [(u'A:', True, u'A:B'), (u'A:B', False, u'A:B2'),
+                                  (u'A:B2', False, u'A:B2:'), (u'A:B2;', True, u'A:B:'),
+                                  (u'A:B;', True, u'A;')])
+
+        def included(name):
+            return any((name >= start if inclusive else name > start) and name < end
+                       for start, inclusive, end in ranges)
+
+        for name in (u'A:A', u'A:B-1', u'A:B 2', u'A:B.x', u'A:B20', u'A:Ba', u'A:C'):
+            self.assertTrue(included(name), name)
+        for name in (u'A', u'A:B', u'A:B:C', u'A:B:E', u'A:B2', u'A:B2:x', u'B:A'):
+            self.assertFalse(included(name), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import __builtin__
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # '0.67'
+
+# Unlike other tests this one needs Zim and PyGTK, it is skipped without them.
+try:
+    import gtk
+    from zim.signals import SignalEmitter
+except ImportError:
+    SignalEmitter = None
+else:
+    if not hasattr(__builtin__, '_'):
+        import gettext
+        gettext.install('zim', unicode = True)
+    sys.path.insert(0, PACKAGE_DIR)
+    from icontags.indexer import init_plugin_tables
+    from icontags.resolver import IconsResolver
+    from icontags.tagicons import TagIconsTable
+    from icontags.rules import IconRulesTable
+    from icontags.overrides import IconOverridesTable
+
+    class PagesSignals(SignalEmitter):
+        __signals__ = dict((a, (None, None, (object,))) for a in (
+            'page-row-inserted', 'page-row-changed', 'page-row-deleted'))
+
+    class TagsSignals(SignalEmitter):
+        __signals__ = dict((a, (None, None, (object, object))) for a in (
+            'tag-added-to-page', 'tag-removed-from-page'))
+
+
+class Index(object):
+    '''The part of the zim index which is used by L{IconsResolver}.'''
+
+    def __init__(self, pages, dbpath = ':memory:'):
+        self._db = sqlite3.connect(dbpath)
+        self._db.executescript('''
+            CREATE TABLE zim_index (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE pages (id INTEGER PRIMARY KEY, name TEXT, n_children INTEGER);
+            CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE tagsources (source INTEGER, tag INTEGER);
+            ''')
+        for id, name in enumerate(pages):
+            n_children = sum(1 for a in pages if a and a.rpartition(':')[0] == name)
+            self._db.execute('INSERT INTO pages VALUES (?, ?, ?)', (id, name, n_children))
+        self._db.commit()
+        self.update_iter = type('UpdateIter', (object,), {})()
+        self.update_iter.pages = PagesSignals()
+        self.update_iter.tags = TagsSignals()
+
+    def get_property(self, key):
+        row = self._db.execute('SELECT value FROM zim_index WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_property(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO zim_index VALUES (?, ?)', (key, value))
+
+
+@unittest.skipIf(SignalEmitter is None, 'Zim and PyGTK are not installed')
+class TestIncrementalUpdate(unittest.TestCase):
+
+    # Names like 'Acme2', 'Acme Corp' or 'Acme-1' are sorted between 'Acme'
+    # and its subpages 'Acme:...', they are siblings, not subpages.
+    PAGES = (u'', u'Clients', u'Clients:Acme', u'Clients:Acme:Notes', u'Clients:Acme Corp',
+             u'Clients:Acme-1', u'Clients:Acme.old', u'Clients:Acme2', u'Clients:Acme2:Notes',
+             u'Clients:Beta', u'Clients;', u'Other')
+
+    def setUp(self):
+        self.index = Index(self.PAGES)
+        init_plugin_tables(self.index)
+        self.resolver = IconsResolver(
+            self.index, TagIconsTable(self.index, {}), IconRulesTable(self.index, {}),
+            IconOverridesTable(self.index, {}), False, inherit = True)
+
+    def assertSameAsRebuild(self):
+        query = 'SELECT id, icon, own FROM iconresolved ORDER BY id'
+        updated = self.resolver.db.execute(query).fetchall()
+        self.resolver.rebuild()
+        self.assertEqual(updated, self.resolver.db.execute(query).fetchall())
+
+    def testSiblingsWithSamePrefix(self):
+        self.resolver.set_page_icon(u'Clients:Acme', u'calendar')
+        self.resolver.set_page_icon(u'Clients', u'apply')
+        self.assertEqual(self.resolver.get_icon(u'Clients:Acme2'), (u'apply', False))
+        self.assertEqual(self.resolver.get_icon(u'Clients:Acme:Notes')[0],
+                         self.resolver.get_icon(u'Clients:Acme')[0])
+        self.assertSameAsRebuild()
+
+        self.resolver.set_page_icon(u'Clients:Acme2', u'calendar')
+        self.resolver.set_page_icon(u'Clients', None)
+        self.assertEqual(self.resolver.get_icon(u'Clients:Acme-1'), (u'_default_file', False))
+        self.assertSameAsRebuild()
+
+        self.resolver.set_page_icon(u'Clients:Acme', None)
+        self.resolver.set_page_icon(u'Clients', u'apply')
+        self.assertSameAsRebuild()
+
+
+@unittest.skipIf(SignalEmitter is None, 'Zim and PyGTK are not installed')
+class TestCommit(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        dbpath = os.path.join(self.folder, 'index.db')
+        self.index = Index((u'', u'Page'), dbpath)
+        init_plugin_tables(self.index)
+        self.resolver = IconsResolver(
+            self.index, TagIconsTable(self.index, {}), IconRulesTable(self.index, {}),
+            IconOverridesTable(self.index, {}), False)
+        self.other = sqlite3.connect(dbpath) # like the connection of the worker
+
+    def tearDown(self):
+        self.resolver.commit()
+        self.other.close()
+        self.index._db.close()
+        shutil.rmtree(self.folder)
+
+    def getCommittedIcon(self):
+        return self.other.execute(
+            'SELECT icon FROM iconresolved WHERE id = ?', (u'Page',)).fetchone()
+
+    def testCommit(self):
+        self.assertTrue(self.resolver.uncommitted) # the table is rebuilt
+        self.resolver.commit()
+        self.assertFalse(self.resolver.uncommitted)
+        self.assertEqual(self.getCommittedIcon(), (u'_default_file',))
+
+        self.resolver.set_page_icon(u'Page', u'apply')
+        self.assertTrue(self.resolver.uncommitted)
+        self.resolver.commit()
+        self.assertFalse(self.resolver.uncommitted)
+        self.assertEqual(self.getCommittedIcon(), (u'apply',))
+
+    def testIndexUpdate(self):
+        self.resolver.commit()
+        self.resolver.set_index_updating(True)
+        self.resolver.set_page_icon(u'Page', u'apply')
+        self.resolver.commit() # left for zim
+        self.assertTrue(self.resolver.uncommitted)
+        self.assertEqual(self.getCommittedIcon(), (u'_default_file',))
+        self.index._db.commit()
+        self.resolver.set_index_updating(False)
+        self.assertFalse(self.resolver.uncommitted)
+
+
+if __name__ == '__main__':
+    unittest.main()
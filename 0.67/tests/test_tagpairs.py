@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import sys
+import unittest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'icontags')
+sys.path.insert(0, PLUGIN_DIR)
+
+from tagpairs import TagPairs, _normalize_tag
+
+
+class PageTags(object):
+    '''The part of L{PageTagsIndex} which is used by L{TagPairs}.'''
+
+    def __init__(self, page_tags):
+        self._page_tags = dict((a, tuple(b)) for a, b in page_tags.items())
+
+    def list_tags(self, pagename):
+        return self._page_tags.get(pagename, ())
+
+    def iter_page_tags(self):
+        return iter(self._page_tags.values())
+
+    def n_list_pages(self, tag):
+        return sum(1 for tags in self._page_tags.values() if tag in tags)
+
+    def list_all_tags(self):
+        return sorted(set(a for tags in self._page_tags.values() for a in tags))
+
+    def add(self, pagename, tag):
+        self._page_tags[pagename] = self.list_tags(pagename) + (tag,)
+
+    def remove(self, pagename, tag):
+        self._page_tags[pagename] = tuple(a for a in self.list_tags(pagename) if a != tag)
+
+
+class TestTagPairs(unittest.TestCase):
+
+    def setUp(self):
+        self.tagsindex = PageTags({
+            u'A': (u'zim', u'wiki', u'todo'),
+            u'B': (u'zim', u'wiki'),
+            u'C': (u'zim', u'wiki', u'To-Dos'),
+            u'D': (u'zim',),
+            u'E': (u'python', u'zim'),
+        })
+        self.pairs = TagPairs(self.tagsindex)
+
+    def testCounts(self):
+        self.assertEqual(self.pairs.n_common_pages(u'zim', u'wiki'), 3)
+        self.assertEqual(self.pairs.n_common_pages(u'wiki', u'zim'), 3)
+        self.assertEqual(self.pairs.n_common_pages(u'todo', u'python'), 0)
+
+        self.tagsindex.add(u'E', u'wiki')
+        self.pairs.add_tag(u'E', u'wiki')
+        self.assertEqual(self.pairs.n_common_pages(u'zim', u'wiki'), 4)
+        self.assertEqual(self.pairs.n_common_pages(u'python', u'wiki'), 1)
+
+        self.tagsindex.remove(u'E', u'wiki')
+        self.pairs.remove_tag(u'E', u'wiki')
+        self.assertEqual(self.pairs.n_common_pages(u'python', u'wiki'), 0)
+        self.assertEqual(self.pairs._pairs, TagPairs(self.tagsindex)._pairs)
+
+    def testRelated(self):
+        self.assertEqual(self.pairs.list_related(u'wiki'),
+                         [(u'zim', 3, 1.0), (u'To-Dos', 1, 1.0 / 3), (u'todo', 1, 1.0 / 3)])
+        self.assertEqual(self.pairs.list_related(u'unknown'), [])
+
+    def testMergeCandidates(self):
+        # 'wiki' is always with 'zim', 'todo' and 'To-Dos' have similar names.
+        self.assertEqual(self.pairs.list_merge_candidates(),
+                         [(u'wiki', u'zim', 3, 1.0), (u'To-Dos', u'todo', 0, 0.0)])
+
+    def testNormalizeTag(self):
+        self.assertEqual(_normalize_tag(u'To-Do'), u'todo')
+        self.assertEqual(_normalize_tag(u'to_dos'), u'todo')
+        self.assertEqual(_normalize_tag(u'bus'), u'bus')
+
+
+if __name__ == '__main__':
+    unittest.main()
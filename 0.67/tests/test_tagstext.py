@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+import os
+import sys
+import unittest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'icontags')
+sys.path.insert(0, PLUGIN_DIR)
+
+from tagstext import TagsOperation
+
+
+class TestTagsOperation(unittest.TestCase):
+
+    def testRename(self):
+        operation = TagsOperation([u'todo'], u'task')
+        self.assertEqual(operation.replace(u'@todo first\n\t@todo, @todos and @todo-list'),
+                         (u'@task first\n\t@task, @todos and @task-list', 3))
+        # Only words which zim parses as tags.
+        self.assertEqual(operation.replace(u'mail@todo x@todo (@todo'), (u'mail@todo x@todo (@todo', 0))
+
+    def testMerge(self):
+        operation = TagsOperation([u'a.b', u'c'], u'd')
+        self.assertEqual(operation.replace(u'@a.b @axb @c'), (u'@d @axb @d', 2))
+
+    def testDelete(self):
+        operation = TagsOperation([u'done'])
+        self.assertEqual(operation.replace(u'Task @done  end\n@done'), (u'Task  end\n', 2))
+
+    def testVerbatimIsSkipped(self):
+        operation = TagsOperation([u'todo'], u'task')
+        text = u"''@todo'' @todo\n'''\n@todo\n'''\n{{{code: lang=\"python\"\n@todo\n}}}\n@todo"
+        new_text = u"''@todo'' @task\n'''\n@todo\n'''\n{{{code: lang=\"python\"\n@todo\n}}}\n@task"
+        self.assertEqual(operation.replace(text), (new_text, 2))
+
+    def testIconsForTags(self):
+        icons = {u'a': u'star', u'b': u'bug', u'c': u'home'}
+        self.assertEqual(TagsOperation([u'a', u'b'], u'd').update_icons_for_tags(icons),
+                         {u'c': u'home', u'd': u'star'})
+        self.assertEqual(TagsOperation([u'a'], u'c').update_icons_for_tags(icons, completed = False),
+                         icons)
+        self.assertEqual(TagsOperation([u'a']).update_icons_for_tags(icons),
+                         {u'b': u'bug', u'c': u'home'})
+
+
+if __name__ == '__main__':
+    unittest.main()
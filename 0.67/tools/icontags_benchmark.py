@@ -0,0 +1,386 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+'''
+Scaling benchmark for the IconTags plugin.
+
+Synthetic notebooks of the given sizes are generated (once, they are
+reused by later runs with the same parameters), indexed by zim into
+their local '.zim/index.db' and every subsystem of the plugin is timed:
+
+  index          zim index update with L{IconsIndexer} connected
+  resolve        L{IconsResolver} rebuild of icons for all pages
+  panel_top      top level rows of L{IconsTreeStore} as the panel shows them
+  panel_all      all rows of the tree as if every page was expanded
+  filter_tagged  L{TaggedPagesFilter} load and walk over visible rows
+  filter_expr    L{TagExpressionFilter} load and walk over visible rows
+  tm_tags        Tags Manager tags view: creation with the first fill and
+                 the first window of rows
+  tm_pages       Tags Manager pages view: creation and the fill of pages
+                 for the most used tag
+
+Every size runs in its own process, so results don't depend on caches
+of previous runs. The goal is a scaling curve: for every pair of sizes
+the exponent of growth is printed (1.0 is linear), phases which grow
+faster than 'SUPERLINEAR' are marked.
+
+The tree is walked by a headless view which asks the model for the
+same columns as the panel. Without a display icons are not rendered
+(render_icon returns the name) and Tags Manager phases are skipped,
+run with 'xvfb-run' to include them.
+
+Usage:
+  python2 icontags_benchmark.py --zim /path/to/zim-0.67 \\
+      --sizes 10000,100000,1000000 --workdir /tmp/icontags-bench
+'''
+
+import os
+import sys
+import json
+import math
+import random
+import shutil
+import logging
+import argparse
+import subprocess
+
+from collections import deque
+
+from timeit import default_timer as timer
+
+
+
+logger = logging.getLogger('icontags.benchmark')
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # '0.67'
+PHASES = ('generate', 'index', 'resolve', 'panel_top', 'panel_all',
+          'filter_tagged', 'filter_expr', 'tm_tags', 'tm_pages')
+SUPERLINEAR = 1.2 # exponent of growth marked in the summary
+DEFAULT_ICONS = ('calendar', 'important', 'users', 'home', 'mail', 'note') # shipped in Tags_Icons
+
+
+def _page_names(n_pages, fanout):
+    '''
+    Return names of 'n_pages' pages in a tree where every namespace
+    has up to 'fanout' subpages, e.g. "P0001:P0012:P0003".
+    Parents are always before children.
+    '''
+    names, queue = [], deque([''])
+    while queue and len(names) < n_pages:
+        parent = queue.popleft()
+        for i in range(fanout):
+            if len(names) >= n_pages:
+                break
+            name = '%sP%04i' % (parent + ':' if parent else '', i)
+            names.append(name)
+            queue.append(name)
+    return names
+
+
+def generate_notebook(path, options):
+    '''
+    Write a notebook with zim pages. Tags are taken with a skewed
+    distribution, so few tags are on many pages like in real notebooks.
+    '''
+    rnd = random.Random(options.seed)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    with open(os.path.join(path, 'notebook.zim'), 'w') as file:
+        file.write('[Notebook]\nname=IconTags benchmark\n')
+
+    tags = ['tag%i' % i for i in range(options.n_tags)]
+    icons = list(options.icons)
+    for name in _page_names(options.size, options.fanout):
+        lines = ['Content-Type: text/x-zim-wiki', 'Wiki-Format: zim 0.4', '',
+                 '====== %s ======' % name.rpartition(':')[2], '']
+        if rnd.random() < options.tag_density:
+            n = rnd.randint(1, options.tags_per_page)
+            page_tags = set(tags[int(len(tags) * rnd.random() ** 3)] for i in range(n))
+            lines.append(' '.join('@' + a for a in sorted(page_tags)))
+        if rnd.random() < options.icon_density:
+            lines.append('**[ICON=%s]**' % rnd.choice(icons))
+        lines.append('Some text for the page %s.\n' % name)
+
+        filename = os.path.join(path, *name.split(':')) + '.txt'
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(filename, 'w') as file:
+            file.write('\n'.join(lines))
+
+
+def _notebook_key(options):
+    return json.dumps([options.size, options.fanout, options.n_tags, options.tags_per_page,
+                       options.tag_density, options.icon_density, list(options.icons),
+                       options.seed])
+
+
+class HeadlessView(object):
+    '''
+    Stand-in for the panel treeview: it walks rows of a tree model
+    and asks for the columns which the panel renders.
+    If 'is_visible' is given only visible rows are walked, like with
+    gtk.TreeModelFilter in L{IconsTreeView}.
+    '''
+
+    def __init__(self, model, columns, is_visible = None):
+        self.model = model
+        self.columns = columns
+        self.is_visible = is_visible
+
+    def _visible(self, treeiter):
+        if not self.is_visible:
+            return True
+        return self.is_visible(self.model.get_user_data(treeiter).row['id'])
+
+    def walk(self, expand_all = True):
+        '''Return the number of shown rows.'''
+        n_rows = 0
+        stack = [self.model.get_iter_first()]
+        while stack:
+            treeiter = stack.pop()
+            while treeiter is not None:
+                if self._visible(treeiter):
+                    n_rows += 1
+                    for column in self.columns:
+                        self.model.get_value(treeiter, column)
+                    if expand_all and self.model.iter_has_child(treeiter):
+                        stack.append(self.model.iter_children(treeiter))
+                treeiter = self.model.iter_next(treeiter)
+        return n_rows
+
+
+def _setup_zim(options):
+    '''Make zim and the plugin importable.'''
+    if options.zim:
+        sys.path.insert(0, options.zim)
+    sys.path.insert(0, PLUGIN_DIR)
+    import zim # installs '_' for translations
+    import __builtin__
+    if not hasattr(__builtin__, '_'):
+        import gettext
+        gettext.install('zim', unicode = True)
+
+
+def _open_notebook(path):
+    from zim.fs import Dir
+    from zim.notebook import build_notebook
+    notebook, page = build_notebook(Dir(path))
+    return notebook
+
+
+def run_one(options):
+    '''Run all phases for one size, return dict phase -> seconds.'''
+    results, counts = {}, {}
+    _setup_zim(options)
+    from icontags.iconutils import ICONS, ICONS_DIRECTORY
+    # Unknown icons are dropped from icons for tags and shown as errors
+    # for shortcodes, so the workload would differ from the requested one.
+    unknown = [a for a in options.icons if a not in ICONS]
+    if unknown:
+        raise SystemExit('Unknown icons: %s, icons are taken from %s in zim data folders'
+                         % (', '.join(unknown), ICONS_DIRECTORY))
+
+    path = os.path.join(options.workdir, 'notebook-%i' % options.size)
+    key_file = os.path.join(options.workdir, 'notebook-%i.key' % options.size)
+    key = _notebook_key(options)
+    if not os.path.exists(key_file) or open(key_file).read() != key:
+        start = timer()
+        generate_notebook(path, options)
+        results['generate'] = timer() - start
+        with open(key_file, 'w') as file:
+            file.write(key)
+
+    # Index is always built again from scratch.
+    if os.path.exists(os.path.join(path, '.zim')):
+        shutil.rmtree(os.path.join(path, '.zim'))
+
+    import gtk
+    from icontags import stats
+    stats.STATS.enabled = options.stats
+    from icontags import panelview
+    from icontags.indexer import IconsIndexer, init_plugin_tables
+    from icontags.tagicons import TagIconsTable
+    from icontags.rules import IconRulesTable
+    from icontags.overrides import IconOverridesTable
+    from icontags.resolver import IconsResolver
+    from icontags.filters import TaggedPagesFilter, TagExpressionFilter
+    from icontags.tagsindex import PageTagsIndex
+
+    headless = gtk.gdk.display_get_default() is None
+    if headless:
+        panelview.render_icon = lambda icon: icon
+
+    notebook = _open_notebook(path)
+    index = notebook.index
+    indexer = IconsIndexer.new_from_index(index)
+    start = timer()
+    update = getattr(index, 'check_and_update', None) or index.update # XXX
+    update()
+    results['index'] = timer() - start
+    counts['pages'] = index._db.execute('SELECT count(*) FROM pages').fetchone()[0] # XXX
+
+    # Some tags have icons, like in the Tags Manager.
+    tagsindex = PageTagsIndex.new_from_index(index)
+    init_plugin_tables(index)
+    rnd = random.Random(options.seed)
+    uistate = {'Icons for Tags': dict(
+        (tag, rnd.choice(options.icons)) for tag in tagsindex.list_all_tags()
+        if rnd.random() < options.tag_icon_density)}
+    tagicons = TagIconsTable(index, uistate)
+    rulestable = IconRulesTable(index, uistate)
+    overrides = IconOverridesTable(index, uistate)
+    resolver = IconsResolver(index, tagicons, rulestable, overrides, True)
+    start = timer()
+    resolver.rebuild()
+    results['resolve'] = timer() - start
+
+    columns = (panelview.NAME_COL, panelview.TIP_COL, panelview.ICON_COL)
+    model = panelview.IconsTreeStore(index, resolver, options.show_tags)
+    start = timer()
+    counts['panel_top'] = HeadlessView(model, columns).walk(expand_all = False)
+    results['panel_top'] = timer() - start
+
+    model = panelview.IconsTreeStore(index, resolver, options.show_tags)
+    start = timer()
+    counts['panel_all'] = HeadlessView(model, columns).walk()
+    results['panel_all'] = timer() - start
+
+    for phase, make_filter in (
+            ('filter_tagged', lambda: TaggedPagesFilter(index)),
+            ('filter_expr', lambda: TagExpressionFilter(
+                index, options.expression, resolver))):
+        model = panelview.IconsTreeStore(index, resolver, options.show_tags)
+        start = timer()
+        pagesfilter = make_filter()
+        counts[phase] = HeadlessView(model, columns, pagesfilter.is_visible).walk()
+        results[phase] = timer() - start
+        pagesfilter.disconnect_all()
+
+    if headless:
+        logger.info('No display, Tags Manager phases are skipped')
+    else:
+        from icontags.listmodel import WINDOW_SIZE
+        from icontags.tagsmanager import TagsManagerTagsView, TagsManagerPagesView
+
+        def fetch(view, n_columns):
+            model = view.get_model()
+            treeiter, n = model.get_iter_first(), 0
+            while treeiter is not None and n < WINDOW_SIZE:
+                for column in range(n_columns):
+                    model.get_value(treeiter, column)
+                treeiter, n = model.iter_next(treeiter), n + 1
+
+        # The view fills the model when it is created.
+        start = timer()
+        view = TagsManagerTagsView(index, tagicons.get_mapping())
+        fetch(view, 4)
+        results['tm_tags'] = timer() - start
+
+        tags = tagsindex.list_all_tags()
+        if tags:
+            tag = max(tags, key = tagsindex.n_list_pages)
+            start = timer()
+            view = TagsManagerPagesView(index, None)
+            view.refill_model(tag)
+            fetch(view, 3)
+            results['tm_pages'] = timer() - start
+            counts['tm_pages'] = tagsindex.n_list_pages(tag)
+
+    try:
+        import resource
+        counts['maxrss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    except ImportError:
+        pass
+    if options.stats:
+        logger.info('Statistics for %i pages:\n%s', options.size, stats.STATS.format())
+    return {'size': options.size, 'times': results, 'counts': counts}
+
+
+def print_summary(runs, file = sys.stdout):
+    '''Print times for all sizes and exponents of growth between sizes.'''
+    runs = sorted(runs, key = lambda a: a['size'])
+    sizes = [a['size'] for a in runs]
+    file.write('%-14s' % 'phase' + ''.join('%12i' % a for a in sizes) + '   growth\n')
+    for phase in PHASES:
+        times = [a['times'].get(phase) for a in runs]
+        if not any(a is not None for a in times):
+            continue
+        line = '%-14s' % phase
+        line += ''.join('%11.3fs' % a if a is not None else '%12s' % '-' for a in times)
+        exponents = []
+        for (n1, t1), (n2, t2) in zip(zip(sizes, times), zip(sizes, times)[1:]):
+            if t1 and t2 and n1 != n2:
+                e = math.log(t2 / t1) / math.log(float(n2) / n1)
+                exponents.append('%.2f%s' % (e, '!' if e > SUPERLINEAR else ''))
+        file.write(line + '   ' + ' '.join(exponents) + '\n')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description = 'Scaling benchmark for the IconTags plugin.')
+    parser.add_argument('--zim', help = 'folder with zim 0.67 sources if zim is not installed')
+    parser.add_argument('--workdir', default = os.path.join(os.getcwd(), 'icontags-benchmark'),
+                        help = 'folder for generated notebooks and results')
+    parser.add_argument('--sizes', default = '10000,100000,1000000',
+                        help = 'comma separated numbers of pages')
+    parser.add_argument('--fanout', type = int, default = 20,
+                        help = 'maximal number of subpages of a page')
+    parser.add_argument('--n-tags', type = int, default = 1000,
+                        help = 'number of different tags')
+    parser.add_argument('--tags-per-page', type = int, default = 3,
+                        help = 'maximal number of tags on a tagged page')
+    parser.add_argument('--tag-density', type = float, default = 0.3,
+                        help = 'fraction of pages with tags')
+    parser.add_argument('--icon-density', type = float, default = 0.05,
+                        help = 'fraction of pages with icon shortcodes')
+    parser.add_argument('--tag-icon-density', type = float, default = 0.2,
+                        help = 'fraction of tags with assigned icons')
+    parser.add_argument('--icons', default = ','.join(DEFAULT_ICONS),
+                        help = 'comma separated names of icons for pages and tags, '
+                               'they should be available in the plugin')
+    parser.add_argument('--expression', default = '@tag0 OR icon:calendar',
+                        help = 'expression for the filter_expr phase')
+    parser.add_argument('--show-tags', action = 'store_true',
+                        help = 'show tags after page names in the panel')
+    parser.add_argument('--stats', action = 'store_true',
+                        help = 'log plugin statistics for every size')
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--json', help = 'write results to this file')
+    parser.add_argument('--size', type = int, help = argparse.SUPPRESS) # run one size
+    options = parser.parse_args(argv)
+    options.icons = [a for a in options.icons.split(',') if a]
+
+    logging.basicConfig(level = logging.INFO, stream = sys.stderr,
+                        format = '%(levelname)s %(message)s')
+    if not os.path.isdir(options.workdir):
+        os.makedirs(options.workdir)
+
+    if options.size:
+        # Child process: print results as the last line.
+        result = run_one(options)
+        sys.stdout.write(json.dumps(result) + '\n')
+        return 0
+
+    runs = []
+    for size in [int(a) for a in options.sizes.split(',') if a]:
+        logger.info('Running %i pages', size)
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--size', str(size)] + argv)
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+        print_summary(runs, sys.stderr)
+
+    print_summary(runs)
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump(runs, file, indent = 1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Copyright 2016-2017 Pavel_M <plprgt@gmail.com>,
+# released under the GNU GPL version 3.
+# This is a plugin for Zim-wiki program (zim-wiki.org) by Jaap Karssenberg.
+
+'''
+Startup cost of the IconTags plugin.
+
+Python 2 has no '-X importtime', so imports are timed by a hook around
+'__import__' which prints the same table to stderr:
+"import time: self [us] | cumulative | imported package".
+Zim modules are imported before the hook is installed, like in
+a running Zim, so only the cost of the plugin is shown.
+
+After the plugin is imported the deferred steps are timed too:
+the import of the panel widgets (done when the main window is created),
+the names of icons (needed to resolve icons for pages) and the images
+of icons (loaded when the panel is shown for the first time).
+
+Usage:
+  python2 icontags_importtime.py --zim /path/to/zim-0.67
+'''
+
+import os
+import sys
+import argparse
+import __builtin__
+
+from timeit import default_timer as timer
+
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # '0.67'
+
+
+class ImportTimer(object):
+    '''Hook for '__import__' which measures new imported modules.'''
+
+    def __init__(self, file = sys.stderr):
+        self.file = file
+        self._import = None
+        self._level = 0
+        self._children = [0.0] # stack of cumulative times of nested imports
+
+    def install(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self
+        self.file.write('import time: self [us] | cumulative | imported package\n')
+
+    def uninstall(self):
+        __builtin__.__import__ = self._import
+
+    def __call__(self, name, globals = None, locals = None, fromlist = None, level = -1):
+        known = set(sys.modules)
+        self._level += 1
+        self._children.append(0.0)
+        start = timer()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = timer() - start
+            nested = self._children.pop()
+            self._level -= 1
+            self._children[-1] += cumulative
+            module = self._get_imported(name, globals, fromlist, known)
+            if module:
+                self.file.write('import time: %9i | %10i | %s%s\n' % (
+                    (cumulative - nested) * 1e6, cumulative * 1e6, '  ' * self._level, module))
+
+    def _get_imported(self, name, globals, fromlist, known):
+        '''Return the name of the new module imported by the statement or None.'''
+        globals = globals or {}
+        package = globals.get('__package__')
+        if not package and '__name__' in globals:
+            package = globals['__name__'] if '__path__' in globals \
+                else globals['__name__'].rpartition('.')[0]
+
+        names = [name] if name else list(fromlist or ())
+        for candidate in names:
+            # Relative names are tried first like python 2 does.
+            for module in (package + '.' + candidate if package else None, candidate):
+                if module and module not in known and sys.modules.get(module) is not None:
+                    return module
+        return None
+
+
+def measure(label, func):
+    start = timer()
+    result = func()
+    sys.stderr.write('%-32s %10.1f ms\n' % (label, (timer() - start) * 1e3))
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'Startup cost of the IconTags plugin.')
+    parser.add_argument('--zim', help = 'folder with zim 0.67 sources if zim is not installed')
+    options = parser.parse_args(argv)
+
+    if options.zim:
+        sys.path.insert(0, options.zim)
+    sys.path.insert(0, PLUGIN_DIR)
+
+    # Modules which are already loaded by a running Zim.
+    import gtk
+    import zim
+    import zim.plugins
+    import zim.actions
+    import zim.gui.widgets
+    import zim.gui.pageindex
+    import zim.notebook
+    if not hasattr(__builtin__, '_'):
+        import gettext
+        gettext.install('zim', unicode = True)
+
+    hook = ImportTimer()
+    hook.install()
+    try:
+        start = timer()
+        import icontags
+        total = timer() - start
+    finally:
+        hook.uninstall()
+
+    sys.stderr.write('\n%-32s %10.1f ms\n' % ('import icontags', total * 1e3))
+    measure('import panel widgets', lambda: __import__('icontags.panelview'))
+    from icontags.iconutils import ICONS
+    measure('names of icons', lambda: 'apply' in ICONS)
+    measure('images of icons', lambda: ICONS.get('apply'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))